@@ -0,0 +1,60 @@
+"""Training step of CRNS_NET under activation checkpointing settings: peak memory against step time.
+
+    python -m benchmarks.bench_activation_checkpointing --img-size 512 --batch-size 8
+
+A step is forward, cross-entropy loss and backward. ``peak_mb`` is the peak memory of one step (see
+common.memory_fn), ``memory_saved`` and ``slowdown`` are relative to the step without checkpointing.
+"""
+import argparse
+
+import torch
+import torch.nn.functional as F
+
+from benchmarks.common import memory_fn, print_results, time_fn
+from networks.CRNS_NET import CRNS_NET
+
+# name -> (granularity, up_blocks), encoder checkpointing alone and together with every UpBlock
+SETTINGS = {
+    'none': (None, None),
+    'encoder_block': ('block', ()),
+    'encoder_stage': ('stage', ()),
+    'block': ('block', None),
+    'stage': ('stage', None),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--settings', nargs='+', default=list(SETTINGS), choices=list(SETTINGS))
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=2)
+    parser.add_argument('--n-classes', type=int, default=3)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--iters', type=int, default=3)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    net = CRNS_NET(args.n_classes, pretrained=None).to(args.device).train()
+    images = torch.randn(args.batch_size, 3, args.img_size, args.img_size, device=args.device)
+    labels = torch.randint(0, args.n_classes, (args.batch_size, args.img_size, args.img_size), device=args.device)
+
+    def step():
+        net.zero_grad(set_to_none=True)
+        F.cross_entropy(net(images), labels).backward()
+
+    results = {}
+    for name in args.settings:
+        granularity, up_blocks = SETTINGS[name]
+        net.set_activation_checkpointing(granularity, up_blocks=up_blocks)
+        stats = time_fn(step, warmup=1, iters=args.iters, device=args.device)
+        stats.update(memory_fn(step, args.device))
+        if 'checkpoint/none' in results:
+            stats['memory_saved'] = 1 - stats['peak_mb'] / results['checkpoint/none']['peak_mb']
+            stats['slowdown'] = stats['median_ms'] / results['checkpoint/none']['median_ms']
+        results[f'checkpoint/{name}'] = stats
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
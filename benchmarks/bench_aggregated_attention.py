@@ -0,0 +1,62 @@
+"""AggregatedAttention (native backend): chunked execution against the single pass on large stage-1 maps.
+
+    python -m benchmarks.bench_aggregated_attention --sizes 56 128 248 --chunk-sizes 4096 16384
+
+Sizes are stage-1 grid sides (input side / 4, e.g. 248 for 992px inputs). Each case reports latency, the memory of
+one forward (see common.memory_fn) and the max abs difference to the single pass.
+"""
+import argparse
+
+import torch
+
+from benchmarks.common import memory_fn, print_results, time_fn
+from benchmarks.reference import max_abs_diff
+from networks.attention_native import AggregatedAttention
+from networks.transnext import get_relative_position_cpb
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=96)
+    parser.add_argument('--num-heads', type=int, default=4)
+    parser.add_argument('--sr-ratio', type=int, default=8)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[56, 128, 248])
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[4096, 16384])
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    module = AggregatedAttention(args.dim, (56, 56), num_heads=args.num_heads, window_size=3,
+                                 sr_ratio=args.sr_ratio).to(args.device).eval()
+    results = {}
+    with torch.inference_mode():
+        for size in args.sizes:
+            pool_size = (size // args.sr_ratio, size // args.sr_ratio)
+            relative_pos_index, relative_coords_table = get_relative_position_cpb(
+                (size, size), pool_size, pretrain_size=(56, 56), device=args.device)
+            x = torch.randn(args.batch_size, size * size, args.dim, device=args.device)
+
+            def run():
+                return module(x, size, size, relative_pos_index, relative_coords_table)
+
+            module.chunk_size = None
+            expected = run()
+            full = time_fn(run, iters=args.iters, device=args.device)
+            full.update(memory_fn(run, args.device))
+            results[f'aggregated_attention/full/{size}x{size}'] = full
+            for chunk_size in args.chunk_sizes:
+                module.chunk_size = chunk_size
+                chunked = time_fn(run, iters=args.iters, device=args.device)
+                chunked.update(memory_fn(run, args.device))
+                chunked['speedup'] = full['median_ms'] / chunked['median_ms']
+                chunked['max_abs_diff'] = max_abs_diff(run(), expected)
+                results[f'aggregated_attention/chunk{chunk_size}/{size}x{size}'] = chunked
+            module.chunk_size = None
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
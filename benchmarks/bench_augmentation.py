@@ -0,0 +1,51 @@
+"""Per-sample RandomGenerator against BatchRandomGenerator on one collated batch.
+
+    python -m benchmarks.bench_augmentation --batch-size 8 --size 256 --output-size 224
+
+The per-sample path is what DataLoader workers run today (summed over the batch, i.e. single worker);
+the batch path runs on --device (default cuda if available).
+"""
+import argparse
+import random
+
+import numpy as np
+import torch
+
+from benchmarks.common import print_results, time_fn
+from utils.batch_augment import BatchRandomGenerator
+from utils.get_datasets import RandomGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--output-size', type=int, default=224)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    random.seed(0)
+    np.random.seed(0)
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (args.batch_size, args.size, args.size, 3), dtype=np.uint8)
+    labels = rng.integers(0, 3, (args.batch_size, args.size, args.size), dtype=np.uint8)
+    output_size = [args.output_size, args.output_size]
+
+    per_sample = RandomGenerator(output_size)
+    batched = BatchRandomGenerator(output_size)
+    batch = {'image': torch.from_numpy(images).to(args.device), 'label': torch.from_numpy(labels).to(args.device)}
+
+    results = {
+        'augment/per_sample': time_fn(lambda: [per_sample({'image': images[i], 'label': labels[i]})
+                                               for i in range(args.batch_size)], iters=args.iters),
+        f'augment/batched/{args.device}': time_fn(lambda: batched(batch), iters=args.iters, device=args.device),
+    }
+    for stats in results.values():
+        stats['samples_per_s'] = args.batch_size / stats['median_ms'] * 1000
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
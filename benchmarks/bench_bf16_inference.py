@@ -0,0 +1,58 @@
+"""bf16 autocast CPU inference of CRNS_NET against fp32: latency, Dice drift and max logit difference.
+
+    python -m benchmarks.bench_bf16_inference --pretrained <ckpt> --base-dir <npz dir> --list-dir <list dir> \
+        --split test
+
+Samples come from a GetDatasets split (random synthetic samples without --base-dir). ``dice_vs_fp32`` is the Dice of
+the bf16 predictions against the fp32 ones, ``dice_drift`` the change of the Dice against the labels. Without
+--pretrained the backbone keeps its random initialisation, which only makes the label Dice meaningless.
+"""
+import argparse
+
+import torch
+
+from benchmarks.common import label_dice, load_samples, print_results, time_fn
+from benchmarks.reference import max_abs_diff
+from networks.CRNS_NET import CRNS_NET
+from networks.cpu_inference import cpu_inference, prediction_dice
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-dir', default=None)
+    parser.add_argument('--list-dir', default=None)
+    parser.add_argument('--split', default='test')
+    parser.add_argument('--n-samples', type=int, default=8)
+    parser.add_argument('--n-classes', type=int, default=3)
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--pretrained', default=None)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    images, labels = load_samples(args.base_dir, args.list_dir, args.split, args.n_samples, args.img_size)
+
+    net = CRNS_NET(args.n_classes, pretrained=args.pretrained)
+    results = {}
+    logits = {}
+    for name, dtype in [('fp32', None), ('bf16', torch.bfloat16)]:
+        with cpu_inference(net, num_threads=args.threads, dtype=dtype) as model:
+            batch = images[:args.batch_size]
+            stats = time_fn(lambda: model(batch), warmup=1, iters=args.iters)
+            stats['images_per_s'] = len(batch) / stats['median_ms'] * 1000
+            logits[name] = torch.cat([model(images[i:i + args.batch_size]).float()
+                                      for i in range(0, len(images), args.batch_size)])
+        stats['dice'] = label_dice(logits[name], labels).mean().item()
+        results[f'bf16_inference/{name}'] = stats
+    bf16 = results['bf16_inference/bf16']
+    bf16['speedup'] = results['bf16_inference/fp32']['median_ms'] / bf16['median_ms']
+    bf16['dice_drift'] = bf16['dice'] - results['bf16_inference/fp32']['dice']
+    bf16['dice_vs_fp32'] = prediction_dice(logits['fp32'], logits['bf16']).min().item()
+    bf16['max_abs_diff'] = max_abs_diff(logits['fp32'], logits['bf16'])
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
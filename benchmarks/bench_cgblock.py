@@ -0,0 +1,59 @@
+"""CGblock: fused NCHW cosine-similarity path against the original permute/reshape implementation.
+
+    python -m benchmarks.bench_cgblock --sizes 224 512 1000 --batch-size 1
+
+CGblock runs on the full-resolution 48-channel decoder map. Each case reports latency, the memory of one forward
+(see common.memory_fn) and the max abs difference between the two outputs. A last case checks that a training
+step with a frozen text branch still runs after an inference_mode forward has cached the text weight.
+"""
+import argparse
+
+import torch
+
+from benchmarks.common import memory_fn, print_results, time_fn
+from benchmarks.reference import cgblock_forward, max_abs_diff
+from networks.ImageBranch import CGblock
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--in-channels', type=int, default=48)
+    parser.add_argument('--n-classes', type=int, default=3)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[224, 512, 1000])
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--channels-last', action='store_true')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    module = CGblock(args.in_channels, args.n_classes).to(args.device).eval()
+    x_text = torch.randn(args.n_classes, 768, device=args.device)
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
+    results = {}
+    with torch.inference_mode():
+        for size in args.sizes:
+            x = torch.randn(args.batch_size, args.in_channels, size, size,
+                            device=args.device).to(memory_format=memory_format)
+            reference = time_fn(lambda: cgblock_forward(module, x, x_text), iters=args.iters, device=args.device)
+            reference.update(memory_fn(lambda: cgblock_forward(module, x, x_text), args.device))
+            fused = time_fn(lambda: module(x, x_text), iters=args.iters, device=args.device)
+            fused.update(memory_fn(lambda: module(x, x_text), args.device))
+            fused['speedup'] = reference['median_ms'] / fused['median_ms']
+            fused['max_abs_diff'] = max_abs_diff(module(x, x_text), cgblock_forward(module, x, x_text))
+            results[f'cgblock/reference/{size}x{size}'] = reference
+            results[f'cgblock/fused/{size}x{size}'] = fused
+
+    # frozen text branch: the cached weight must not be the inference tensor of the forward above
+    module.train().text.requires_grad_(False)
+    module.logit_scale.requires_grad_(False)
+    with torch.inference_mode():
+        module(x, x_text)
+    module(x.clone().requires_grad_(), x_text).sum().backward()
+    results['cgblock/frozen_text_backward'] = {'ok': 1}
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Cold start of ImageBranch from the original pretrained checkpoint against the converted, memory-mapped one.
+
+    python -m benchmarks.bench_cold_start --src pretrained_ckpt/transnext_base_224_1k.pth
+    python -m benchmarks.bench_cold_start            # synthetic TransNeXt-Base checkpoint in a temp dir
+
+Every run is a fresh interpreter, as a new worker would be. Reported per checkpoint: import time, construction
+time of ImageBranch(pretrained=...) and the peak resident memory of the process.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import torch
+
+from benchmarks.common import print_results
+from utils.convert_checkpoint import convert_checkpoint
+
+WORKER = '''
+import json, resource, time
+start = time.perf_counter()
+from networks.ImageBranch import ImageBranch
+imported = time.perf_counter()
+model = ImageBranch(pretrained={path!r})
+built = time.perf_counter()
+print(json.dumps({{'import_s': imported - start, 'construct_s': built - imported,
+                  'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+'''
+
+
+def make_synthetic_checkpoint(path):
+    # same keys as the released checkpoint would present to the loader: the encoder's, plus a classifier head
+    from networks.transnext import transnext_base
+
+    state_dict = transnext_base().state_dict()
+    state_dict['head.weight'] = torch.randn(1000, 768)
+    state_dict['head.bias'] = torch.zeros(1000)
+    torch.save(state_dict, path)
+
+
+def cold_start(path, repeats):
+    runs = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', WORKER.format(path=path)], capture_output=True, text=True,
+                             check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    # best of the repeats, the first run also pays for a cold page cache
+    return {key: min(run[key] for run in runs) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src', default=None, help='original checkpoint, a synthetic one is written otherwise')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = args.src
+        if src is None:
+            src = os.path.join(tmp, 'transnext_base_224_1k.pth')
+            make_synthetic_checkpoint(src)
+        dst = os.path.join(tmp, 'transnext_base_224_1k_backbone.pth')
+        convert_checkpoint(src, dst)
+        results = {'cold_start/original': cold_start(src, args.repeats),
+                   'cold_start/converted': cold_start(dst, args.repeats)}
+    results['cold_start/converted']['speedup'] = (results['cold_start/original']['construct_s'] /
+                                                  results['cold_start/converted']['construct_s'])
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Batch size in bytes and DataLoader throughput with float32 samples against compact uint8 samples.
+
+    python -m benchmarks.bench_compact_loader --workers 4 --batch-size 16
+"""
+import argparse
+import tempfile
+import time
+
+from torch.utils.data import DataLoader
+
+from benchmarks.common import make_synthetic_split, print_results
+from utils.get_datasets import GetDatasets, RandomGenerator
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-samples', type=int, default=64)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--output-size', type=int, default=224)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir, list_dir = make_synthetic_split(tmp, 'train', args.n_samples, args.size)
+        for compact in [False, True]:
+            transform = RandomGenerator([args.output_size, args.output_size], compact=compact)
+            dataset = GetDatasets(base_dir, list_dir, 'train', transform=transform)
+            loader = DataLoader(dataset, batch_size=args.batch_size, num_workers=args.workers,
+                                pin_memory=False)
+            start = time.perf_counter()
+            batch_bytes = 0
+            for batch in loader:
+                batch_bytes = max(batch_bytes, batch['image'].nbytes + batch['label'].nbytes)
+            elapsed = time.perf_counter() - start
+            results['loader/' + ('compact_uint8' if compact else 'float32')] = {
+                'samples_per_s': len(dataset) / elapsed, 'batch_mb': batch_bytes / 2 ** 20}
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Decoder of CRNS_NET with the BatchNorms folded into the convolutions (CRNS_NET.fuse_conv_bn) against unfused.
+
+    python -m benchmarks.bench_conv_bn_fusion --sizes 224 512 1024 --batch-size 1
+
+The encoder features are computed once per size and only the decoder (Bridge, UpBlocks, CGblock, output conv) is
+timed. Each case also reports the max abs difference between the fused and unfused logits.
+"""
+import argparse
+
+import torch
+
+from benchmarks.common import print_results, time_fn
+from benchmarks.reference import max_abs_diff
+from networks.CRNS_NET import CRNS_NET
+
+
+def decoder_forward(branch, x, downsample, x_text):
+    # ImageBranch.forward after the encoder
+    x = branch.bridge(x)
+    for i, block in enumerate(branch.up_blocks):
+        x = block(x, downsample[3 - i])
+    return branch.out(branch.cgblock(x, x_text))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[224, 512, 1024])
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--channels-last', action='store_true')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    net = CRNS_NET(3, pretrained=None).to(args.device).eval()
+    branch = net.backbone
+    x_text = net.organ_embedding.relu()
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
+    results = {}
+    with torch.inference_mode():
+        for size in args.sizes:
+            image = torch.randn(args.batch_size, 3, size, size, device=args.device)
+            x, downsample = branch.encoder(image)
+            x, downsample = x.to(memory_format=memory_format), [d.to(memory_format=memory_format) for d in downsample]
+
+            branch.fuse_conv_bn(False)
+            reference = decoder_forward(branch, x, downsample, x_text)
+            unfused = time_fn(lambda: decoder_forward(branch, x, downsample, x_text), iters=args.iters,
+                              device=args.device)
+            branch.fuse_conv_bn()
+            fused = time_fn(lambda: decoder_forward(branch, x, downsample, x_text), iters=args.iters,
+                            device=args.device)
+            fused['speedup'] = unfused['median_ms'] / fused['median_ms']
+            fused['max_abs_diff'] = max_abs_diff(decoder_forward(branch, x, downsample, x_text), reference)
+            results[f'conv_bn_fusion/unfused/{size}x{size}'] = unfused
+            results[f'conv_bn_fusion/fused/{size}x{size}'] = fused
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""CPU inference throughput of CRNS_NET over a grid of thread settings and batch sizes.
+
+    python -m benchmarks.bench_cpu_inference --threads 1 4 8 --interop-threads 1 --batch-sizes 1 4 8
+
+The inter-op pool can only be configured once per process, run one invocation per inter-op setting.
+Without --pretrained the backbone keeps its random initialisation, which does not change the cost.
+"""
+import argparse
+
+import torch
+
+from benchmarks.common import print_results, time_fn
+from networks.CRNS_NET import CRNS_NET
+from networks.cpu_inference import cpu_inference
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, nargs='+', default=[torch.get_num_threads()])
+    parser.add_argument('--interop-threads', type=int, default=None)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--pretrained', default=None)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    net = CRNS_NET(3, pretrained=args.pretrained)
+    results = {}
+    for num_threads in args.threads:
+        with cpu_inference(net, num_threads=num_threads, num_interop_threads=args.interop_threads) as model:
+            for batch_size in args.batch_sizes:
+                x = torch.randn(batch_size, 3, args.img_size, args.img_size)
+                stats = time_fn(lambda: model(x), warmup=1, iters=args.iters)
+                stats['images_per_s'] = batch_size / stats['median_ms'] * 1000
+                stats['interop_threads'] = torch.get_num_interop_threads()
+                results[f"cpu_inference/threads{num_threads}/bs{batch_size}"] = stats
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Samples/s of GetDatasets with the per-file npz backend against the packed memmap backend.
+
+    python -m benchmarks.bench_dataset_backends --base-dir <npz dir> --list-dir <lists> --split test_vol
+    python -m benchmarks.bench_dataset_backends            # synthetic 224x224 split in a temp dir
+
+Each backend is read once directly and once through a DataLoader with --workers workers.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from torch.utils.data import DataLoader
+
+from benchmarks.common import make_synthetic_split, print_results
+from utils.get_datasets import GetDatasets
+from utils.pack_dataset import pack_split
+
+
+def samples_per_s(dataset, workers, batch_size):
+    start = time.perf_counter()
+    if workers is None:
+        for i in range(len(dataset)):
+            dataset[i]
+    else:
+        for _ in DataLoader(dataset, batch_size=batch_size, num_workers=workers):
+            pass
+    return len(dataset) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-dir', default=None)
+    parser.add_argument('--list-dir', default=None)
+    parser.add_argument('--split', default='test_vol')
+    parser.add_argument('--packed-dir', default=None, help='existing packed shards, packed into a temp dir otherwise')
+    parser.add_argument('--n-samples', type=int, default=64, help='size of the synthetic split')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir, list_dir = args.base_dir, args.list_dir
+        if base_dir is None:
+            base_dir, list_dir = make_synthetic_split(tmp, args.split, args.n_samples)
+        packed_dir = args.packed_dir
+        if packed_dir is None:
+            packed_dir = os.path.join(tmp, 'packed')
+            pack_split(base_dir, list_dir, args.split, packed_dir)
+
+        results = {}
+        for backend in ['npz', 'packed']:
+            dataset = GetDatasets(base_dir, list_dir, args.split, backend=backend, packed_dir=packed_dir)
+            for workers in [None, args.workers]:
+                name = f"dataset/{backend}/" + ('direct' if workers is None else f'workers{workers}')
+                results[name] = {'samples_per_s': samples_per_s(dataset, workers, args.batch_size),
+                                 'samples': len(dataset)}
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
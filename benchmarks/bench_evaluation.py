@@ -0,0 +1,128 @@
+"""Throughput of the Dice / AJI / PQ evaluator (utils/evaluation.py) and parity with the per-instance loops.
+
+    python -m benchmarks.bench_evaluation --n-cases 16 --workers 1 4
+
+Small synthetic cases (including empty ones and arbitrary ground-truth labels) are first checked against
+benchmarks/reference.py (exit code 1 on a mismatch); in the cases of well-separated nuclei the reference gets
+ground-truth instances from ndimage.label, independently of the watershed that evaluate_case derives them with.
+Then a synthetic test split of 1000x1000 labels with noisy logits is evaluated; the reference is timed on one small
+case for comparison.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from scipy import ndimage
+
+from benchmarks.bench_instance_extraction import make_output
+from benchmarks.common import print_results
+from benchmarks.reference import instance_metrics_reference
+from utils.evaluation import evaluate, evaluate_case, instance_metrics, relabel_sequential
+from utils.get_datasets import GetDatasets
+from utils.instances import BACKGROUND, EDGE, NUCLEUS, extract_instances
+
+INSTANCE_METRICS = ['aji', 'dq', 'sq', 'pq', 'tp', 'fp', 'fn']
+
+
+def parity_cases(rng, n_cases, size):
+    # (true instances, predicted instances) pairs, the true labels shuffled to non-sequential values
+    cases = [(np.zeros((size, size), np.int32), np.zeros((size, size), np.int32))]
+    for _ in range(n_cases):
+        label, logits = make_output(size, int(rng.integers(1, 12)), float(rng.uniform(4, 10)), rng)
+        true = extract_instances(label, min_size=1, marker_erosion=0)
+        shuffled = np.concatenate([[0], rng.permutation(np.arange(1, true.max() + 1)) * 7])
+        cases.append((shuffled[true], extract_instances(logits, min_size=4)))
+    cases.append((cases[-1][0], np.zeros((size, size), np.int32)))
+    cases.append((np.zeros((size, size), np.int32), cases[-2][1]))
+    return cases
+
+
+def separated_case(size, radius, rng):
+    # (class map, noisy logits) of nuclei on a jittered grid, far enough apart that no two of them touch
+    spacing = int(4 * radius)
+    centers = np.stack(np.meshgrid(np.arange(spacing // 2, size, spacing), np.arange(spacing // 2, size, spacing)),
+                       -1).reshape(-1, 2)
+    centers = centers[rng.random(len(centers)) < 0.7]
+    centers = centers + rng.integers(-int(radius // 2), int(radius // 2) + 1, centers.shape)
+    rows, cols = np.ogrid[:size, :size]
+    distance = np.full((size, size), np.inf)
+    for y, x in centers:
+        distance = np.minimum(distance, np.hypot(rows - y, cols - x))
+    class_map = np.full((size, size), BACKGROUND, np.uint8)
+    class_map[distance < radius] = EDGE
+    class_map[distance < radius - 2] = NUCLEUS
+    logits = np.eye(3, dtype=np.float32)[class_map].transpose(2, 0, 1) * 4
+    logits += rng.normal(0, 1, logits.shape).astype(np.float32)
+    return class_map, logits
+
+
+def metric_diff(value, reference):
+    if np.isnan(value) or np.isnan(reference):
+        return 0. if np.isnan(value) and np.isnan(reference) else np.inf
+    return abs(value - reference)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-cases', type=int, default=16)
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--n-nuclei', type=int, default=600)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--parity-cases', type=int, default=20)
+    parser.add_argument('--parity-size', type=int, default=64)
+    parser.add_argument('--reference-size', type=int, default=256)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    results = {}
+    worst = 0.
+    for true, pred in parity_cases(rng, args.parity_cases, args.parity_size):
+        metrics, reference = instance_metrics(relabel_sequential(true), pred), instance_metrics_reference(true, pred)
+        worst = max([worst] + [metric_diff(metrics[name], reference[name]) for name in INSTANCE_METRICS])
+    for _ in range(args.parity_cases):
+        class_map, logits = separated_case(args.parity_size, float(rng.uniform(3, 7)), rng)
+        metrics = evaluate_case(logits, class_map, min_size=4)
+        reference = instance_metrics_reference(ndimage.label(class_map != BACKGROUND)[0],
+                                               extract_instances(logits, min_size=4))
+        worst = max([worst] + [metric_diff(metrics[name], reference[name]) for name in INSTANCE_METRICS])
+    results['evaluation/parity'] = {'cases': 2 * args.parity_cases + 3, 'max_abs_diff': worst}
+
+    _, logits = make_output(args.reference_size, args.n_nuclei * args.reference_size ** 2 // args.size ** 2, 12, rng)
+    label, _ = make_output(args.reference_size, args.n_nuclei * args.reference_size ** 2 // args.size ** 2, 12, rng)
+    true, pred = extract_instances(label, min_size=1, marker_erosion=0), extract_instances(logits)
+    for name, fn in [('vectorized', instance_metrics), ('reference', instance_metrics_reference)]:
+        start = time.perf_counter()
+        fn(true, pred)
+        results[f'evaluation/instance_metrics/{name}/{args.reference_size}px'] = {
+            'ms': (time.perf_counter() - start) * 1e3, 'instances': int(true.max())}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'lists'))
+        outputs = {}
+        for i in range(args.n_cases):
+            label, logits = make_output(args.size, args.n_nuclei, 12, rng)
+            name = f'test_case{i:03d}'
+            np.savez(os.path.join(tmp, name + '.npz'), image=np.zeros(label.shape + (3,), np.uint8), label=label)
+            # a prediction from a slightly shifted ground truth
+            outputs[name] = np.roll(logits, 2, axis=2)
+        with open(os.path.join(tmp, 'lists', 'test.txt'), 'w') as f:
+            f.write('\n'.join(outputs) + '\n')
+        dataset = GetDatasets(tmp, os.path.join(tmp, 'lists'), 'test')
+        for workers in args.workers:
+            start = time.perf_counter()
+            _, summary = evaluate(outputs, dataset, num_workers=workers)
+            elapsed = time.perf_counter() - start
+            results[f'evaluation/{args.size}px/workers{workers}'] = {
+                'cases_per_s': args.n_cases / elapsed, **{k: summary[k] for k in ['dice', 'aji', 'pq']}}
+    print_results(results, args.json)
+    if worst > 1e-9:
+        print(f'Mismatch with the reference implementation: {worst:.3g}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Exported CRNS_NET graphs (networks/export.py) against the eager model: latency and max abs difference.
+
+    python -m benchmarks.bench_export --formats torchscript onnx --img-size 224 --batch-size 1
+
+The ONNX graph is run with onnxruntime on the CPU (skipped when it is not installed). Without --pretrained the
+backbone keeps its random initialisation, which does not change the cost.
+"""
+import argparse
+import os
+import tempfile
+
+import torch
+
+from benchmarks.common import print_results, time_fn
+from benchmarks.reference import max_abs_diff
+from networks.CRNS_NET import CRNS_NET
+from networks.export import EXPORT_FORMATS, export_crns_net, load_exported, prepare_for_export
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--formats', nargs='+', default=list(EXPORT_FORMATS), choices=EXPORT_FORMATS)
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--pretrained', default=None)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    net = CRNS_NET(3, pretrained=args.pretrained).cpu().eval()
+    x = torch.randn(args.batch_size, 3, args.img_size, args.img_size)
+    results = {}
+    with torch.inference_mode():
+        eager = prepare_for_export(net)
+        reference = eager(x)
+        results['export/eager'] = time_fn(lambda: eager(x), iters=args.iters)
+    with tempfile.TemporaryDirectory() as tmp:
+        for format in args.formats:
+            path = os.path.join(tmp, 'crns_net.onnx' if format == 'onnx' else 'crns_net.pt')
+            export_crns_net(net, path, x, format=format, check=False)
+            try:
+                exported = load_exported(path, format)
+            except ImportError:
+                print(f"Skipping {format}: onnxruntime is not installed.")
+                continue
+            with torch.inference_mode():
+                stats = time_fn(lambda: exported(x), iters=args.iters)
+                stats['speedup'] = results['export/eager']['median_ms'] / stats['median_ms']
+                stats['max_abs_diff'] = max_abs_diff(exported(x), reference)
+            results[f'export/{format}'] = stats
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
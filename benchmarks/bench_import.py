@@ -0,0 +1,50 @@
+"""Import time of the model modules, each measured in a fresh interpreter with ``python -X importtime``.
+
+    python -m benchmarks.bench_import --modules networks.CRNS_NET --repeats 5
+
+Reports the cumulative import time of every module listed and of its heaviest dependencies (--top).
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import print_results
+
+
+def import_times(module):
+    # -X importtime writes "import time: self [us] | cumulative | imported package" lines to stderr
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True,
+                         text=True, check=True)
+    times = {}
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=['networks.CRNS_NET'])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='heaviest top-level dependencies reported per module')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeats)]
+        total = [run[module] for run in runs]
+        results[f'import/{module}'] = {'median_ms': statistics.median(total), 'min_ms': min(total),
+                                       'iters': args.repeats}
+        dependencies = {name: statistics.median(run.get(name, 0.) for run in runs) for name in runs[0]
+                        if name != module and '.' not in name}
+        for name in sorted(dependencies, key=dependencies.get, reverse=True)[:args.top]:
+            results[f'import/{module}/{name}'] = {'median_ms': dependencies[name]}
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
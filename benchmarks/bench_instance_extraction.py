@@ -0,0 +1,103 @@
+"""Throughput of the nucleus instance extraction (utils/instances.py) on synthetic 1000x1000 outputs.
+
+    python -m benchmarks.bench_instance_extraction --n-images 32 --workers 1 4 8
+
+Synthetic nuclei are overlapping disks with an edge ring and edges along their contacts, given to the extraction
+as noisy (3, H, W) logits and as class maps; the large case reads logits from an np.memmap as SlidingWindowInferer
+writes them. Every extracted instance is checked to be a single connected component, also on small nuclei that
+the marker erosion removes (exit code 1 otherwise).
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+import numpy as np
+from scipy import ndimage
+
+from benchmarks.common import print_results
+from utils.instances import BACKGROUND, EDGE, NUCLEUS, extract_instances, extract_instances_batch
+
+
+def make_output(size, n_nuclei, radius, rng):
+    # (class map, logits) with nuclei at random centers; pixels closer to another center than to their own nucleus
+    # center border on that nucleus, the contact line becomes edge
+    seeds = np.ones((size, size), bool)
+    seeds[rng.integers(0, size, n_nuclei), rng.integers(0, size, n_nuclei)] = False
+    distance, (rows, cols) = ndimage.distance_transform_edt(seeds, return_indices=True)
+    nearest = rows * size + cols
+    contact = np.zeros_like(seeds)
+    contact[:, 1:] |= nearest[:, 1:] != nearest[:, :-1]
+    contact[1:, :] |= nearest[1:, :] != nearest[:-1, :]
+    class_map = np.full((size, size), BACKGROUND, np.uint8)
+    class_map[distance < radius] = EDGE
+    class_map[(distance < radius - 2) & ~contact] = NUCLEUS
+    logits = np.eye(3, dtype=np.float32)[class_map].transpose(2, 0, 1) * 4
+    logits += rng.normal(0, 1, logits.shape).astype(np.float32)
+    return class_map, logits
+
+
+def count_fragmented(instances):
+    # instances made of more than one connected component (same connectivity as the labelling)
+    fragmented = 0
+    for i, region in enumerate(ndimage.find_objects(instances), 1):
+        if region is not None and ndimage.label(instances[region] == i)[1] > 1:
+            fragmented += 1
+    return fragmented
+
+
+def throughput(fn, n_images, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        instances = fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    return {'images_per_s': n_images / elapsed, 'ms_per_image': elapsed / n_images * 1e3,
+            'instances_per_image': float(np.mean([labels.max() for labels in instances]))}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-images', type=int, default=16)
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--n-nuclei', type=int, default=600)
+    parser.add_argument('--radius', type=float, default=12)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--large-size', type=int, default=4000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    outputs = [make_output(args.size, args.n_nuclei, args.radius, rng) for _ in range(args.n_images)]
+    class_maps = np.stack([class_map for class_map, _ in outputs])
+    logits = np.stack([logit for _, logit in outputs])
+
+    results = {}
+    for workers in args.workers:
+        for name, batch in [('logits', logits), ('class_map', class_maps)]:
+            results[f'instances/{name}/{args.size}px/workers{workers}'] = throughput(
+                lambda: extract_instances_batch(batch, num_workers=workers), args.n_images, args.repeat)
+
+    if args.large_size:
+        n_nuclei = int(args.n_nuclei * (args.large_size / args.size) ** 2)
+        _, large = make_output(args.large_size, n_nuclei, args.radius, rng)
+        with tempfile.NamedTemporaryFile(suffix='.dat') as f:
+            memmap = np.memmap(f.name, np.float32, 'w+', shape=large.shape)
+            memmap[...] = large
+            memmap.flush()
+            results[f'instances/memmap_logits/{args.large_size}px'] = throughput(
+                lambda: [extract_instances(memmap)], 1, args.repeat)
+
+    thin = [make_output(256, 200, float(rng.uniform(2, 6)), rng)[1] for _ in range(4)]
+    fragmented = sum(count_fragmented(instances) for instances in
+                     extract_instances_batch(list(logits[:4]) + list(class_maps[:4]) + thin, num_workers=1))
+    results['instances/connectivity'] = {'fragmented': fragmented}
+    print_results(results, args.json)
+    if fragmented:
+        print(f'{fragmented} instances are not connected', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
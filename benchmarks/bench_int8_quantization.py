@@ -0,0 +1,68 @@
+"""Dynamic INT8 CRNS_NET (networks/quantization.py) against the float model on the CPU: size, latency and Dice.
+
+    python -m benchmarks.bench_int8_quantization --pretrained <ckpt> --base-dir <npz dir> --list-dir <list dir>
+
+Samples come from a GetDatasets split (random synthetic samples without --base-dir). ``size_mb`` is the size of the
+serialized state dict, ``dice_delta`` the change of the Dice against the labels and ``dice_vs_float`` the Dice of the
+INT8 predictions against the float ones. Without --pretrained the label Dice is meaningless.
+"""
+import argparse
+import io
+
+import torch
+
+from benchmarks.common import label_dice, load_samples, print_results, time_fn
+from benchmarks.reference import max_abs_diff
+from networks.CRNS_NET import CRNS_NET
+from networks.cpu_inference import cpu_inference, prediction_dice
+from networks.quantization import get_quantized_linear_names, quantize_dynamic_int8
+
+
+def state_dict_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-dir', default=None)
+    parser.add_argument('--list-dir', default=None)
+    parser.add_argument('--split', default='test')
+    parser.add_argument('--n-samples', type=int, default=8)
+    parser.add_argument('--n-classes', type=int, default=3)
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--engine', default=None)
+    parser.add_argument('--pretrained', default=None)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    images, labels = load_samples(args.base_dir, args.list_dir, args.split, args.n_samples, args.img_size)
+    net = CRNS_NET(args.n_classes, pretrained=args.pretrained).eval()
+    models = {'float': net, 'int8': quantize_dynamic_int8(net, args.engine)}
+    results = {}
+    logits = {}
+    for name, model in models.items():
+        with cpu_inference(model, num_threads=args.threads) as model:
+            batch = images[:args.batch_size]
+            stats = time_fn(lambda: model(batch), warmup=1, iters=args.iters)
+            stats['ms_per_image'] = stats['median_ms'] / len(batch)
+            logits[name] = torch.cat([model(images[i:i + args.batch_size])
+                                      for i in range(0, len(images), args.batch_size)])
+        stats['size_mb'] = state_dict_mb(model)
+        stats['dice'] = label_dice(logits[name], labels).mean().item()
+        results[f'int8_quantization/{name}'] = stats
+    int8 = results['int8_quantization/int8']
+    int8['quantized_linears'] = len(get_quantized_linear_names(net))
+    int8['speedup'] = results['int8_quantization/float']['median_ms'] / int8['median_ms']
+    int8['dice_delta'] = int8['dice'] - results['int8_quantization/float']['dice']
+    int8['dice_vs_float'] = prediction_dice(logits['float'], logits['int8']).min().item()
+    int8['max_abs_diff'] = max_abs_diff(logits['float'], logits['int8'])
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Per-stage profile of one CRNS_NET forward (networks/profiling.py): summary table and optional Chrome trace.
+
+    python -m benchmarks.bench_profile_stages --img-size 1024 --batch-size 2 --trace trace.json
+
+--no-counters skips the FLOP and memory counting, whose per-operator overhead is included in the wall times.
+"""
+import argparse
+import json
+
+import torch
+
+from networks.CRNS_NET import CRNS_NET
+from networks.profiling import profile_stages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--pretrained', default=None)
+    parser.add_argument('--no-counters', action='store_true')
+    parser.add_argument('--trace', default=None)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    net = CRNS_NET(3, pretrained=args.pretrained).to(args.device).eval()
+    x = torch.randn(args.batch_size, 3, args.img_size, args.img_size, device=args.device)
+    with torch.inference_mode():
+        net(x)  # builds the per-resolution caches
+        with profile_stages(net, flops=not args.no_counters, memory=not args.no_counters) as profiler:
+            net(x)
+    if args.json:
+        print(json.dumps(profiler.summary(), indent=2))
+    else:
+        print(profiler.summary_table())
+    if args.trace is not None:
+        profiler.save_chrome_trace(args.trace)
+
+
+if __name__ == '__main__':
+    main()
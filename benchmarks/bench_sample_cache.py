@@ -0,0 +1,52 @@
+"""DataLoader throughput per epoch without and with the shared decoded-sample cache (utils/sample_cache.py).
+
+    python -m benchmarks.bench_sample_cache --workers 4 --epochs 3 --cache-mb 64
+
+The first epoch fills the cache, later ones read from it. A budget below the split size shows the LRU evictions.
+"""
+import argparse
+import tempfile
+import time
+
+from torch.utils.data import DataLoader
+
+from benchmarks.common import make_synthetic_split, print_results
+from utils.get_datasets import GetDatasets, RandomGenerator
+from utils.sample_cache import SharedSampleCache
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-samples', type=int, default=64)
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--output-size', type=int, default=224)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--cache-mb', type=float, default=256)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir, list_dir = make_synthetic_split(tmp, 'train', args.n_samples, args.size)
+        for name in ['no_cache', 'shared_cache']:
+            cache = SharedSampleCache(args.cache_mb * 2 ** 20) if name == 'shared_cache' else None
+            dataset = GetDatasets(base_dir, list_dir, 'train', cache=cache,
+                                  transform=RandomGenerator([args.output_size, args.output_size], compact=True))
+            loader = DataLoader(dataset, batch_size=args.batch_size, num_workers=args.workers, shuffle=True)
+            for epoch in range(args.epochs):
+                start = time.perf_counter()
+                for _ in loader:
+                    pass
+                stats = {'samples_per_s': len(dataset) / (time.perf_counter() - start)}
+                if cache is not None:
+                    stats.update(cache.stats())
+                results[f'sample_cache/{name}/epoch{epoch}'] = stats
+            if cache is not None:
+                cache.close()
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
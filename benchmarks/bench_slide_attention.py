@@ -0,0 +1,56 @@
+"""SlideAttention: optimized forward against the original implementation at several stage resolutions.
+
+    python -m benchmarks.bench_slide_attention --sizes 7 14 28 56 --batch-size 4
+
+Each case also reports the max abs difference between the two outputs. The default configuration is timed; the
+other combinations of share_dwc_kernel and share_qkv are only checked against the original at the first size.
+"""
+import argparse
+
+import torch
+
+from benchmarks.common import print_results, time_fn
+from benchmarks.reference import max_abs_diff, slide_attention_forward
+from networks.transnext import SlideAttention
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=768)
+    parser.add_argument('--num-heads', type=int, default=32)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[7, 14, 28, 56])
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    module = SlideAttention(args.dim, num_heads=args.num_heads, ka=3, qkv_bias=True).to(args.device).eval()
+    results = {}
+    with torch.inference_mode():
+        for size in args.sizes:
+            x = torch.randn(args.batch_size, size * size, args.dim, device=args.device)
+            reference = time_fn(lambda: slide_attention_forward(module, x, size, size), iters=args.iters,
+                                device=args.device)
+            optimized = time_fn(lambda: module(x, size, size, None, None), iters=args.iters, device=args.device)
+            optimized['speedup'] = reference['median_ms'] / optimized['median_ms']
+            optimized['max_abs_diff'] = max_abs_diff(module(x, size, size, None, None),
+                                                     slide_attention_forward(module, x, size, size))
+            results[f'slide_attention/reference/{size}x{size}'] = reference
+            results[f'slide_attention/optimized/{size}x{size}'] = optimized
+
+        size = args.sizes[0]
+        x = torch.randn(args.batch_size, size * size, args.dim, device=args.device)
+        for share_dwc_kernel in [True, False]:
+            for share_qkv in [False, True]:
+                variant = SlideAttention(args.dim, num_heads=args.num_heads, ka=3, qkv_bias=True,
+                                         share_dwc_kernel=share_dwc_kernel, share_qkv=share_qkv).to(args.device).eval()
+                results[f'slide_attention/share_dwc_kernel={share_dwc_kernel}/share_qkv={share_qkv}'] = {
+                    'max_abs_diff': max_abs_diff(variant(x, size, size, None, None),
+                                                 slide_attention_forward(variant, x, size, size))}
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
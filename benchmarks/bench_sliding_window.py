@@ -0,0 +1,50 @@
+"""Throughput of SlidingWindowInferer on a 1000x1000 image.
+
+    python -m benchmarks.bench_sliding_window --model conv
+    python -m benchmarks.bench_sliding_window --model crns --batch-size 16
+
+``--model conv`` swaps CRNS_NET for a single 1x1 convolution, which isolates the tiling/blending overhead.
+"""
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from benchmarks.common import print_results, time_fn
+from networks.sliding_window import SlidingWindowInferer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='conv', choices=['conv', 'crns'])
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--tile-size', type=int, default=224)
+    parser.add_argument('--overlap', type=float, default=0.25)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--blend', default='gaussian')
+    parser.add_argument('--pretrained', default=None)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if args.model == 'crns':
+        from networks.CRNS_NET import CRNS_NET
+        model = CRNS_NET(3, pretrained=args.pretrained).to(device).eval()
+    else:
+        model = nn.Conv2d(3, 3, kernel_size=1).to(device).eval()
+
+    image = np.random.randint(0, 256, (args.size, args.size, 3), dtype=np.uint8)
+    out = np.zeros((3, args.size, args.size), dtype=np.float32)
+    inferer = SlidingWindowInferer(args.tile_size, args.overlap, args.batch_size, args.blend)
+    n_tiles = len(inferer.get_tiles(args.size, args.size)[2])
+
+    stats = time_fn(lambda: inferer(model, image, out=out, channels_last=True), warmup=1, iters=args.iters)
+    stats['tiles'] = n_tiles
+    stats['tiles_per_s'] = n_tiles / stats['median_ms'] * 1000
+    print_results({f"sliding_window/{args.model}/{args.size}px/bs{args.batch_size}": stats}, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Time to the first batch and throughput of GetDatasets against StreamingDataset over .npz files and .tar shards.
+
+    python -m benchmarks.bench_streaming_dataset --n-samples 256 --workers 4 --threads 4
+
+The synthetic split is also written as --shards uncompressed .tar shards of .npz members. A second set of shards of
+uneven sizes checks that with samples_per_rank equal to the split size every sample is seen exactly once per epoch
+across the workers, and that every rank of two yields exactly samples_per_rank samples (exit code 1 on a failure).
+"""
+import argparse
+import collections
+import os
+import sys
+import tarfile
+import tempfile
+import time
+
+from torch.utils.data import DataLoader
+
+from benchmarks.common import make_synthetic_split, print_results
+from utils.get_datasets import GetDatasets, RandomGenerator
+from utils.stream_dataset import StreamingDataset
+
+
+def write_shards(base_dir, out_dir, n_shards, uneven=False):
+    # round-robin shards, or with uneven=True consecutive shards of 1, 2, 3, ... parts of the samples
+    names = sorted(os.listdir(base_dir))
+    os.makedirs(out_dir, exist_ok=True)
+    if uneven:
+        bounds = [len(names) * i * (i + 1) // (n_shards * (n_shards + 1)) for i in range(n_shards + 1)]
+        shards = [names[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+    else:
+        shards = [names[i::n_shards] for i in range(n_shards)]
+    for i, shard in enumerate(shards):
+        with tarfile.open(os.path.join(out_dir, f'shard{i:05d}.tar'), 'w') as tar:
+            for name in shard:
+                tar.add(os.path.join(base_dir, name), arcname=name)
+    return out_dir
+
+
+def check_coverage(shard_dir, n_samples, workers):
+    # failures of the per-rank evening on uneven shards, [] when there are none
+    failures = []
+    for world_size, samples_per_rank in [(1, n_samples), (2, n_samples // 2 - 3), (2, n_samples // 2 + 3)]:
+        seen = collections.Counter()
+        for rank in range(world_size):
+            dataset = StreamingDataset(shard_dir, 'train', rank=rank, world_size=world_size,
+                                       samples_per_rank=samples_per_rank)
+            names = [sample['case_name'] for sample in DataLoader(dataset, batch_size=None, num_workers=workers)]
+            if len(names) != samples_per_rank:
+                failures.append(f'rank {rank} of {world_size} yielded {len(names)} samples instead of '
+                                f'{samples_per_rank}')
+            seen.update(names)
+        if world_size == 1 and (len(seen) != n_samples or max(seen.values()) != 1):
+            failures.append(f'{len(seen)} of {n_samples} samples seen, up to {max(seen.values())} times each')
+    return failures
+
+
+def measure(dataset, batch_size, workers):
+    loader = DataLoader(dataset, batch_size=batch_size, num_workers=workers)
+    start = time.perf_counter()
+    first_batch_ms, n_samples = None, 0
+    for batch in loader:
+        if first_batch_ms is None:
+            first_batch_ms = (time.perf_counter() - start) * 1000
+        n_samples += len(batch['case_name'])
+    return {'first_batch_ms': first_batch_ms, 'samples_per_s': n_samples / (time.perf_counter() - start),
+            'samples': n_samples}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-samples', type=int, default=128)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--output-size', type=int, default=224)
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir, list_dir = make_synthetic_split(tmp, 'train', args.n_samples, args.size)
+        shard_dir = write_shards(base_dir, os.path.join(tmp, 'shards'), args.shards)
+        transform = RandomGenerator([args.output_size, args.output_size], compact=True)
+        datasets = {
+            'get_datasets': GetDatasets(base_dir, list_dir, 'train', transform=transform),
+            'streaming_npz': StreamingDataset(base_dir, 'train', transform=transform, num_threads=args.threads),
+            'streaming_tar': StreamingDataset(shard_dir, 'train', transform=transform, num_threads=args.threads),
+        }
+        for name, dataset in datasets.items():
+            results[f'streaming/{name}'] = measure(dataset, args.batch_size, args.workers)
+        uneven_dir = write_shards(base_dir, os.path.join(tmp, 'uneven_shards'), args.shards, uneven=True)
+        failures = check_coverage(uneven_dir, args.n_samples, args.workers)
+    results['streaming/uneven_shards'] = {'failures': len(failures)}
+    print_results(results, args.json)
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Microbenchmark suite of the CRNS-Net hot paths, CPU-runnable, with JSON output and baseline comparison.
+
+    python -m benchmarks.bench_suite --sizes 224 512 --batch-sizes 1 4 --save baseline.json
+    python -m benchmarks.bench_suite --sizes 224 512 --batch-sizes 1 4 --baseline baseline.json
+
+Cases (select with --cases, by name prefix): slide_attention (stage 4), aggregated_attention (native, stage 1),
+convglu (stage 1), cgblock, up_block0-3, crns_net/forward, crns_net/backward and loader (GetDatasets +
+RandomGenerator). Sizes are input image sides, each module runs at the resolution and width it has at that input.
+With --baseline, cases whose median_ms grew by more than --tolerance are reported and the exit code is 1.
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+from benchmarks.common import compare_results, make_synthetic_split, print_results, time_fn
+from networks.CRNS_NET import CRNS_NET
+from utils.get_datasets import GetDatasets, RandomGenerator
+
+
+def module_cases(net, size, batch_size, device):
+    # name -> zero-argument callable, the modules of one model at input side ``size``
+    branch = net.backbone
+    cases = {}
+
+    H = size // 32
+    slide = branch.encoder.block4[0].attn
+    x = torch.randn(batch_size, H * H, slide.dim, device=device)
+    cases['slide_attention'] = lambda: slide(x, H, H, None, None)
+
+    H = size // 4
+    attention = branch.encoder.block1[0].attn
+    relative_pos_index, relative_coords_table = branch.encoder.get_relative_position(0, H, H, device)
+    x1 = torch.randn(batch_size, H * H, attention.dim, device=device)
+    cases['aggregated_attention'] = lambda: attention(x1, H, H, relative_pos_index, relative_coords_table)
+    mlp = branch.encoder.block1[0].mlp
+    cases['convglu'] = lambda: mlp(x1, H, H)
+
+    x_text = net.get_task_encoding().detach()
+    x48 = torch.randn(batch_size, branch.cgblock.in_channels, size, size, device=device)
+    cases['cgblock'] = lambda: branch.cgblock(x48, x_text)
+
+    for i, block in enumerate(branch.up_blocks):
+        # the UpBlocks run from the bridge at 1/32 up to the input resolution, the skip connection is the encoder
+        # feature map (the image for the last block) at the upsampled resolution
+        up_size = size // 2 ** (5 - i)
+        out_size = up_size * block.upsample.stride[0]
+        up_x = torch.randn(batch_size, block.upsample.in_channels, up_size, up_size, device=device)
+        down_x = torch.randn(batch_size, block.conv_block_1.conv.in_channels - block.upsample.out_channels,
+                             out_size, out_size, device=device)
+        cases[f'up_block{i}'] = lambda block=block, up_x=up_x, down_x=down_x: block(up_x, down_x)
+
+    image = torch.randn(batch_size, 3, size, size, device=device)
+    cases['crns_net/forward'] = lambda: net(image)
+    return cases
+
+
+def crns_net_backward(net, size, batch_size, device):
+    image = torch.randn(batch_size, 3, size, size, device=device)
+    labels = torch.randint(0, net.n_classes, (batch_size, size, size), device=device)
+
+    def step():
+        net.zero_grad(set_to_none=True)
+        F.cross_entropy(net(image), labels).backward()
+
+    return step
+
+
+def loader_throughput(size, batch_size, n_samples, workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir, list_dir = make_synthetic_split(tmp, 'train', n_samples, size)
+        dataset = GetDatasets(base_dir, list_dir, 'train', transform=RandomGenerator([size, size]))
+        loader = DataLoader(dataset, batch_size=batch_size, num_workers=workers)
+        start = time.perf_counter()
+        for _ in loader:
+            pass
+        elapsed = time.perf_counter() - start
+    return {'median_ms': elapsed * 1000 / len(loader), 'samples_per_s': len(dataset) / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', nargs='+', default=None)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[224, 512])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--loader-samples', type=int, default=32)
+    parser.add_argument('--loader-workers', type=int, default=0)
+    parser.add_argument('--save', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    def selected(name):
+        return args.cases is None or any(name.startswith(prefix) for prefix in args.cases)
+
+    torch.manual_seed(0)
+    net = CRNS_NET(3, pretrained=None, attention_backend='native').to(args.device)
+    results = {}
+    for size in args.sizes:
+        for batch_size in args.batch_sizes:
+            key = f'{size}x{size}/bs{batch_size}'
+            with torch.inference_mode():
+                net.eval()
+                for name, fn in module_cases(net, size, batch_size, args.device).items():
+                    if selected(name):
+                        results[f'{name}/{key}'] = time_fn(fn, warmup=1, iters=args.iters, device=args.device)
+            if selected('crns_net/backward'):
+                step = crns_net_backward(net.train(), size, batch_size, args.device)
+                results[f'crns_net/backward/{key}'] = time_fn(step, warmup=1, iters=args.iters, device=args.device)
+            if selected('loader'):
+                results[f'loader/{key}'] = loader_throughput(size, batch_size, args.loader_samples,
+                                                             args.loader_workers)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    regressions = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare_results(results, json.load(f), tolerance=args.tolerance)
+    if args.json:
+        print(json.dumps({'results': results, 'regressions': regressions}, indent=2))
+    else:
+        print_results(results)
+        if args.baseline is not None:
+            print(f"{len(regressions)} regression(s) against {args.baseline} (tolerance {args.tolerance:.0%})")
+            print_results(regressions)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Latency of batched test-time augmentation (networks/tta.py) against one forward per view, per view set.
+
+    python -m benchmarks.bench_tta --img-size 224 --batch-size 1 --views identity flip rot90 d4
+
+The per-view baseline copies every view's logits to the host, as a hand-written TTA loop does; max_abs_diff
+compares the merged logits of both. Without --pretrained the backbone keeps its random initialisation, which does
+not change the cost.
+"""
+import argparse
+
+import torch
+
+from benchmarks.common import print_results, time_fn
+from benchmarks.reference import max_abs_diff
+from networks.CRNS_NET import CRNS_NET
+from networks.tta import VIEW_SETS, TestTimeAugmentation, apply_view, invert_view
+
+
+def per_view(net, x, views):
+    outputs = torch.stack([invert_view(net(apply_view(x, view)).cpu(), view) for view in views])
+    return outputs.mean(0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--views', nargs='+', default=list(VIEW_SETS), choices=VIEW_SETS)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--pretrained', default=None)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    net = CRNS_NET(3, pretrained=args.pretrained).to(args.device).eval()
+    x = torch.randn(args.batch_size, 3, args.img_size, args.img_size, device=args.device)
+    results = {}
+    with torch.inference_mode():
+        single = time_fn(lambda: net(x).cpu(), iters=args.iters, device=args.device)['median_ms']
+        for name in args.views:
+            tta = TestTimeAugmentation(net, views=name)
+            n_views = len(tta.views)
+            batched = time_fn(lambda: tta(x).cpu(), iters=args.iters, device=args.device)
+            looped = time_fn(lambda: per_view(net, x, tta.views), iters=args.iters, device=args.device)
+            results[f'tta/{name}/batched'] = {**batched, 'views': n_views,
+                                              'per_view_vs_single': batched['median_ms'] / single / n_views,
+                                              'max_abs_diff': max_abs_diff(tta(x).cpu(), per_view(net, x, tta.views))}
+            results[f'tta/{name}/per_view'] = {**looped, 'views': n_views,
+                                               'per_view_vs_single': looped['median_ms'] / single / n_views}
+    print_results(results, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import json
+import statistics
+import time
+
+import torch
+
+
+def synchronize(device=None):
+    if torch.cuda.is_available() and (device is None or torch.device(device).type == 'cuda'):
+        torch.cuda.synchronize()
+
+
+def time_fn(fn, warmup=2, iters=10, device=None):
+    """Run ``fn`` ``warmup`` times untimed and ``iters`` times timed, return wall-clock statistics in ms."""
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': statistics.median(times), 'mean_ms': statistics.fmean(times), 'min_ms': min(times),
+            'iters': iters}
+
+
+def memory_fn(fn, device=None):
+    '''
+    Memory used by one call of ``fn``: ``allocated_mb`` is the total size of the new (non-view, not in-place) tensors
+    the call's operators create, ``peak_mb`` the peak of those alive at the same time (on CUDA the allocator's peak
+    above the starting point).
+    '''
+    from torch.utils._python_dispatch import TorchDispatchMode
+
+    from networks.profiling import LiveTensorTracker
+
+    class AllocationTracker(TorchDispatchMode):
+        def __init__(self):
+            super().__init__()
+            self.tensors = LiveTensorTracker()
+
+        def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+            kwargs = kwargs or {}
+            out = func(*args, **kwargs)
+            self.tensors.record(args, kwargs, out)
+            return out
+
+    tracker = AllocationTracker()
+    with tracker:
+        fn()
+    stats = {'allocated_mb': tracker.tensors.allocated / 2 ** 20, 'peak_mb': tracker.tensors.peak / 2 ** 20}
+    if torch.cuda.is_available() and device is not None and torch.device(device).type == 'cuda':
+        synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        start = torch.cuda.memory_allocated(device)
+        fn()
+        synchronize(device)
+        stats['peak_mb'] = (torch.cuda.max_memory_allocated(device) - start) / 2 ** 20
+    return stats
+
+
+def print_results(results, as_json=False):
+    if as_json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, stats in results.items():
+        print(f"{name:<48s} " + '  '.join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}"
+                                           for k, v in stats.items()))
+
+
+def make_synthetic_split(root, split='train', n_samples=32, size=224, seed=0):
+    """
+    Write ``n_samples`` random <name>.npz slices and lists/<split>.txt under ``root``, return (base_dir, list_dir).
+    """
+    import os
+    import numpy as np
+
+    base_dir, list_dir = os.path.join(root, 'npz'), os.path.join(root, 'lists')
+    os.makedirs(base_dir, exist_ok=True)
+    os.makedirs(list_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    names = []
+    for i in range(n_samples):
+        name = f'{split}_slice{i:05d}'
+        image = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        label = rng.integers(0, 3, (size, size), dtype=np.uint8)
+        np.savez_compressed(os.path.join(base_dir, name + '.npz'), image=image, label=label)
+        names.append(name)
+    with open(os.path.join(list_dir, split + '.txt'), 'w') as f:
+        f.write('\n'.join(names) + '\n')
+    return base_dir, list_dir
+
+
+def load_samples(base_dir=None, list_dir=None, split='test', n_samples=8, size=224):
+    """Up to ``n_samples`` compact (uint8) images and labels of a GetDatasets split, synthetic without ``base_dir``."""
+    import tempfile
+
+    from utils.get_datasets import GetDatasets
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if base_dir is None:
+            base_dir, list_dir = make_synthetic_split(tmp, split, n_samples, size)
+        dataset = GetDatasets(base_dir, list_dir, split, compact=True)
+        samples = [dataset[i] for i in range(min(n_samples, len(dataset)))]
+    return torch.stack([s['image'] for s in samples]), torch.stack([s['label'] for s in samples])
+
+
+def label_dice(logits, label):
+    """Per-class Dice of the argmax predictions of (B, n_classes, H, W) ``logits`` against (B, H, W) labels."""
+    from networks.cpu_inference import prediction_dice
+
+    reference = torch.nn.functional.one_hot(label.long(), logits.shape[1]).permute(0, 3, 1, 2)
+    return prediction_dice(reference, logits)
+
+
+def compare_results(results, baseline, metric='median_ms', tolerance=0.1):
+    """Cases of ``results`` whose ``metric`` exceeds the one in ``baseline`` by more than ``tolerance`` (relative)."""
+    regressions = {}
+    for name, stats in results.items():
+        reference = baseline.get(name, {}).get(metric)
+        if reference and metric in stats and stats[metric] > reference * (1 + tolerance):
+            regressions[name] = {f'baseline_{metric}': reference, metric: stats[metric],
+                                 'ratio': stats[metric] / reference}
+    return regressions
@@ -0,0 +1,122 @@
+"""Frozen copies of the original implementations of optimized hot paths.
+
+The optimized modules keep their parameters, so these functions take the live module and recompute its output the
+way the original code did. Benchmarks use them for parity checks and as the timing baseline. The instance metrics
+are the straightforward per-instance-mask loops of the usual evaluation scripts.
+"""
+import einops
+import torch
+
+
+def slide_attention_forward(self, x, H, W):
+    # SlideAttention.forward as originally written: two shift/depthwise convolutions over K and V each and
+    # einops layout round-trips (non-square H x W as introduced for multi-resolution support)
+    B1, L1, C1 = x.shape
+    x = x.reshape(B1, C1, H, W)
+
+    x = einops.rearrange(x, 'b c h w -> b h w c')
+    B, H, W, C = x.shape
+
+    qkv = self.qkv(x)
+
+    f_conv = qkv.permute(0, 3, 1, 2).reshape(B * self.num_heads,
+                                             self.qkv_scale * C // self.dim_reduction // self.num_heads, H, W)
+
+    if self.qkv_scale == 3:
+        q = (f_conv[:, :C // self.dim_reduction // self.num_heads, :, :] * self.scale).reshape(
+            B, self.num_heads, C // self.dim_reduction // self.num_heads, 1, H, W)
+        k = f_conv[:, C // self.dim_reduction // self.num_heads:2 * C // self.dim_reduction // self.num_heads, :, :]
+        v = f_conv[:, 2 * C // self.dim_reduction // self.num_heads:, :, :]
+    elif self.qkv_scale == 1:
+        q = (f_conv * self.scale).reshape(B, self.num_heads, C // self.dim_reduction // self.num_heads, 1, H, W)
+        k = v = f_conv
+
+    if self.share_dwc_kernel:
+        k = (self.dep_conv(k) + self.dep_conv1(k)).reshape(B, self.num_heads, C // self.dim_reduction // self.num_heads,
+                                                           self.ka * self.ka, H, W)
+        v = (self.dep_conv(v) + self.dep_conv1(v)).reshape(B, self.num_heads, C // self.dim_reduction // self.num_heads,
+                                                           self.ka * self.ka, H, W)
+    else:
+        k = (self.dep_conv(k) + self.dep_conv1(k)).reshape(B, self.num_heads, C // self.dim_reduction // self.num_heads,
+                                                           self.ka * self.ka, H, W)
+        v = (self.dep_conv(v) + self.dep_conv2(v)).reshape(B, self.num_heads, C // self.dim_reduction // self.num_heads,
+                                                           self.ka * self.ka, H, W)
+
+    if self.rpb:
+        k = k + self.relative_position_bias_table
+    attn = (q * k).sum(2, keepdim=True)
+
+    attn = self.softmax(attn)
+    attn = self.attn_drop(attn)
+
+    x = (attn * v).sum(3).reshape(B, C // self.dim_reduction, H, W).permute(0, 2, 3, 1)
+    x = self.proj(x)
+    x = self.proj_drop(x)
+    x = einops.rearrange(x, 'b h w c -> b c h w')
+    x = x.reshape(B1, L1, C1)
+    return x
+
+
+def cgblock_forward(self, x, x_text):
+    # CGblock.forward as originally written: the decoder map is permuted/reshaped to (B*H*W, C), normalized and
+    # multiplied with the text features recomputed on every call, then viewed and permuted back
+    if self.in_channels != 2048:
+        x_text = self.text(x_text)
+
+    imshape = x.shape
+    image_features = x.permute(0, 2, 3, 1).reshape(-1, self.in_channels)
+    image_features = image_features / image_features.norm(dim=1, keepdim=True)
+    text_features = x_text / x_text.norm(dim=1, keepdim=True)
+
+    logit_scale = self.logit_scale.exp()
+    logits_per_image = logit_scale * image_features @ text_features.t()
+    out = logits_per_image.float().view(imshape[0], imshape[2], imshape[3], -1).permute(0, 3, 1, 2)
+    out = torch.concat([x, out], dim=1)
+    out = self.conv_block_1(out)
+    out = self.channelAtten(out)
+    return out
+
+
+def max_abs_diff(a, b):
+    return (a.float() - b.float()).abs().max().item()
+
+
+def instance_metrics_reference(true, pred, iou_threshold=0.5):
+    # AJI and PQ of two instance maps (any labels) with one boolean mask per instance and a loop over every pair
+    import numpy as np
+
+    true_masks = [true == i for i in np.unique(true) if i != 0]
+    pred_masks = [pred == i for i in np.unique(pred) if i != 0]
+
+    aji_intersection = aji_union = 0
+    used = set()
+    for t in true_masks:
+        best, best_iou = None, 0.
+        for j, p in enumerate(pred_masks):
+            intersection = np.logical_and(t, p).sum()
+            if intersection == 0:
+                continue
+            iou = intersection / np.logical_or(t, p).sum()
+            if iou > best_iou:
+                best, best_iou = j, iou
+        if best is None:
+            aji_union += t.sum()
+        else:
+            aji_intersection += np.logical_and(t, pred_masks[best]).sum()
+            aji_union += np.logical_or(t, pred_masks[best]).sum()
+            used.add(best)
+    aji_union += sum(p.sum() for j, p in enumerate(pred_masks) if j not in used)
+
+    tp, iou_sum = 0, 0.
+    for t in true_masks:
+        for p in pred_masks:
+            iou = np.logical_and(t, p).sum() / np.logical_or(t, p).sum()
+            if iou > iou_threshold:
+                tp += 1
+                iou_sum += iou
+    fp, fn = len(pred_masks) - tp, len(true_masks) - tp
+    detections = tp + 0.5 * fp + 0.5 * fn
+    dq = tp / detections if detections else np.nan
+    sq = iou_sum / tp if tp else (0. if detections else np.nan)
+    return {'aji': aji_intersection / aji_union if aji_union else np.nan, 'dq': dq, 'sq': sq, 'pq': dq * sq,
+            'tp': tp, 'fp': fp, 'fn': fn}
@@ -5,16 +5,18 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from networks.ImageBranch import ImageBranch
+from networks.ImageBranch import ImageBranch, PRETRAINED_CKPT
+from utils.prompt_store import DEFAULT_ENCODER, DEFAULT_STORE, PromptEmbeddingStore
 
 class CRNS_NET(nn.Module):
-    def __init__(self, n_classes, encoding='word_embedding'):
+    def __init__(self, n_classes, encoding='word_embedding', pretrained=PRETRAINED_CKPT, input_mean=None,
+                 input_std=None, attention_backend=None):
         super().__init__()
 
         self.n_classes = n_classes
         self.channels = 768
-        self.device = 'cuda'
-        self.backbone = ImageBranch(n_classes=self.n_classes)
+        self.backbone = ImageBranch(n_classes=self.n_classes, pretrained=pretrained,
+                                    attention_backend=attention_backend)
         self.encoding = encoding
 
         if self.encoding == 'rand_embedding':
@@ -22,22 +24,95 @@ class CRNS_NET(nn.Module):
         elif self.encoding == 'word_embedding':
             self.register_buffer('organ_embedding', torch.randn(n_classes, self.channels))
             self.text_to_vision = nn.Linear(512, self.channels)
+            # prompts switched at runtime (set_prompts), used instead of organ_embedding and not in the state dict
+            self.register_buffer('prompt_embedding', None, persistent=False)
         self.class_num = n_classes
 
-    def forward(self, x_in):
-        x_in = x_in.to('cuda')
+        # uint8 input batches (GetDatasets/RandomGenerator with compact=True) are cast and normalized as
+        # x * input_scale + input_shift in one fused step; without mean/std this is a plain cast, matching float input.
+        input_mean = torch.zeros(3) if input_mean is None else torch.as_tensor(input_mean, dtype=torch.float32)
+        input_std = torch.ones(3) if input_std is None else torch.as_tensor(input_std, dtype=torch.float32)
+        self.register_buffer('input_scale', (1 / input_std).view(1, -1, 1, 1), persistent=False)
+        self.register_buffer('input_shift', (-input_mean / input_std).view(1, -1, 1, 1), persistent=False)
+
+    @property
+    def device(self):
+        # placement follows the parameters, move the model with .to()/.cuda()/.cpu() as usual
+        return next(self.parameters()).device
+
+    def switch_to_deploy(self, check_input=None, atol=1e-5):
+        # precompute the encoder's relative position biases, see TransNeXt.switch_to_deploy
+        self.backbone.encoder.switch_to_deploy(check_input, atol)
+        return self
+
+    @torch.no_grad()
+    def fuse_conv_bn(self, fuse=True, check_input=None, atol=1e-4):
+        '''
+        Fold the decoder's BatchNorms into the convolutions for inference (see ImageBranch.fuse_conv_bn), reversible
+        with ``fuse=False``. If ``check_input`` is given, the eval-mode outputs before and after are compared and a
+        RuntimeError is raised when they differ by more than ``atol``.
+        '''
+        was_training = self.training
+        self.eval()
+        reference = self(check_input) if check_input is not None else None
+        self.backbone.fuse_conv_bn(fuse)
+        max_diff = (self(check_input) - reference).abs().max().item() if reference is not None else 0.
+        self.train(was_training)
+        if max_diff > atol:
+            self.backbone.fuse_conv_bn(False)
+            raise RuntimeError(f"Conv-BN fused output differs from the unfused one by {max_diff:.3e} > {atol:.1e}")
+        return self
+
+    def set_activation_checkpointing(self, granularity='block', stages=None, up_blocks=None):
+        # trade recomputation for activation memory in training, see ImageBranch.set_activation_checkpointing
+        self.backbone.set_activation_checkpointing(granularity, stages, up_blocks)
+        return self
+
+    def set_attention_chunk_size(self, chunk_size=None):
+        # bounded-memory attention for large inputs, see TransNeXt.set_attention_chunk_size
+        self.backbone.encoder.set_attention_chunk_size(chunk_size)
+        return self
 
+    def set_prompts(self, prompts, store=DEFAULT_STORE, encoder=DEFAULT_ENCODER):
+        '''
+        Switch the class prompts at runtime, one prompt per class, from a PromptEmbeddingStore (or its path);
+        ``prompts=None`` returns to the trained organ_embedding. Only stored embeddings are used, CLIP is never
+        loaded here; encode new prompts offline with PromptEmbeddingStore.populate / utils/getText.py. The text
+        branch takes ``self.channels``-d embeddings, encoders of another width are rejected.
+        '''
+        if self.encoding != 'word_embedding':
+            raise ValueError(f"set_prompts needs encoding='word_embedding', got {self.encoding}")
+        if prompts is None:
+            self.prompt_embedding = None
+            return self
+        if len(prompts) != self.n_classes:
+            raise ValueError(f"Expected {self.n_classes} prompts, one per class, got {len(prompts)}")
+        if not isinstance(store, PromptEmbeddingStore):
+            store = PromptEmbeddingStore(store)
+        embedding = store.get(prompts, encoder)
+        if embedding.shape[-1] != self.channels:
+            raise ValueError(f"{encoder} embeddings are {embedding.shape[-1]}-d, the text branch takes "
+                             f"{self.channels}-d prompt embeddings (e.g. {DEFAULT_ENCODER}).")
+        self.prompt_embedding = embedding.to(self.organ_embedding.device, torch.float32)
+        return self
+
+    def prepare_input(self, x_in):
+        if x_in.dtype == torch.uint8:
+            return torch.addcmul(self.input_shift, x_in, self.input_scale)
+        return x_in
+
+    def get_task_encoding(self):
         if self.encoding == 'rand_embedding':
-            task_encoding = self.organ_embedding.weight
-        elif self.encoding == 'word_embedding':
-            task_encoding = F.relu(self.organ_embedding)
-            task_encoding = task_encoding
-        out = self.backbone(x_in, task_encoding)
+            return self.organ_embedding.weight
+        return F.relu(self.organ_embedding if self.prompt_embedding is None else self.prompt_embedding)
+
+    def forward(self, x_in):
+        x_in = self.prepare_input(x_in)
+        out = self.backbone(x_in, self.get_task_encoding())
         return out
 
 
 
 #
-# net = CRNS_NET(args.num_classes).to(device)
-# word_embedding = torch.load(args.word_embedding).to(device)
-# net.organ_embedding.data = word_embedding.float()
+# net = CRNS_NET(args.num_classes).to(device)   # the input batch has to be on the same device
+# net.set_prompts([f'A computerized tomography of a {item}' for item in ORGAN_NAME])   # see utils/getText.py
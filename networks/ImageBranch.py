@@ -1,12 +1,76 @@
 import torch
 import torch.nn as nn
-import torchvision
-import torchvision.models as models
+import torch.nn.functional as F
+import torch.utils.checkpoint
 import numpy as np
 import math
+from contextlib import contextmanager
 from torch.nn import CrossEntropyLoss, Dropout, Softmax, Linear, Conv2d, LayerNorm, MultiheadAttention
 
 from networks.transnext import transnext_base
+
+PRETRAINED_CKPT = 'pretrained_ckpt/transnext_base_224_1k.pth'
+# PRETRAINED_CKPT pre-filtered by utils/convert_checkpoint.py, loaded lazily
+CONVERTED_CKPT = 'pretrained_ckpt/transnext_base_224_1k_backbone.pth'
+
+# 列出要忽略的层: block4 runs SlideAttention, whose qkv / proj shapes differ from the pretrained attention
+PRETRAINED_IGNORED_KEYS = [
+    'head.weight', 'head.bias',
+    'block4.0.attn.qkv.weight', 'block4.0.attn.qkv.bias', 'block4.0.attn.proj.weight',
+    'block4.1.attn.qkv.weight', 'block4.1.attn.qkv.bias', 'block4.1.attn.proj.weight',
+    'block4.2.attn.qkv.weight', 'block4.2.attn.qkv.bias', 'block4.2.attn.proj.weight',
+    'block4.3.attn.qkv.weight', 'block4.3.attn.qkv.bias', 'block4.3.attn.proj.weight',
+    'block4.4.attn.qkv.weight', 'block4.4.attn.qkv.bias', 'block4.4.attn.proj.weight'
+]
+
+
+def load_checkpoint(path):
+    # on the CPU, memory-mapped when the file is in torch's zip format: tensors are only read when first used
+    try:
+        return torch.load(path, map_location='cpu', mmap=True)
+    except RuntimeError:
+        return torch.load(path, map_location='cpu')
+
+
+def filter_pretrained_state_dict(state_dict):
+    ignored = set(PRETRAINED_IGNORED_KEYS)
+    return {k: v for k, v in state_dict.items() if k not in ignored}
+
+
+def is_converted_checkpoint(checkpoint):
+    return isinstance(checkpoint, dict) and isinstance(checkpoint.get('backbone'), dict)
+
+
+@contextmanager
+def frozen_batchnorm_stats(module):
+    # BatchNorms keep normalizing with the batch statistics but leave their running statistics untouched
+    bns = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training]
+    state = [(m.momentum, m.num_batches_tracked.clone()) for m in bns]
+    for m in bns:
+        m.momentum = 0.
+    try:
+        yield
+    finally:
+        for m, (momentum, num_batches_tracked) in zip(bns, state):
+            m.momentum = momentum
+            m.num_batches_tracked.copy_(num_batches_tracked)
+
+
+def checkpoint_module(module, *args):
+    # Activation checkpoint of ``module``: its forward runs again during backward, the recomputation must not
+    # update the running statistics of its BatchNorms a second time.
+    calls = []
+
+    def run(*args):
+        if calls:
+            with frozen_batchnorm_stats(module):
+                return module(*args)
+        calls.append(None)
+        return module(*args)
+
+    return torch.utils.checkpoint.checkpoint(run, *args, use_reentrant=False)
+
+
 class ConvBlock(nn.Module):
 
 
@@ -16,10 +80,38 @@ class ConvBlock(nn.Module):
         self.bn = nn.BatchNorm2d(out_channels)
         self.relu = nn.ReLU()
         self.with_nonlinearity = with_nonlinearity
+        # conv weights with the eval-mode BatchNorm folded in (see fuse_bn), not part of the state dict
+        self.register_buffer('fused_weight', None, persistent=False)
+        self.register_buffer('fused_bias', None, persistent=False)
+        self.fused_key = None
+
+    def get_fused_key(self):
+        # storage and in-place version of everything folded into fused_weight / fused_bias
+        tensors = [self.conv.weight, self.conv.bias, self.bn.weight, self.bn.bias, self.bn.running_mean,
+                   self.bn.running_var]
+        return tuple((t.data_ptr(), t._version) for t in tensors if t is not None)
+
+    @torch.no_grad()
+    def fuse_bn(self):
+        # bn(conv(x)) with running statistics is a conv with per-output-channel scaled weights and shifted bias
+        scale = self.bn.weight * torch.rsqrt(self.bn.running_var + self.bn.eps)
+        bias = self.conv.bias if self.conv.bias is not None else torch.zeros_like(self.bn.running_mean)
+        self.fused_weight = self.conv.weight * scale[:, None, None, None]
+        self.fused_bias = (bias - self.bn.running_mean) * scale + self.bn.bias
+        self.fused_key = self.get_fused_key()
+
+    def unfuse_bn(self):
+        self.fused_weight = self.fused_bias = self.fused_key = None
 
     def forward(self, x):
-        x = self.conv(x)
-        x = self.bn(x)
+        if self.fused_weight is not None and not self.training:
+            if self.fused_key != self.get_fused_key():
+                # the weights or statistics changed since fuse_bn (optimizer steps in train mode, load_state_dict,
+                # a move to another device): fold the current ones
+                self.fuse_bn()
+            x = F.conv2d(x, self.fused_weight, self.fused_bias, self.conv.stride, self.conv.padding)
+        else:
+            x = self.bn(self.conv(x))
         if self.with_nonlinearity:
             x = self.relu(x)
         return x
@@ -83,24 +175,48 @@ class CGblock(nn.Module):
 
         self.channelAtten = ChannelAttention(in_channels)
         self.text = nn.Linear(768, self.in_channels)
+        # (key, weight) of the last text features computed without autograd, see get_text_weight
+        self.text_cache = None
+
+    def compute_text_weight(self, x_text):
+        # fp32 under autocast as well: the weight is cached across calls with and without reduced precision
+        with torch.autocast(x_text.device.type, enabled=False):
+            x_text = x_text.float()
+            if self.in_channels != 2048:
+                x_text = self.text(x_text)
+            text_features = x_text / torch.linalg.vector_norm(x_text, dim=1, keepdim=True)
+            # logit_scale * normalized text features, as the weight of a 1x1 convolution
+            return (self.logit_scale.exp() * text_features)[:, :, None, None]
+
+    def get_text_weight(self, x_text):
+        # (a dynamically quantized self.text keeps its packed weights outside of parameters(), the cache is then
+        # keyed by the module itself)
+        parameters = tuple(self.text.parameters()) + (self.logit_scale,)
+        if torch.is_grad_enabled() and (x_text.requires_grad or any(p.requires_grad for p in parameters)) or \
+                torch.jit.is_tracing():
+            # (a traced graph computes the weight from its constant prompts, see networks/export.py)
+            return self.compute_text_weight(x_text)
+        # The prompts are fixed between calls at inference, so the projection is reused as long as the prompt
+        # values and the parameters (storage and in-place version) are unchanged. A weight made under inference_mode
+        # is an inference tensor that cannot be saved for backward, so the mode is part of the key.
+        key = (id(self.text), torch.is_inference_mode_enabled()) + tuple((p.data_ptr(), p._version)
+                                                                         for p in parameters)
+        if self.text_cache is not None:
+            cached_key, cached_text, weight = self.text_cache
+            if cached_key == key and cached_text.shape == x_text.shape and torch.equal(cached_text, x_text):
+                return weight
+        with torch.no_grad():
+            weight = self.compute_text_weight(x_text)
+        self.text_cache = (key, x_text.detach().clone(), weight)
+        return weight
 
     def forward(self, x, x_text):
-
-        if self.in_channels != 2048:
-            x_text = self.text(x_text)
-
-        imshape = x.shape
-        image_features = x
-        image_features = image_features.permute(0, 2, 3, 1).reshape(-1, self.in_channels)
-        # normalized features
-        image_features = image_features / image_features.norm(dim=1, keepdim=True)
-        text_features = x_text / x_text.norm(dim=1, keepdim=True)
-
-        # cosine similarity as logits
-        logit_scale = self.logit_scale.exp()
-        logits_per_image = logit_scale * image_features @ text_features.t()
-        out = logits_per_image.float().view(imshape[0], imshape[2], imshape[3], -1).permute(0,3,1,2)
-        out = torch.concat([x,out],dim=1)
+        # Cosine similarity logits computed in place of the (B*H*W, C) permute/reshape round trip: a 1x1
+        # convolution with the scaled text features divided by the per-pixel feature norm, in x's layout
+        # (NCHW or channels_last).
+        weight = self.get_text_weight(x_text)
+        out = F.conv2d(x, weight.to(x.dtype)) / torch.linalg.vector_norm(x, dim=1, keepdim=True, dtype=torch.float32)
+        out = torch.concat([x, out.float()], dim=1)
         out = self.conv_block_1(out)
         out = self.channelAtten(out)
 
@@ -125,35 +241,20 @@ class ChannelAttention(nn.Module):
         return self.sigmoid(out) * x
 
 class ImageBranch(nn.Module):
-    def __init__(self, n_classes=3):
+    def __init__(self, n_classes=3, pretrained=PRETRAINED_CKPT, attention_backend=None):
         super().__init__()
 
-        self.encoder = transnext_base(n_classes)
-        state_dict = torch.load('pretrained_ckpt/transnext_base_224_1k.pth', map_location='cuda')
-        state_dict.pop('head.weight', None)
-        state_dict.pop('head.bias', None)
-        # 列出要忽略的层
-        layers_to_ignore = [
-            'block4.0.attn.qkv.weight', 'block4.0.attn.qkv.bias', 'block4.0.attn.proj.weight',
-            'block4.1.attn.qkv.weight', 'block4.1.attn.qkv.bias', 'block4.1.attn.proj.weight',
-            'block4.2.attn.qkv.weight', 'block4.2.attn.qkv.bias', 'block4.2.attn.proj.weight',
-            'block4.3.attn.qkv.weight', 'block4.3.attn.qkv.bias', 'block4.3.attn.proj.weight',
-            'block4.4.attn.qkv.weight', 'block4.4.attn.qkv.bias', 'block4.4.attn.proj.weight'
-        ]
-
-        # 删除 state_dict 中要忽略的层
-        for layer in layers_to_ignore:
-            if layer in state_dict:
-                del state_dict[layer]
-        missing_keys, unexpected_keys = self.encoder.load_state_dict(state_dict, strict=False)
-
-        if not missing_keys and not unexpected_keys:
-            print("All keys matched successfully and weights are loaded properly.")
+        checkpoint = load_checkpoint(pretrained) if pretrained is not None else None
+        if is_converted_checkpoint(checkpoint):
+            # Built on the meta device: the checkpoint's (memory-mapped) tensors are assigned as they are and only
+            # the weights missing from it are allocated and randomly initialized.
+            with torch.device('meta'):
+                self.encoder = transnext_base(n_classes, attention_backend=attention_backend)
+            self.report_loaded_keys(*self.encoder.assign_pretrained(checkpoint['backbone']))
         else:
-            if missing_keys:
-                print(f"Missing keys: {missing_keys}")
-            if unexpected_keys:
-                print(f"Unexpected keys: {unexpected_keys}")
+            self.encoder = transnext_base(n_classes, attention_backend=attention_backend)
+            if checkpoint is not None:
+                self.load_pretrained_state_dict(checkpoint)
 
         up_blocks = []
         self.n_classes = n_classes
@@ -166,16 +267,67 @@ class ImageBranch(nn.Module):
                                                     up_conv_in_channels=96, up_conv_out_channels=48, islast=True))
 
         self.up_blocks = nn.ModuleList(up_blocks)
+        # indices of the UpBlocks run under activation checkpointing, see set_activation_checkpointing
+        self.checkpoint_up_blocks = set()
         self.cgblock = CGblock(48, self.n_classes)
         self.out = nn.Conv2d(48, n_classes, kernel_size=1, stride=1)
 
+    def set_activation_checkpointing(self, granularity='block', stages=None, up_blocks=None):
+        '''
+        Activation checkpointing of the encoder stages (see TransNeXt.set_activation_checkpointing for
+        ``granularity`` and ``stages``) and of the decoder UpBlocks with indices ``up_blocks`` (default all, each
+        block one segment; the last one runs at the input resolution). ``granularity=None`` turns both off.
+        '''
+        self.encoder.set_activation_checkpointing(granularity, stages)
+        self.checkpoint_up_blocks = set() if granularity is None else set(range(len(self.up_blocks))
+                                                                           if up_blocks is None else up_blocks)
+        return self
+
+    def fuse_conv_bn(self, fuse=True):
+        '''
+        Fold the BatchNorm of every decoder ConvBlock (Bridge, UpBlocks, CGblock) into its convolution for inference:
+        one conv per block instead of a conv and a BatchNorm pass over the feature map. The fused weights are
+        computed from the current parameters and running statistics and only used in eval mode; the original
+        modules and the state dict are unchanged, ``fuse=False`` drops the fused weights again. A block whose
+        parameters or statistics changed since (training steps, load_state_dict, .to()) folds them again on its next
+        eval-mode forward.
+        '''
+        for m in self.modules():
+            if isinstance(m, ConvBlock) and fuse:
+                m.fuse_bn()
+            elif isinstance(m, ConvBlock):
+                m.unfuse_bn()
+        return self
+
+    def load_pretrained(self, path):
+        # loaded on the CPU, the weights follow the module when it is moved afterwards
+        checkpoint = load_checkpoint(path)
+        self.load_pretrained_state_dict(checkpoint['backbone'] if is_converted_checkpoint(checkpoint) else checkpoint)
+
+    def load_pretrained_state_dict(self, state_dict):
+        # 删除 state_dict 中要忽略的层
+        state_dict = filter_pretrained_state_dict(state_dict)
+        self.report_loaded_keys(*self.encoder.load_state_dict(state_dict, strict=False))
+
+    @staticmethod
+    def report_loaded_keys(missing_keys, unexpected_keys):
+        if not missing_keys and not unexpected_keys:
+            print("All keys matched successfully and weights are loaded properly.")
+        else:
+            if missing_keys:
+                print(f"Missing keys: {missing_keys}")
+            if unexpected_keys:
+                print(f"Unexpected keys: {unexpected_keys}")
+
     def forward(self, x, x_text):
         x_text = x_text.squeeze(-1).squeeze(-1)
-        x = x.to('cuda')
         x, downsample = self.encoder(x)
         x = self.bridge(x)
         for i, block in enumerate(self.up_blocks):
-            x = block(x, downsample[3-i])
+            if i in self.checkpoint_up_blocks and torch.is_grad_enabled():
+                x = checkpoint_module(block, x, downsample[3-i])
+            else:
+                x = block(x, downsample[3-i])
         x = self.cgblock(x, x_text)
 
         x = self.out(x)
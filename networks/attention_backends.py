@@ -0,0 +1,53 @@
+import importlib
+import importlib.util
+import os
+
+# Selects the AggregatedAttention implementation of models that do not pass attention_backend explicitly.
+ATTENTION_BACKEND_ENV = 'CRNS_ATTENTION_BACKEND'
+
+# name -> (module defining AggregatedAttention, top-level packages it needs)
+ATTENTION_BACKENDS = {
+    'native': ('networks.attention_native', ()),
+    'cuda': ('networks.attention_cuda', ('swattention',)),
+}
+
+# order in which 'auto' picks a backend
+DEFAULT_BACKEND_ORDER = ['cuda', 'native']
+
+
+def register_attention_backend(name, module, requires=(), default_priority=None):
+    """Register a module defining a drop-in ``AggregatedAttention``; it is only imported when first selected."""
+    ATTENTION_BACKENDS[name] = (module, tuple(requires))
+    if default_priority is not None and name not in DEFAULT_BACKEND_ORDER:
+        DEFAULT_BACKEND_ORDER.insert(default_priority, name)
+
+
+def is_backend_available(name):
+    # find_spec only locates the top-level package, nothing is imported and no installed distribution is scanned
+    _, requires = ATTENTION_BACKENDS[name]
+    return all(importlib.util.find_spec(package) is not None for package in requires)
+
+
+def available_backends():
+    return [name for name in ATTENTION_BACKENDS if is_backend_available(name)]
+
+
+def resolve_attention_backend(name=None):
+    '''
+    Backend name for ``name``: an explicit name is checked and returned, ``None`` falls back to
+    $CRNS_ATTENTION_BACKEND and then to 'auto', the first available backend of DEFAULT_BACKEND_ORDER
+    (the CUDA kernels when swattention is installed, the PyTorch native version otherwise).
+    '''
+    name = name or os.environ.get(ATTENTION_BACKEND_ENV) or 'auto'
+    if name == 'auto':
+        return next(backend for backend in DEFAULT_BACKEND_ORDER if is_backend_available(backend))
+    if name not in ATTENTION_BACKENDS:
+        raise ValueError(f"Unknown attention backend {name}, expected 'auto' or one of {list(ATTENTION_BACKENDS)}")
+    if not is_backend_available(name):
+        raise RuntimeError(f"Attention backend {name} needs {ATTENTION_BACKENDS[name][1]}, which is not installed")
+    return name
+
+
+def get_aggregated_attention(name=None):
+    module, _ = ATTENTION_BACKENDS[resolve_attention_backend(name)]
+    return importlib.import_module(module).AggregatedAttention
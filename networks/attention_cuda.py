@@ -4,6 +4,8 @@ import torch.nn.functional as F
 import swattention
 import numpy as np
 
+from networks.lru_cache import LRUCache
+
 CUDA_NUM_THREADS = 128
 
 
@@ -71,13 +73,10 @@ class AggregatedAttention(nn.Module):
         self.window_size = window_size
         self.local_len = window_size ** 2
 
-        if fixed_pool_size is None:
-            self.pool_H, self.pool_W = input_resolution[0] // self.sr_ratio, input_resolution[1] // self.sr_ratio
-        else:
+        if fixed_pool_size is not None:
             assert fixed_pool_size < min(input_resolution), \
                 f"The fixed_pool_size {fixed_pool_size} should be less than the shorter side of input resolution {input_resolution} to ensure pooling works correctly."
-            self.pool_H, self.pool_W = fixed_pool_size, fixed_pool_size
-        self.pool_len = self.pool_H * self.pool_W
+        self.fixed_pool_size = fixed_pool_size
 
         self.unfold = nn.Unfold(kernel_size=window_size, padding=window_size // 2, stride=1)
         self.temperature = nn.Parameter(
@@ -91,8 +90,7 @@ class AggregatedAttention(nn.Module):
         self.proj = nn.Linear(dim, dim)
         self.proj_drop = nn.Dropout(proj_drop)
 
-        # Components to generate pooled features.
-        self.pool = nn.AdaptiveAvgPool2d((self.pool_H, self.pool_W))
+        # Components to generate pooled features, the pooled size follows the input resolution (see get_pool_size).
         self.sr = nn.Conv2d(dim, dim, kernel_size=1, stride=1, padding=0)
         self.norm = nn.LayerNorm(dim)
         self.act = nn.GELU()
@@ -101,28 +99,65 @@ class AggregatedAttention(nn.Module):
         self.cpb_fc1 = nn.Linear(2, 512, bias=True)
         self.cpb_act = nn.ReLU(inplace=True)
         self.cpb_fc2 = nn.Linear(512, num_heads, bias=True)
+        self.deploy = False
 
         # relative bias for local features
         self.relative_pos_bias_local = nn.Parameter(
             nn.init.trunc_normal_(torch.empty(num_heads, self.local_len), mean=0, std=0.0004))
 
-        # Generate padding_mask && sequnce length scale
-        local_seq_length = get_seqlen_scale(input_resolution, window_size)
-        self.register_buffer("seq_length_scale", torch.as_tensor(np.log(local_seq_length.numpy() + self.pool_len)),
-                             persistent=False)
+        # sequnce length scale (and the deploy-mode pool bias) per input resolution, built on first use
+        self.resolution_cache = LRUCache()
 
         # dynamic_local_bias:
         self.learnable_tokens = nn.Parameter(
             nn.init.trunc_normal_(torch.empty(num_heads, self.head_dim, self.local_len), mean=0, std=0.02))
         self.learnable_bias = nn.Parameter(torch.zeros(num_heads, 1, self.local_len))
 
+    def get_pool_size(self, H, W):
+        if self.fixed_pool_size is None:
+            return H // self.sr_ratio, W // self.sr_ratio
+        return self.fixed_pool_size, self.fixed_pool_size
+
+    def get_resolution_state(self, H, W, device):
+        def build():
+            pool_H, pool_W = self.get_pool_size(H, W)
+            local_seq_length = get_seqlen_scale((H, W), self.window_size)
+            seq_length_scale = torch.as_tensor(np.log(local_seq_length.numpy() + pool_H * pool_W))
+            return {'seq_length_scale': seq_length_scale.to(device)}
+
+        return self.resolution_cache.get((H, W, device), build)
+
+    def compute_pool_bias(self, relative_pos_index, relative_coords_table, pool_len):
+        return self.cpb_fc2(self.cpb_act(self.cpb_fc1(relative_coords_table))).transpose(0, 1)[:,
+               relative_pos_index.view(-1)].view(self.num_heads, -1, pool_len)
+
+    def get_pool_bias(self, H, W, relative_pos_index, relative_coords_table):
+        pool_H, pool_W = self.get_pool_size(H, W)
+        if not self.deploy:
+            return self.compute_pool_bias(relative_pos_index, relative_coords_table, pool_H * pool_W)
+        # In deploy mode the continuous relative position bias only depends on the (constant) coordinate table,
+        # the MLP and the gather run once per resolution and the result is kept with the other per-resolution state.
+        state = self.get_resolution_state(H, W, relative_coords_table.device)
+        if 'pool_bias' not in state:
+            with torch.no_grad(), torch.inference_mode(False):
+                state['pool_bias'] = self.compute_pool_bias(relative_pos_index, relative_coords_table,
+                                                            pool_H * pool_W)
+        return state['pool_bias']
+
+    def switch_to_deploy(self, H, W, relative_pos_index, relative_coords_table):
+        self.deploy = True
+        self.get_pool_bias(H, W, relative_pos_index, relative_coords_table)
+
     def forward(self, x, H, W, relative_pos_index, relative_coords_table):
         B, N, C = x.shape
+        pool_H, pool_W = self.get_pool_size(H, W)
+        pool_len = pool_H * pool_W
+        state = self.get_resolution_state(H, W, x.device)
 
         # Generate queries, normalize them with L2, add query embedding, and then magnify with sequence length scale and temperature.
         # Use softplus function ensuring that the temperature is not lower than 0.
         q_norm = F.normalize(self.q(x).reshape(B, N, self.num_heads, self.head_dim).permute(0, 2, 1, 3), dim=-1)
-        q_norm_scaled = (q_norm + self.query_embedding) * F.softplus(self.temperature) * self.seq_length_scale
+        q_norm_scaled = (q_norm + self.query_embedding) * F.softplus(self.temperature) * state['seq_length_scale']
 
         # Generate unfolded keys and values and l2-normalize them
         k_local, v_local = self.kv(x).reshape(B, N, 2 * self.num_heads, self.head_dim).permute(0, 2, 1, 3).chunk(2,
@@ -135,16 +170,15 @@ class AggregatedAttention(nn.Module):
 
         # Generate pooled features
         x_ = x.permute(0, 2, 1).reshape(B, -1, H, W).contiguous()
-        x_ = self.pool(self.act(self.sr(x_))).reshape(B, -1, self.pool_len).permute(0, 2, 1)
+        x_ = F.adaptive_avg_pool2d(self.act(self.sr(x_)), (pool_H, pool_W)).reshape(B, -1, pool_len).permute(0, 2, 1)
         x_ = self.norm(x_)
 
         # Generate pooled keys and values
-        kv_pool = self.kv(x_).reshape(B, self.pool_len, 2 * self.num_heads, self.head_dim).permute(0, 2, 1, 3)
+        kv_pool = self.kv(x_).reshape(B, pool_len, 2 * self.num_heads, self.head_dim).permute(0, 2, 1, 3)
         k_pool, v_pool = kv_pool.chunk(2, dim=1)
 
         # Use MLP to generate continuous relative positional bias for pooled features.
-        pool_bias = self.cpb_fc2(self.cpb_act(self.cpb_fc1(relative_coords_table))).transpose(0, 1)[:,
-                    relative_pos_index.view(-1)].view(-1, N, self.pool_len)
+        pool_bias = self.get_pool_bias(H, W, relative_pos_index, relative_coords_table)
         # Compute pooled similarity
         attn_pool = q_norm_scaled @ F.normalize(k_pool, dim=-1).transpose(-2, -1) + pool_bias
 
@@ -153,7 +187,7 @@ class AggregatedAttention(nn.Module):
         attn = self.attn_drop(attn)
 
         # Split the attention weights and separately aggregate the values of local & pooled features
-        attn_local, attn_pool = torch.split(attn, [self.local_len, self.pool_len], dim=-1)
+        attn_local, attn_pool = torch.split(attn, [self.local_len, pool_len], dim=-1)
         attn_local = (q_norm @ self.learnable_tokens) + self.learnable_bias + attn_local
         x_local = sw_av_cuda.apply(attn_local.type_as(v_local), v_local.contiguous(), H, W, self.window_size)
 
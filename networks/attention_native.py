@@ -3,6 +3,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 
+from networks.lru_cache import LRUCache
+
 
 @torch.no_grad()
 def get_seqlen_and_mask(input_resolution, window_size):
@@ -29,13 +31,10 @@ class AggregatedAttention(nn.Module):
         self.window_size = window_size
         self.local_len = window_size ** 2
 
-        if fixed_pool_size is None:
-            self.pool_H, self.pool_W = input_resolution[0] // self.sr_ratio, input_resolution[1] // self.sr_ratio
-        else:
+        if fixed_pool_size is not None:
             assert fixed_pool_size < min(input_resolution), \
                 f"The fixed_pool_size {fixed_pool_size} should be less than the shorter side of input resolution {input_resolution} to ensure pooling works correctly."
-            self.pool_H, self.pool_W = fixed_pool_size, fixed_pool_size
-        self.pool_len = self.pool_H * self.pool_W
+        self.fixed_pool_size = fixed_pool_size
 
         self.unfold = nn.Unfold(kernel_size=window_size, padding=window_size // 2, stride=1)
         self.temperature = nn.Parameter(
@@ -49,8 +48,7 @@ class AggregatedAttention(nn.Module):
         self.proj = nn.Linear(dim, dim)
         self.proj_drop = nn.Dropout(proj_drop)
 
-        # Components to generate pooled features.
-        self.pool = nn.AdaptiveAvgPool2d((self.pool_H, self.pool_W))
+        # Components to generate pooled features, the pooled size follows the input resolution (see get_pool_size).
         self.sr = nn.Conv2d(dim, dim, kernel_size=1, stride=1, padding=0)
         self.norm = nn.LayerNorm(dim)
         self.act = nn.GELU()
@@ -59,66 +57,151 @@ class AggregatedAttention(nn.Module):
         self.cpb_fc1 = nn.Linear(2, 512, bias=True)
         self.cpb_act = nn.ReLU(inplace=True)
         self.cpb_fc2 = nn.Linear(512, num_heads, bias=True)
+        self.deploy = False
 
         # relative bias for local features
         self.relative_pos_bias_local = nn.Parameter(
             nn.init.trunc_normal_(torch.empty(num_heads, self.local_len), mean=0, std=0.0004))
 
-        # Generate padding_mask && sequnce length scale
-        local_seq_length, padding_mask = get_seqlen_and_mask(input_resolution, window_size)
-        self.register_buffer("seq_length_scale", torch.as_tensor(np.log(local_seq_length.numpy() + self.pool_len)),
-                             persistent=False)
-        self.register_buffer("padding_mask", padding_mask, persistent=False)
+        # padding_mask && sequnce length scale (and the deploy-mode pool bias) per input resolution, built on first use
+        self.resolution_cache = LRUCache()
+        # query tokens per chunk of the chunked execution (see forward), None processes all tokens at once
+        self.chunk_size = None
 
         # dynamic_local_bias:
         self.learnable_tokens = nn.Parameter(
             nn.init.trunc_normal_(torch.empty(num_heads, self.head_dim, self.local_len), mean=0, std=0.02))
         self.learnable_bias = nn.Parameter(torch.zeros(num_heads, 1, self.local_len))
 
-    def forward(self, x, H, W, relative_pos_index, relative_coords_table):
-        B, N, C = x.shape
+    def get_pool_size(self, H, W):
+        if self.fixed_pool_size is None:
+            return H // self.sr_ratio, W // self.sr_ratio
+        return self.fixed_pool_size, self.fixed_pool_size
+
+    def get_resolution_state(self, H, W, device):
+        def build():
+            pool_H, pool_W = self.get_pool_size(H, W)
+            local_seq_length, padding_mask = get_seqlen_and_mask((H, W), self.window_size)
+            seq_length_scale = torch.as_tensor(np.log(local_seq_length.numpy() + pool_H * pool_W))
+            return {'seq_length_scale': seq_length_scale.to(device), 'padding_mask': padding_mask.to(device)}
+
+        return self.resolution_cache.get((H, W, device), build)
+
+    def compute_pool_bias_table(self, relative_coords_table):
+        # kept in fp32 under autocast (bf16 inference, see cpu_inference), like the other softmax inputs
+        with torch.autocast(relative_coords_table.device.type, enabled=False):
+            return self.cpb_fc2(self.cpb_act(self.cpb_fc1(relative_coords_table.float()))).transpose(0, 1)
+
+    def compute_pool_bias(self, relative_pos_index, relative_coords_table, pool_len):
+        return self.compute_pool_bias_table(relative_coords_table)[:, relative_pos_index.view(-1)].view(
+            self.num_heads, -1, pool_len)
+
+    def get_pool_bias(self, H, W, relative_pos_index, relative_coords_table):
+        pool_H, pool_W = self.get_pool_size(H, W)
+        if not self.deploy:
+            return self.compute_pool_bias(relative_pos_index, relative_coords_table, pool_H * pool_W)
+        # In deploy mode the continuous relative position bias only depends on the (constant) coordinate table,
+        # the MLP and the gather run once per resolution and the result is kept with the other per-resolution state.
+        state = self.get_resolution_state(H, W, relative_coords_table.device)
+        if 'pool_bias' not in state:
+            with torch.no_grad(), torch.inference_mode(False):
+                state['pool_bias'] = self.compute_pool_bias(relative_pos_index, relative_coords_table,
+                                                            pool_H * pool_W)
+        return state['pool_bias']
+
+    def get_pool_bias_table(self, H, W, relative_coords_table):
+        # Bias per entry of the coordinate table, before the gather over the relative position index: the chunked
+        # execution gathers the rows of each chunk instead of building the (heads, N, pool_len) bias.
+        if not self.deploy:
+            return self.compute_pool_bias_table(relative_coords_table)
+        state = self.get_resolution_state(H, W, relative_coords_table.device)
+        if 'pool_bias_table' not in state:
+            with torch.no_grad(), torch.inference_mode(False):
+                state['pool_bias_table'] = self.compute_pool_bias_table(relative_coords_table)
+        return state['pool_bias_table']
+
+    def switch_to_deploy(self, H, W, relative_pos_index, relative_coords_table):
+        self.deploy = True
+        self.get_pool_bias(H, W, relative_pos_index, relative_coords_table)
+
+    def attend_rows(self, x, H, W, r0, r1, k_pool, v_pool, pool_bias):
+        # Attention output (before the projection) of the query tokens in rows [r0, r1) of the H x W map
+        B, _, C = x.shape
+        n0, n1 = r0 * W, r1 * W
+        N = n1 - n0
+        state = self.get_resolution_state(H, W, x.device)
 
         # Generate queries, normalize them with L2, add query embedding, and then magnify with sequence length scale and temperature.
         # Use softplus function ensuring that the temperature is not lower than 0.
-        q_norm = F.normalize(self.q(x).reshape(B, N, self.num_heads, self.head_dim).permute(0, 2, 1, 3), dim=-1)
-        q_norm_scaled = (q_norm + self.query_embedding) * F.softplus(self.temperature) * self.seq_length_scale
-
-        # Generate unfolded keys and values and l2-normalize them
-        k_local, v_local = self.kv(x).chunk(2, dim=-1)
-        k_local = F.normalize(k_local.reshape(B, N, self.num_heads, self.head_dim), dim=-1).reshape(B, N, -1)
-        kv_local = torch.cat([k_local, v_local], dim=-1).permute(0, 2, 1).reshape(B, -1, H, W)
-        k_local, v_local = self.unfold(kv_local).reshape(
+        # The normalizations, the temperature scaling and the softmax run in fp32 under reduced-precision autocast,
+        # only the projections and the matmuls are cast down.
+        q_norm = F.normalize(
+            self.q(x[:, n0:n1]).float().reshape(B, N, self.num_heads, self.head_dim).permute(0, 2, 1, 3), dim=-1)
+        q_norm_scaled = (q_norm + self.query_embedding) * F.softplus(self.temperature) * \
+                        state['seq_length_scale'][n0:n1]
+
+        # Generate unfolded keys and values and l2-normalize them. The 3x3 windows of rows [r0, r1) only reach
+        # window_size // 2 rows above and below, so keys and values are computed for the rows plus that halo.
+        halo = self.window_size // 2
+        h0, h1 = max(r0 - halo, 0), min(r1 + halo, H)
+        k_local, v_local = self.kv(x[:, h0 * W:h1 * W]).chunk(2, dim=-1)
+        # (normalized in fp32, the matmuls with q cast it to the dtype of the values again under autocast)
+        k_local = F.normalize(k_local.float().reshape(B, -1, self.num_heads, self.head_dim), dim=-1)
+        k_local = k_local.reshape(B, -1, C).to(v_local.dtype)
+        kv_local = torch.cat([k_local, v_local], dim=-1).permute(0, 2, 1).reshape(B, -1, h1 - h0, W)
+        k_local, v_local = self.unfold(kv_local)[:, :, (r0 - h0) * W:(r1 - h0) * W].reshape(
             B, 2 * self.num_heads, self.head_dim, self.local_len, N).permute(0, 1, 4, 2, 3).chunk(2, dim=1)
 
         # Compute local similarity
         attn_local = ((q_norm_scaled.unsqueeze(-2) @ k_local).squeeze(-2) \
-                      + self.relative_pos_bias_local.unsqueeze(1)).masked_fill(self.padding_mask, float('-inf'))
-
-        # Generate pooled features
-        x_ = x.permute(0, 2, 1).reshape(B, -1, H, W).contiguous()
-        x_ = self.pool(self.act(self.sr(x_))).reshape(B, -1, self.pool_len).permute(0, 2, 1)
-        x_ = self.norm(x_)
-
-        # Generate pooled keys and values
-        kv_pool = self.kv(x_).reshape(B, self.pool_len, 2 * self.num_heads, self.head_dim).permute(0, 2, 1, 3)
-        k_pool, v_pool = kv_pool.chunk(2, dim=1)
-
-        # Use MLP to generate continuous relative positional bias for pooled features.
-        pool_bias = self.cpb_fc2(self.cpb_act(self.cpb_fc1(relative_coords_table))).transpose(0, 1)[:,
-                    relative_pos_index.view(-1)].view(-1, N, self.pool_len)
+                      + self.relative_pos_bias_local.unsqueeze(1)).masked_fill(state['padding_mask'][n0:n1],
+                                                                               float('-inf'))
         # Compute pooled similarity
-        attn_pool = q_norm_scaled @ F.normalize(k_pool, dim=-1).transpose(-2, -1) + pool_bias
+        attn_pool = q_norm_scaled @ k_pool.transpose(-2, -1) + pool_bias
 
         # Concatenate local & pooled similarity matrices and calculate attention weights through the same Softmax
-        attn = torch.cat([attn_local, attn_pool], dim=-1).softmax(dim=-1)
+        attn = torch.cat([attn_local, attn_pool], dim=-1).float().softmax(dim=-1)
         attn = self.attn_drop(attn)
 
         # Split the attention weights and separately aggregate the values of local & pooled features
-        attn_local, attn_pool = torch.split(attn, [self.local_len, self.pool_len], dim=-1)
+        attn_local, attn_pool = torch.split(attn, [self.local_len, k_pool.shape[2]], dim=-1)
         x_local = (((q_norm @ self.learnable_tokens) + self.learnable_bias + attn_local).unsqueeze(
             -2) @ v_local.transpose(-2, -1)).squeeze(-2)
         x_pool = attn_pool @ v_pool
-        x = (x_local + x_pool).transpose(1, 2).reshape(B, N, C)
+        return (x_local + x_pool).transpose(1, 2).reshape(B, N, C)
+
+    def forward(self, x, H, W, relative_pos_index, relative_coords_table):
+        B, N, C = x.shape
+        pool_H, pool_W = self.get_pool_size(H, W)
+        pool_len = pool_H * pool_W
+
+        # Generate pooled features
+        x_ = x.permute(0, 2, 1).reshape(B, -1, H, W).contiguous()
+        x_ = F.adaptive_avg_pool2d(self.act(self.sr(x_)), (pool_H, pool_W)).reshape(B, -1, pool_len).permute(0, 2, 1)
+        x_ = self.norm(x_)
+
+        # Generate pooled keys and values
+        kv_pool = self.kv(x_).reshape(B, pool_len, 2 * self.num_heads, self.head_dim).permute(0, 2, 1, 3)
+        k_pool, v_pool = kv_pool.chunk(2, dim=1)
+        k_pool = F.normalize(k_pool.float(), dim=-1)
+
+        if self.chunk_size is None or N <= self.chunk_size:
+            # Use MLP to generate continuous relative positional bias for pooled features.
+            pool_bias = self.get_pool_bias(H, W, relative_pos_index, relative_coords_table)
+            x = self.attend_rows(x, H, W, 0, H, k_pool, v_pool, pool_bias)
+        else:
+            # Chunked execution: the query tokens are processed in bands of whole rows (chunk_size tokens at most,
+            # one row at least) against the shared pooled keys/values, so the unfolded keys/values and the
+            # similarity matrices only ever exist for one band. Same result as the single pass.
+            pool_bias_table = self.get_pool_bias_table(H, W, relative_coords_table)
+            pool_index = relative_pos_index.view(N, pool_len)
+            rows = max(1, self.chunk_size // W)
+            out = x.new_empty(B, N, C)
+            for r0 in range(0, H, rows):
+                r1 = min(r0 + rows, H)
+                pool_bias = pool_bias_table[:, pool_index[r0 * W:r1 * W]]
+                out[:, r0 * W:r1 * W] = self.attend_rows(x, H, W, r0, r1, k_pool, v_pool, pool_bias)
+            x = out
 
         # Linear projection and output
         x = self.proj(x)
@@ -0,0 +1,81 @@
+import os
+import warnings
+from contextlib import contextmanager
+
+import torch
+import torch.nn.functional as F
+
+
+def set_cpu_threads(num_threads=None, num_interop_threads=None):
+    """Set the intra-op / inter-op thread pools. ``None`` leaves the current setting untouched."""
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads is not None and num_interop_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            # PyTorch only allows this before the first inter-op parallel work of the process
+            warnings.warn(f"Could not set num_interop_threads={num_interop_threads} after parallel work started, "
+                          f"keeping {torch.get_num_interop_threads()}. Set it at start-up or via "
+                          f"cpu_inference(...) before the first forward.")
+
+
+def prediction_dice(reference, logits):
+    """Per-class Dice between the argmax predictions of two (B, n_classes, H, W) logits, 1 for classes in neither."""
+    n_classes = reference.shape[1]
+    reference = F.one_hot(reference.argmax(1), n_classes).flatten(0, -2)
+    prediction = F.one_hot(logits.argmax(1), n_classes).flatten(0, -2)
+    intersection = (reference * prediction).sum(0).double()
+    total = (reference.sum(0) + prediction.sum(0)).double()
+    return torch.where(total > 0, 2 * intersection / total.clamp(min=1), torch.ones_like(total))
+
+
+def check_precision(model, check_input, dtype=torch.bfloat16, min_dice=0.99):
+    '''
+    Compare the predictions of ``model`` under ``dtype`` autocast with the fp32 ones on ``check_input`` and raise a
+    RuntimeError when the Dice of any class falls below ``min_dice``. Returns the per-class Dice.
+    '''
+    with torch.inference_mode():
+        reference = model(check_input)
+        with torch.autocast('cpu', dtype=dtype):
+            logits = model(check_input)
+    dice = prediction_dice(reference, logits)
+    if dice.min() < min_dice:
+        raise RuntimeError(f"{dtype} predictions drift from fp32: Dice per class {dice.tolist()}, "
+                           f"expected >= {min_dice}")
+    return dice
+
+
+@contextmanager
+def cpu_inference(model, num_threads=None, num_interop_threads=None, dtype=None, check_input=None, min_dice=0.99):
+    '''
+    CPU inference mode for CRNS_NET:
+
+        with cpu_inference(net, num_threads=16) as net:
+            logits = net(images)
+
+    The model is moved to the CPU and switched to eval mode, forwards run under ``torch.inference_mode`` and the
+    thread pools are configured for the duration of the block. The intra-op setting is restored afterwards;
+    the inter-op pool can only be configured once per process. ``num_threads`` defaults to $OMP_NUM_THREADS
+    when set.
+
+    ``dtype=torch.bfloat16`` runs the forwards under CPU autocast: convolutions, projections and matmuls use bf16,
+    while the L2 normalizations, temperature scaling, position biases and softmaxes of the attention blocks and
+    CGblock stay in fp32; the logits come out in bf16. With ``check_input`` the predictions are first checked
+    against fp32 on these samples (see check_precision).
+    '''
+    if num_threads is None and os.environ.get('OMP_NUM_THREADS'):
+        num_threads = int(os.environ['OMP_NUM_THREADS'])
+    previous_threads = torch.get_num_threads()
+    was_training = model.training
+    set_cpu_threads(num_threads, num_interop_threads)
+    model = model.cpu().eval()
+    reduced = dtype is not None and dtype != torch.float32
+    try:
+        if reduced and check_input is not None:
+            check_precision(model, check_input.cpu(), dtype, min_dice)
+        with torch.inference_mode(), torch.autocast('cpu', dtype=dtype or torch.bfloat16, enabled=reduced):
+            yield model
+    finally:
+        torch.set_num_threads(previous_threads)
+        model.train(was_training)
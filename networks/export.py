@@ -0,0 +1,100 @@
+import copy
+import os
+import warnings
+
+import torch
+import torch.nn as nn
+
+from utils.prompt_store import DEFAULT_STORE
+
+EXPORT_FORMATS = ('torchscript', 'onnx')
+# file extension -> format load_exported assumes when none is given
+EXPORT_EXTENSIONS = {'.pt': 'torchscript', '.pth': 'torchscript', '.torchscript': 'torchscript', '.onnx': 'onnx'}
+
+
+class FrozenPromptModel(nn.Module):
+    '''
+    CRNS_NET for a fixed prompt set: the task encoding (relu + projection of the prompt embeddings) is computed once
+    and kept as a buffer, so an exported graph only takes the image batch and folds the text branch into constants.
+    '''
+
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+        with torch.no_grad():
+            self.register_buffer('task_encoding', net.get_task_encoding().detach().clone())
+
+    def forward(self, x):
+        return self.net.backbone(self.net.prepare_input(x), self.task_encoding)
+
+
+def prepare_for_export(net, prompts=None, store=DEFAULT_STORE):
+    '''
+    Eval-mode copy of ``net`` wrapped in FrozenPromptModel, optionally with new ``prompts`` (see CRNS_NET.set_prompts),
+    with the relative position biases precomputed (switch_to_deploy) and the decoder BatchNorms folded (fuse_conv_bn).
+    '''
+    net = copy.deepcopy(net).eval()
+    if prompts is not None:
+        net.set_prompts(prompts, store)
+    return FrozenPromptModel(net.switch_to_deploy().fuse_conv_bn()).eval()
+
+
+def load_exported(path, format=None):
+    '''
+    Callable (images -> logits tensor) for a graph written by export_crns_net: a TorchScript module for 'torchscript',
+    an onnxruntime session on the CPU for 'onnx' (needs the optional onnxruntime package). ``format`` defaults to the
+    one of the file extension (EXPORT_EXTENSIONS).
+    '''
+    if format is None:
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in EXPORT_EXTENSIONS:
+            raise ValueError(f"Cannot infer the export format of {path}, pass format= (one of {EXPORT_FORMATS}) or "
+                             f"use one of the extensions {sorted(EXPORT_EXTENSIONS)}.")
+        format = EXPORT_EXTENSIONS[extension]
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {format}, expected one of {EXPORT_FORMATS}.")
+    if format == 'torchscript':
+        return torch.jit.load(path)
+    import onnxruntime
+
+    session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+
+    def run(x):
+        return torch.from_numpy(session.run(None, {input_name: x.detach().cpu().numpy()})[0])
+
+    return run
+
+
+@torch.no_grad()
+def export_crns_net(net, path, example_input, format='torchscript', prompts=None, store=DEFAULT_STORE, check=True,
+                    atol=1e-4, opset_version=17):
+    '''
+    Export CRNS_NET as a frozen graph for a fixed prompt set and the input size and dtype of ``example_input``
+    (B, 3, H, W): 'torchscript' traces and freezes the model (torch.jit.save to ``path``), 'onnx' writes an ONNX
+    graph with opset ``opset_version``. The prompt embeddings, relative position biases and folded BatchNorms end up
+    as constants of the graph. With ``check`` the exported graph is run on ``example_input`` and a RuntimeError is
+    raised when it differs from the eager model by more than ``atol`` (for ONNX only when onnxruntime is installed).
+    Returns ``path``.
+    '''
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {format}, expected one of {EXPORT_FORMATS}.")
+    model = prepare_for_export(net, prompts, store)
+    example_input = example_input.to(net.device)
+    if format == 'torchscript':
+        traced = torch.jit.trace(model, example_input, check_trace=False)
+        torch.jit.save(torch.jit.freeze(traced), path)
+    else:
+        torch.onnx.export(model, example_input, path, input_names=['image'], output_names=['logits'],
+                          opset_version=opset_version, do_constant_folding=True)
+    if check:
+        try:
+            exported = load_exported(path, format)
+        except ImportError:
+            warnings.warn("onnxruntime is not installed, the exported ONNX graph was not checked.")
+            return path
+        reference = model(example_input)
+        max_diff = (exported(example_input).to(reference) - reference).abs().max().item()
+        if max_diff > atol:
+            raise RuntimeError(f"Exported {format} output differs from the eager model by {max_diff:.3e} > {atol:.1e}")
+    return path
@@ -0,0 +1,38 @@
+from collections import OrderedDict
+
+import torch
+
+RESOLUTION_CACHE_SIZE = 8
+
+
+class LRUCache(object):
+    '''
+    Bounded least-recently-used mapping for the per-resolution constants of TransNeXt (relative position tables,
+    padding masks, sequence length scales, deploy-mode biases). Values are built by ``factory`` on the first
+    request of a key, outside of autograd and of inference mode, so the same cached tensors can be reused by
+    training and inference forwards alike.
+    '''
+
+    def __init__(self, maxsize=RESOLUTION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key, factory):
+        if key in self.data:
+            self.data.move_to_end(key)
+            return self.data[key]
+        with torch.no_grad(), torch.inference_mode(False):
+            value = factory()
+        self.data[key] = value
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.data.clear()
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
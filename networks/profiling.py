@@ -0,0 +1,195 @@
+import json
+import time
+import weakref
+from contextlib import contextmanager, nullcontext
+
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+try:
+    from torch.utils.flop_counter import flop_registry
+except ImportError:  # torch < 2.1, no FLOP estimates
+    flop_registry = {}
+
+# StageProfiler of the enclosing profile_stages block, None outside of it
+ACTIVE_PROFILER = None
+NULL_REGION = nullcontext()
+
+
+def profile_region(name):
+    '''
+    Instrumented region of a forward that has no module of its own (a TransNeXt stage, its reshape to NCHW):
+    the shared no-op context unless profile_stages is active.
+    '''
+    return NULL_REGION if ACTIVE_PROFILER is None else ACTIVE_PROFILER.region(name)
+
+
+def instrumented_modules(model):
+    # (region name, module) of the patch embeddings, blocks and norms of every TransNeXt stage and of the decoder
+    # blocks of every ImageBranch in ``model``
+    from networks.ImageBranch import ImageBranch
+    from networks.transnext import TransNeXt
+
+    for m in model.modules():
+        if isinstance(m, TransNeXt):
+            for i in range(1, m.num_stages + 1):
+                yield f'encoder/stage{i}/patch_embed', getattr(m, f'patch_embed{i}')
+                for j, blk in enumerate(getattr(m, f'block{i}')):
+                    yield f'encoder/stage{i}/block{j}', blk
+                yield f'encoder/stage{i}/norm', getattr(m, f'norm{i}')
+        elif isinstance(m, ImageBranch):
+            yield 'decoder/bridge', m.bridge
+            for i, block in enumerate(m.up_blocks):
+                yield f'decoder/up_block{i}', block
+            yield 'decoder/cgblock', m.cgblock
+            yield 'decoder/out', m.out
+
+
+class LiveTensorTracker(object):
+    '''
+    Bytes of the tensors created by operators (new storages: neither views nor outputs written in place into an
+    input): ``current`` is the size of those still alive, ``peak`` the largest ``current`` seen and ``allocated`` the
+    total ever created. Fed with every operator's arguments and outputs by a TorchDispatchMode (StageProfiler,
+    benchmarks.common.memory_fn).
+    '''
+
+    def __init__(self):
+        self.allocated = self.current = self.peak = 0
+        self.live = {}  # storage data_ptr -> [nbytes, number of live tensors created on it]
+
+    def release(self, ptr):
+        self.live[ptr][1] -= 1
+        if self.live[ptr][1] == 0:
+            self.current -= self.live.pop(ptr)[0]
+
+    def record(self, args, kwargs, out):
+        inputs = {id(t) for t in tree_flatten((args, kwargs))[0] if isinstance(t, torch.Tensor)}
+        for t in tree_flatten(out)[0]:
+            if isinstance(t, torch.Tensor) and not t._is_view() and id(t) not in inputs:
+                storage = t.untyped_storage()
+                ptr = storage.data_ptr()
+                if ptr not in self.live:
+                    self.live[ptr] = [storage.nbytes(), 0]
+                    self.allocated += storage.nbytes()
+                    self.current += storage.nbytes()
+                    self.peak = max(self.peak, self.current)
+                self.live[ptr][1] += 1
+                weakref.finalize(t, self.release, ptr)
+
+
+class StageProfiler(TorchDispatchMode):
+    '''
+    Records wall time, FLOP estimates and peak memory per region. While a region is open, the operators are seen
+    through this dispatch mode: ``flops`` adds their estimated FLOPs (torch.utils.flop_counter) to every open
+    region, ``memory`` tracks the new tensors alive at the same time (LiveTensorTracker), and
+    ``peak_mb`` is the peak of those above the level at the region's start. Counting adds per-operator overhead to
+    the wall times, turn both off for exact timings.
+    '''
+
+    def __init__(self, flops=True, memory=True):
+        super().__init__()
+        self.flops = flops
+        self.memory = memory
+        self.events = []
+        self.stack = []
+        self.tensors = LiveTensorTracker()
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        out = func(*args, **kwargs)
+        if not self.stack:
+            return out
+        if self.flops and func._overloadpacket in flop_registry:
+            flops = flop_registry[func._overloadpacket](*args, **kwargs, out_val=out)
+            for event in self.stack:
+                event['args']['flops'] += flops
+        if self.memory:
+            self.tensors.record(args, kwargs, out)
+            for event in self.stack:
+                event['peak'] = max(event['peak'], self.tensors.current - event['live'])
+        return out
+
+    def synchronize(self):
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            torch.cuda.synchronize()
+
+    def enter(self, name):
+        self.synchronize()
+        event = {'name': name, 'ph': 'X', 'pid': 0, 'tid': 0, 'ts': time.perf_counter() * 1e6,
+                 'live': self.tensors.current, 'peak': 0, 'args': {'flops': 0}}
+        self.stack.append(event)
+
+    def exit(self):
+        self.synchronize()
+        event = self.stack.pop()
+        event['dur'] = time.perf_counter() * 1e6 - event['ts']
+        event['args']['peak_mb'] = event.pop('peak') / 2 ** 20
+        del event['live']
+        self.events.append(event)
+
+    @contextmanager
+    def region(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def summary(self):
+        '''Per region name: number of calls, total / mean wall time (ms), total GFLOPs and the largest peak (MB).'''
+        summary = {}
+        for event in sorted(self.events, key=lambda e: e['ts']):
+            stats = summary.setdefault(event['name'], {'calls': 0, 'total_ms': 0., 'gflops': 0., 'peak_mb': 0.})
+            stats['calls'] += 1
+            stats['total_ms'] += event['dur'] / 1000
+            stats['gflops'] += event['args']['flops'] / 1e9
+            stats['peak_mb'] = max(stats['peak_mb'], event['args']['peak_mb'])
+        for stats in summary.values():
+            stats['mean_ms'] = stats['total_ms'] / stats['calls']
+        return summary
+
+    def summary_table(self):
+        lines = [f"{'region':<36s} {'calls':>6s} {'total_ms':>10s} {'mean_ms':>9s} {'gflops':>9s} {'peak_mb':>9s}"]
+        for name, stats in self.summary().items():
+            lines.append(f"{name:<36s} {stats['calls']:>6d} {stats['total_ms']:>10.3f} {stats['mean_ms']:>9.3f} "
+                         f"{stats['gflops']:>9.3f} {stats['peak_mb']:>9.2f}")
+        return '\n'.join(lines)
+
+    def save_chrome_trace(self, path):
+        # open in chrome://tracing or https://ui.perfetto.dev, nested regions show as nested slices
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+@contextmanager
+def profile_stages(model, flops=True, memory=True):
+    '''
+    Per-region profiling of the forwards of ``model`` (CRNS_NET, ImageBranch or TransNeXt) inside the block:
+
+        with profile_stages(net) as profiler:
+            net(images)
+        print(profiler.summary_table())
+        profiler.save_chrome_trace('trace.json')
+
+    Regions are every patch embedding, Block and norm of the encoder stages, the stages themselves and their
+    reshape to NCHW, and the decoder's Bridge, UpBlocks, CGblock and output conv. The hooks only exist inside the
+    block, outside of it the stage regions are a shared no-op context.
+    '''
+    global ACTIVE_PROFILER
+    profiler = StageProfiler(flops, memory)
+    handles = []
+    for name, module in instrumented_modules(model):
+        handles.append(module.register_forward_pre_hook(lambda m, args, name=name: profiler.enter(name)))
+        handles.append(module.register_forward_hook(lambda m, args, out: profiler.exit()))
+    ACTIVE_PROFILER = profiler
+    try:
+        if flops or memory:
+            with profiler:
+                yield profiler
+        else:
+            yield profiler
+    finally:
+        ACTIVE_PROFILER = None
+        for handle in handles:
+            handle.remove()
@@ -0,0 +1,35 @@
+import copy
+
+import torch
+import torch.nn as nn
+
+# nn.Linear children converted to dynamic INT8 per module class (by name, so both attention backends match): the
+# projections of the attention blocks, the ConvGLU MLPs and the text projection of CGblock. The cpb MLPs are
+# evaluated once per resolution (or cached in deploy mode) and stay float, like all convolutions and normalizations.
+QUANTIZED_LINEARS = {
+    'SlideAttention': ('qkv', 'proj'),
+    'AggregatedAttention': ('q', 'kv', 'proj'),
+    'ConvolutionalGLU': ('fc1', 'fc2'),
+    'CGblock': ('text',),
+}
+
+
+def get_quantized_linear_names(model):
+    """Qualified names of the nn.Linear modules of ``model`` that quantize_dynamic_int8 converts."""
+    return {'.'.join(filter(None, (name, attr))) for name, module in model.named_modules()
+            for attr in QUANTIZED_LINEARS.get(type(module).__name__, ())
+            if type(getattr(module, attr, None)) is nn.Linear}
+
+
+def quantize_dynamic_int8(model, engine=None):
+    '''
+    CPU serving copy of CRNS_NET (or any of its parts) with the linears of QUANTIZED_LINEARS converted to dynamic
+    INT8: weights are stored as qint8 and activations are quantized per call, the rest of the model stays float.
+    The float model is left untouched, the copy is on the CPU in eval mode and meant for inference only (not
+    combined with bf16 autocast). ``engine`` selects the quantized backend, e.g. 'fbgemm' (x86) or 'qnnpack' (ARM).
+    '''
+    if engine is not None:
+        torch.backends.quantized.engine = engine
+    model = copy.deepcopy(model).cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(model, get_quantized_linear_names(model), dtype=torch.qint8,
+                                                  inplace=True)
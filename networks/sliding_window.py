@@ -0,0 +1,131 @@
+import numpy as np
+import torch
+
+
+def get_blend_window(tile_size, mode='gaussian', sigma_scale=0.125):
+    """1D blending profile of length ``tile_size``; the 2D weight of a tile is its outer product."""
+    position = np.arange(tile_size, dtype=np.float64) + 0.5
+    if mode == 'gaussian':
+        sigma = tile_size * sigma_scale
+        window = np.exp(-0.5 * ((position - tile_size / 2) / sigma) ** 2)
+        # keep the border strictly positive so every pixel receives some weight
+        window = np.maximum(window / window.max(), 1e-3)
+    elif mode == 'linear':
+        window = np.minimum(position, tile_size - position)
+        window = window / window.max()
+    elif mode == 'constant':
+        window = np.ones(tile_size, dtype=np.float64)
+    else:
+        raise ValueError(f"Unknown blend mode {mode}, expected 'gaussian', 'linear' or 'constant'.")
+    return window
+
+
+def get_tile_starts(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] != length - tile_size:
+        starts.append(length - tile_size)
+    return starts
+
+
+def get_normalized_windows(length, tile_size, starts, window):
+    # The tile grid is a product grid and the blend weight is separable, so the total weight a pixel receives
+    # factorises into a row term and a column term. Dividing every tile's window by that total up front makes
+    # the overlapping contributions sum to a convex combination without a second normalization pass.
+    total = np.zeros(max(length, tile_size), dtype=np.float64)
+    for start in starts:
+        total[start:start + tile_size] += window
+    return {start: (window / total[start:start + tile_size]).astype(np.float32) for start in starts}
+
+
+class SlidingWindowInferer(object):
+    '''
+    Whole-image inference for CRNS_NET. Large images are cut into ``tile_size`` tiles (the resolution the model
+    was built for), the tiles are pushed through the model ``batch_size`` at a time and the overlapping logits
+    are blended with a gaussian, linear or constant window.
+    The input can be a (C, H, W) array/tensor or, with ``channels_last=True``, an (H, W, C) one such as an
+    ``np.memmap`` of a slide; only the tiles of the current batch are read into memory.
+    The blended logits are accumulated into ``out``, which may be a preallocated numpy array, an ``np.memmap``
+    or a torch tensor of shape (n_classes, H, W).
+    '''
+
+    def __init__(self, tile_size=224, overlap=0.25, batch_size=8, blend='gaussian', sigma_scale=0.125):
+        assert 0 <= overlap < 1, "overlap must be in [0, 1)"
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.stride = max(1, int(round(tile_size * (1 - overlap))))
+        self.window = get_blend_window(tile_size, blend, sigma_scale)
+
+    def get_tiles(self, height, width):
+        row_starts = get_tile_starts(height, self.tile_size, self.stride)
+        col_starts = get_tile_starts(width, self.tile_size, self.stride)
+        return row_starts, col_starts, [(y, x) for y in row_starts for x in col_starts]
+
+    @torch.inference_mode()
+    def __call__(self, model, image, out=None, channels_last=False):
+        if channels_last:
+            image = image.permute(2, 0, 1) if torch.is_tensor(image) else np.transpose(image, (2, 0, 1))
+        if torch.is_tensor(image) and image.device.type == 'cpu':
+            image = image.numpy()
+        in_channels, height, width = image.shape
+        device = next(model.parameters()).device
+        tile = self.tile_size
+
+        row_starts, col_starts, tiles = self.get_tiles(height, width)
+        row_windows = {s: torch.from_numpy(w).to(device) for s, w in
+                       get_normalized_windows(height, tile, row_starts, self.window).items()}
+        col_windows = {s: torch.from_numpy(w).to(device) for s, w in
+                       get_normalized_windows(width, tile, col_starts, self.window).items()}
+
+        # One reusable host (or device) staging buffer; tiles running over the image border stay zero padded.
+        if torch.is_tensor(image):
+            buffer = torch.zeros((self.batch_size, in_channels, tile, tile), dtype=image.dtype, device=image.device)
+        else:
+            buffer = torch.from_numpy(np.zeros((self.batch_size, in_channels, tile, tile), dtype=image.dtype))
+            if device.type == 'cuda':
+                buffer = buffer.pin_memory()
+            buffer = buffer.numpy()
+
+        for first in range(0, len(tiles), self.batch_size):
+            batch_tiles = tiles[first:first + self.batch_size]
+            n = len(batch_tiles)
+            for i, (y, x) in enumerate(batch_tiles):
+                crop = image[:, y:y + tile, x:x + tile]
+                h, w = crop.shape[1:]
+                if h < tile or w < tile:
+                    buffer[i] = 0
+                buffer[i, :, :h, :w] = crop
+            batch = torch.as_tensor(buffer[:n]).to(device)
+            if not hasattr(model, 'prepare_input'):
+                # CRNS_NET casts (and normalizes) uint8 batches itself, so they travel to the device uint8
+                batch = batch.float()
+
+            logits = model(batch)
+            weights = torch.stack([row_windows[y][:, None] * col_windows[x][None, :] for y, x in batch_tiles])
+            logits = logits * weights.unsqueeze(1).to(logits.dtype)
+
+            if out is None:
+                if torch.is_tensor(image):
+                    out = torch.zeros((logits.shape[1], height, width), dtype=torch.float32, device=device)
+                else:
+                    out = np.zeros((logits.shape[1], height, width), dtype=np.float32)
+            elif first == 0:
+                out[...] = 0
+            if not (torch.is_tensor(out) and out.device == device):
+                logits = logits.float().cpu()
+                if not torch.is_tensor(out):
+                    logits = logits.numpy()
+
+            for i, (y, x) in enumerate(batch_tiles):
+                h, w = min(tile, height - y), min(tile, width - x)
+                out[:, y:y + h, x:x + w] += logits[i, :, :h, :w]
+
+        return out
+
+
+def sliding_window_inference(model, image, tile_size=224, overlap=0.25, batch_size=8, blend='gaussian',
+                             out=None, channels_last=False):
+    inferer = SlidingWindowInferer(tile_size=tile_size, overlap=overlap, batch_size=batch_size, blend=blend)
+    return inferer(model, image, out=out, channels_last=channels_last)
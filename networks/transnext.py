@@ -1,36 +1,32 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.utils.checkpoint
 import numpy as np
 from functools import partial
 from timm.models.layers import DropPath, to_2tuple, trunc_normal_
 from timm.models.registry import register_model
 from timm.models.vision_transformer import _cfg
 import math
-import pkg_resources
+import warnings
 
-
-def is_installed(package_name):
-    try:
-        pkg_resources.get_distribution(package_name)
-        return True
-    except pkg_resources.DistributionNotFound:
-        return False
-
-
-if is_installed('swattention'):
-    print('swattention package found, loading CUDA version of Aggregated Attention')
-    from networks.attention_cuda import AggregatedAttention
-else:
-    print('swattention package not found, loading PyTorch native version of Aggregated Attention')
-    from networks.attention_native import AggregatedAttention
+from networks.attention_backends import get_aggregated_attention, resolve_attention_backend
+from networks.lru_cache import LRUCache, RESOLUTION_CACHE_SIZE
+from networks.profiling import profile_region
 
 import torch
 import torch.nn as nn
-import einops
 from timm.models.layers import trunc_normal_
 
 
+def linear_nchw(linear, x):
+    # nn.Linear over the channel dim of a (B, C, H, W) map, as a 1x1 convolution with the same weights.
+    # Other modules in its place (e.g. dynamically quantized linears) are applied channels-last.
+    if type(linear) is nn.Linear:
+        return F.conv2d(x, linear.weight[:, :, None, None], linear.bias)
+    return linear(x.permute(0, 2, 3, 1)).permute(0, 3, 1, 2)
+
+
 class SlideAttention(nn.Module):
 
     def __init__(
@@ -73,15 +69,14 @@ class SlideAttention(nn.Module):
                                        groups=dim // self.dim_reduction // self.num_heads, padding=self.ka // 2,
                                        padding_mode=padding_mode)
 
-        self.reset_parameters()
-
         # define a parameter table of relative position bias
         if self.rpb:
             self.relative_position_bias_table = nn.Parameter(
                 torch.zeros(1, self.num_heads, 1, self.ka * self.ka, 1, 1))
-            trunc_normal_(self.relative_position_bias_table, std=.02)
         self.softmax = nn.Softmax(dim=3)
 
+        self.reset_parameters()
+
     def reset_parameters(self):
         # shift initialization for group convolution
         kernel = torch.zeros(self.ka * self.ka, self.ka, self.ka)
@@ -89,63 +84,57 @@ class SlideAttention(nn.Module):
             kernel[i, i // self.ka, i % self.ka] = 1.
         kernel = kernel.unsqueeze(1).repeat(self.dim // self.dim_reduction // self.num_heads, 1, 1, 1)
         self.dep_conv.weight = nn.Parameter(data=kernel, requires_grad=False)
+        if self.rpb:
+            trunc_normal_(self.relative_position_bias_table, std=.02)
 
-    def forward(self, x,H22, W22, relative_pos_index, relative_coords_table):
-        # print("xxxxxxxxxxx111111111", x.shape)
-        B1, L1, C1 = x.shape
-        H1 = int(L1**0.5)
-        x = x.reshape(B1, C1, H1, H1)
-
-        x = einops.rearrange(x, 'b c h w -> b h w c')
-        B, H, W, C = x.shape
-
-        # print("xxxxxxxxxxx22222222", x.shape)
-        qkv = self.qkv(x)
-
-        f_conv = qkv.permute(0, 3, 1, 2).reshape(B * self.num_heads,
-                                                 self.qkv_scale * C // self.dim_reduction // self.num_heads, H, W)
-
-        if self.qkv_scale == 3:
-            q = (f_conv[:, :C // self.dim_reduction // self.num_heads, :, :] * self.scale).reshape(B, self.num_heads,
-                                                                                                   C // self.dim_reduction // self.num_heads,
-                                                                                                   1, H, W)
-            k = f_conv[:, C // self.dim_reduction // self.num_heads:2 * C // self.dim_reduction // self.num_heads, :,
-                :]  # B*self.nhead, C//self.nhead, H, W
-            v = f_conv[:, 2 * C // self.dim_reduction // self.num_heads:, :, :]
-        elif self.qkv_scale == 1:
-            q = (f_conv * self.scale).reshape(B, self.num_heads, C // self.dim_reduction // self.num_heads, 1, H, W)
-            k = v = f_conv
-
-        if self.share_dwc_kernel:
-            k = (self.dep_conv(k) + self.dep_conv1(k)).reshape(B, self.num_heads,
-                                                               C // self.dim_reduction // self.num_heads,
-                                                               self.ka * self.ka, H, W)
-            v = (self.dep_conv(v) + self.dep_conv1(v)).reshape(B, self.num_heads,
-                                                               C // self.dim_reduction // self.num_heads,
-                                                               self.ka * self.ka, H, W)
-        else:
-            k = (self.dep_conv(k) + self.dep_conv1(k)).reshape(B, self.num_heads,
-                                                               C // self.dim_reduction // self.num_heads,
-                                                               self.ka * self.ka, H, W)
-            v = (self.dep_conv(v) + self.dep_conv2(v)).reshape(B, self.num_heads,
-                                                               C // self.dim_reduction // self.num_heads,
-                                                               self.ka * self.ka, H, W)
+    def get_kv_weights(self):
+        # dep_conv (the fixed shift kernel) and dep_conv1/dep_conv2 are applied to the same input and summed, which
+        # is one convolution with the summed weights: the shift part costs nothing. K and V are stacked along the
+        # groups, so a single grouped convolution produces the ka*ka neighbourhoods of both.
+        weight_k = self.dep_conv.weight + self.dep_conv1.weight
+        bias_k = self.dep_conv.bias + self.dep_conv1.bias
+        if self.qkv_scale == 1 and self.share_dwc_kernel:
+            # shared qkv and kernels: K and V are the same neighbourhoods
+            return weight_k, bias_k
+        dep_conv_v = self.dep_conv1 if self.share_dwc_kernel else self.dep_conv2
+        weight_v = self.dep_conv.weight + dep_conv_v.weight
+        bias_v = self.dep_conv.bias + dep_conv_v.bias
+        return torch.cat([weight_k, weight_v]), torch.cat([bias_k, bias_v])
+
+    def forward(self, x, H, W, relative_pos_index, relative_coords_table):
+        B, L, C = x.shape
+        head_dim = C // self.dim_reduction // self.num_heads
+        local_len = self.ka * self.ka
+
+        # The token sequence is read as a (B, C, H, W) map (a view of the same memory), so qkv and proj run as
+        # 1x1 convolutions in that layout and no permute/rearrange copies are needed on the way in or out.
+        qkv = linear_nchw(self.qkv, x.reshape(B, C, H, W))
+        f_conv = qkv.reshape(B * self.num_heads, self.qkv_scale * head_dim, H, W)
+
+        q = (f_conv[:, :head_dim] * self.scale).reshape(B, self.num_heads, head_dim, 1, H, W)
+        kv = f_conv[:, head_dim:] if self.qkv_scale == 3 else f_conv
+        weight, bias = self.get_kv_weights()
+        if self.qkv_scale == 1 and not self.share_dwc_kernel:
+            # shared qkv with separate kernels: the same input goes through the K and the V kernels
+            kv = torch.cat([kv, kv], 1)
+        if self.padding_mode != 'zeros':
+            kv = F.pad(kv, [self.ka // 2] * 4, mode=self.padding_mode)
+        kv = F.conv2d(kv, weight, bias, padding=self.ka // 2 if self.padding_mode == 'zeros' else 0,
+                      groups=kv.shape[1]).reshape(B, self.num_heads, -1, head_dim, local_len, H, W)
+        k, v = kv[:, :, 0], kv[:, :, -1]
 
-        if self.rpb:
-            k = k + self.relative_position_bias_table
         attn = (q * k).sum(2, keepdim=True)  # B, self.nhead, 1, k^2, H, W
+        if self.rpb:
+            # q . (k + rpb) == q . k + rpb * sum(q), which avoids materializing k + rpb
+            attn = attn + self.relative_position_bias_table * q.sum(2, keepdim=True)
 
-        attn = self.softmax(attn)
+        attn = self.softmax(attn.float())  # fp32 under reduced-precision autocast
         attn = self.attn_drop(attn)
 
-        x = (attn * v).sum(3).reshape(B, C // self.dim_reduction, H, W).permute(0, 2, 3, 1)
-        x = self.proj(x)
+        x = (attn * v).sum(3).reshape(B, C // self.dim_reduction, H, W)
+        x = linear_nchw(self.proj, x)
         x = self.proj_drop(x)
-        x = einops.rearrange(x, 'b h w c -> b c h w')
-        x = x.reshape(B1, L1, C1)
-
-        # print("xxxxxxxxxxx",x.shape)
-        return x#, None, None
+        return x.reshape(B, L, C)
 
 
 
@@ -187,8 +176,8 @@ class ConvolutionalGLU(nn.Module):
 
 
 @torch.no_grad()
-def get_relative_position_cpb(query_size, key_size, pretrain_size=None):
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+def get_relative_position_cpb(query_size, key_size, pretrain_size=None, device=None):
+    device = device or torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     pretrain_size = pretrain_size or query_size
     axis_qh = torch.arange(query_size[0], dtype=torch.float32, device=device)
     axis_kh = F.adaptive_avg_pool1d(axis_qh.unsqueeze(0), key_size[0]).squeeze(0)
@@ -225,9 +214,8 @@ class Attention(nn.Module):
         self.head_dim = dim // num_heads
         self.temperature = nn.Parameter(
             torch.log((torch.ones(num_heads, 1, 1) / 0.24).exp() - 1))  # Initialize softplus(temperature) to 1/0.24.
-        # Generate sequnce length scale
-        self.register_buffer("seq_length_scale", torch.as_tensor(np.log(input_resolution[0] * input_resolution[1])),
-                             persistent=False)
+        # sequnce length scale is log(H * W) of the current input, deploy-mode biases are kept per resolution
+        self.resolution_cache = LRUCache()
 
         self.qkv = nn.Linear(dim, dim * 3, bias=qkv_bias)
         self.query_embedding = nn.Parameter(
@@ -241,6 +229,23 @@ class Attention(nn.Module):
         self.cpb_fc1 = nn.Linear(2, 512, bias=True)
         self.cpb_act = nn.ReLU(inplace=True)
         self.cpb_fc2 = nn.Linear(512, num_heads, bias=True)
+        self.deploy = False
+
+    def compute_rel_bias(self, relative_pos_index, relative_coords_table, N):
+        with torch.autocast(relative_coords_table.device.type, enabled=False):
+            return self.cpb_fc2(self.cpb_act(self.cpb_fc1(relative_coords_table.float()))).transpose(0, 1)[:,
+                   relative_pos_index.view(-1)].view(-1, N, N)
+
+    def get_rel_bias(self, H, W, relative_pos_index, relative_coords_table):
+        if not self.deploy:
+            return self.compute_rel_bias(relative_pos_index, relative_coords_table, H * W)
+        return self.resolution_cache.get((H, W, relative_coords_table.device),
+                                         lambda: self.compute_rel_bias(relative_pos_index, relative_coords_table,
+                                                                       H * W))
+
+    def switch_to_deploy(self, H, W, relative_pos_index, relative_coords_table):
+        self.deploy = True
+        self.get_rel_bias(H, W, relative_pos_index, relative_coords_table)
 
     def forward(self, x, H, W, relative_pos_index, relative_coords_table):
         B, N, C = x.shape
@@ -248,13 +253,12 @@ class Attention(nn.Module):
         q, k, v = qkv.chunk(3, dim=1)
 
         # Use MLP to generate continuous relative positional bias
-        rel_bias = self.cpb_fc2(self.cpb_act(self.cpb_fc1(relative_coords_table))).transpose(0, 1)[:,
-                   relative_pos_index.view(-1)].view(-1, N, N)
+        rel_bias = self.get_rel_bias(H, W, relative_pos_index, relative_coords_table)
 
         # Calculate attention map using sequence length scaled cosine attention and query embedding
-        attn = ((F.normalize(q, dim=-1) + self.query_embedding) * F.softplus(
-            self.temperature) * self.seq_length_scale) @ F.normalize(k, dim=-1).transpose(-2, -1) + rel_bias
-        attn = attn.softmax(dim=-1)
+        attn = ((F.normalize(q.float(), dim=-1) + self.query_embedding) * F.softplus(
+            self.temperature) * math.log(H * W)) @ F.normalize(k.float(), dim=-1).transpose(-2, -1) + rel_bias
+        attn = attn.float().softmax(dim=-1)
         attn = self.attn_drop(attn)
         x = (attn @ v).transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
@@ -266,7 +270,8 @@ class Block(nn.Module):
 
     def __init__(self, dim, num_heads, input_resolution, window_size=3, mlp_ratio=4.,
                  qkv_bias=False, drop=0., attn_drop=0.,
-                 drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, sr_ratio=1, fixed_pool_size=None):
+                 drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, sr_ratio=1, fixed_pool_size=None,
+                 attention_backend=None):
         super().__init__()
         self.norm1 = norm_layer(dim)
         if sr_ratio == 1:
@@ -278,7 +283,7 @@ class Block(nn.Module):
                 attn_drop=attn_drop,
                 proj_drop=drop)
         else:
-            self.attn = AggregatedAttention(
+            self.attn = get_aggregated_attention(attention_backend)(
                 dim,
                 input_resolution,
                 window_size=window_size,
@@ -329,42 +334,47 @@ class OverlapPatchEmbed(nn.Module):
 
 class TransNeXt(nn.Module):
     '''
-    The parameter "img size" is primarily utilized for generating relative spatial coordinates,
-    which are used to compute continuous relative positional biases. As this TransNeXt implementation does not support multi-scale inputs,
-    it is recommended to set the "img size" parameter to a value that is exactly the same as the resolution of the inference images.
-    It is not advisable to set the "img size" parameter to a value exceeding 800x800.
+    The relative spatial coordinates used to compute continuous relative positional biases, as well as the padding
+    masks and sequence length scales of the attention layers, are generated for the resolution of the actual input on
+    first use and kept in bounded LRU caches ("resolution cache size" entries per stage), so one model can run at
+    arbitrary, also non-square, H x W. For CRNS_NET the input sides have to be multiples of 32 for the decoder skip
+    connections. The parameter "img size" is the default resolution, used for deploy-mode precomputation and pooling
+    size checks.
     The "pretrain size" refers to the "img size" used during the initial pre-training phase,
     which is used to scale the relative spatial coordinates for better extrapolation by the MLP.
     For models trained on ImageNet-1K at a resolution of 224x224,
     as well as downstream task models fine-tuned based on these pre-trained weights,
     the "pretrain size" parameter should be set to 224x224.
+    The "attention backend" selects the AggregatedAttention implementation of this model (see
+    networks/attention_backends.py), by default $CRNS_ATTENTION_BACKEND or the best available one.
     '''
 
     def __init__(self, img_size=224, pretrain_size=None, window_size=[3, 3, 3, None],
                  patch_size=16, in_chans=3, num_classes=1000, embed_dims=[64, 128, 256, 512],
                  num_heads=[1, 2, 4, 8], mlp_ratios=[4, 4, 4, 4], qkv_bias=False, drop_rate=0.,
                  attn_drop_rate=0., drop_path_rate=0., norm_layer=nn.LayerNorm,
-                 depths=[3, 4, 6, 3], sr_ratios=[8, 4, 2, 1], num_stages=4, fixed_pool_size=None):
+                 depths=[3, 4, 6, 3], sr_ratios=[8, 4, 2, 1], num_stages=4, fixed_pool_size=None,
+                 resolution_cache_size=RESOLUTION_CACHE_SIZE, attention_backend=None):
         super().__init__()
         self.num_classes = num_classes
+        self.attention_backend = resolve_attention_backend(attention_backend)
         self.depths = depths
         self.num_stages = num_stages
         pretrain_size = pretrain_size or img_size
-
-        dpr = [x.item() for x in torch.linspace(0, drop_path_rate, sum(depths))]  # stochastic depth decay rule
+        self.img_size = img_size
+        self.pretrain_size = pretrain_size
+        self.sr_ratios = sr_ratios
+        self.fixed_pool_size = fixed_pool_size
+        self.relative_position_cache = LRUCache(resolution_cache_size * num_stages)
+        # activation checkpointing of the stages' blocks, see set_activation_checkpointing
+        self.checkpoint_granularity = None
+        self.checkpoint_stages = set()
+
+        # stochastic depth decay rule, on the CPU explicitly so the model can also be built on the meta device
+        dpr = [x.item() for x in torch.linspace(0, drop_path_rate, sum(depths), device='cpu')]
         cur = 0
 
         for i in range(num_stages):
-            # Generate relative positional coordinate table and index for each stage to compute continuous relative positional bias.
-            relative_pos_index, relative_coords_table = get_relative_position_cpb(
-                query_size=to_2tuple(img_size // (2 ** (i + 2))),
-                key_size=to_2tuple(img_size // ((2 ** (i + 2)) * sr_ratios[i])) if (
-                        fixed_pool_size is None or sr_ratios[i] == 1) else to_2tuple(fixed_pool_size),
-                pretrain_size=to_2tuple(pretrain_size // (2 ** (i + 2))))
-
-            self.register_buffer(f"relative_pos_index{i + 1}", relative_pos_index, persistent=False)
-            self.register_buffer(f"relative_coords_table{i + 1}", relative_coords_table, persistent=False)
-
             patch_embed = OverlapPatchEmbed(patch_size=patch_size * 2 - 1 if i == 0 else 3,
                                             stride=patch_size if i == 0 else 2,
                                             in_chans=in_chans if i == 0 else embed_dims[i - 1],
@@ -374,7 +384,7 @@ class TransNeXt(nn.Module):
                 dim=embed_dims[i], input_resolution=to_2tuple(img_size // (2 ** (i + 2))), window_size=window_size[i],
                 num_heads=num_heads[i], mlp_ratio=mlp_ratios[i], qkv_bias=qkv_bias,
                 drop=drop_rate, attn_drop=attn_drop_rate, drop_path=dpr[cur + j], norm_layer=norm_layer,
-                sr_ratio=sr_ratios[i], fixed_pool_size=fixed_pool_size)
+                sr_ratio=sr_ratios[i], fixed_pool_size=fixed_pool_size, attention_backend=self.attention_backend)
                 for j in range(depths[i])])
             norm = norm_layer(embed_dims[i])
             cur += depths[i]
@@ -385,6 +395,26 @@ class TransNeXt(nn.Module):
 
         for n, m in self.named_modules():
             self._init_weights(m, n)
+            if hasattr(m, 'resolution_cache'):
+                m.resolution_cache.maxsize = resolution_cache_size
+
+    def get_relative_position(self, stage, H, W, device):
+        # Relative positional coordinate table and index of a stage, used to compute the continuous relative
+        # positional bias.
+        # Stages with sr_ratio 1 run SlideAttention, which has no use for them.
+        if self.sr_ratios[stage] == 1:
+            return None, None
+
+        def build():
+            if self.fixed_pool_size is None:
+                key_size = (H // self.sr_ratios[stage], W // self.sr_ratios[stage])
+            else:
+                key_size = to_2tuple(self.fixed_pool_size)
+            return get_relative_position_cpb(query_size=(H, W), key_size=key_size,
+                                             pretrain_size=to_2tuple(self.pretrain_size // (2 ** (stage + 2))),
+                                             device=device)
+
+        return self.relative_position_cache.get((stage, H, W, device), build)
 
     def _init_weights(self, m: nn.Module, name: str = ''):
         if isinstance(m, nn.Linear):
@@ -401,6 +431,67 @@ class TransNeXt(nn.Module):
             nn.init.zeros_(m.bias)
             nn.init.ones_(m.weight)
 
+    def set_attention_chunk_size(self, chunk_size=None):
+        '''
+        Chunked execution of the AggregatedAttention blocks: query tokens are processed in row bands of at most
+        ``chunk_size`` tokens, which caps the attention's working memory on large inputs at the cost of some
+        speed. ``None`` turns it off. Only backends with a ``chunk_size`` attribute (the native one) support it.
+        '''
+        modules = [m for m in self.modules() if hasattr(m, 'chunk_size')]
+        if not modules and any(sr != 1 for sr in self.sr_ratios):
+            warnings.warn(f"The {self.attention_backend} attention backend has no chunked execution, "
+                          f"set_attention_chunk_size has no effect.")
+        for m in modules:
+            m.chunk_size = chunk_size
+        return self
+
+    def set_activation_checkpointing(self, granularity='block', stages=None):
+        '''
+        Activation checkpointing for training with larger batches or crops: the activations inside the checkpointed
+        segments (unfolded keys/values, attention maps, ConvGLU hidden states) are not kept for backward but
+        recomputed from the segment input. ``granularity`` 'block' checkpoints every Block, keeping one activation
+        per block; 'stage' checkpoints the blocks of a stage as one segment, keeping only the stage input at the
+        price of a larger peak while one stage is recomputed. ``stages`` are the 0-based stage indices (default
+        all), ``granularity=None`` turns checkpointing off. Forwards without autograd are not affected.
+        '''
+        if granularity not in (None, 'block', 'stage'):
+            raise ValueError(f"Unknown checkpoint granularity {granularity}, expected 'block', 'stage' or None.")
+        self.checkpoint_granularity = granularity
+        self.checkpoint_stages = set() if granularity is None else set(range(self.num_stages) if stages is None
+                                                                            else stages)
+        return self
+
+    def forward_blocks(self, stage, x, H, W, relative_pos_index, relative_coords_table):
+        for blk in getattr(self, f"block{stage + 1}"):
+            x = blk(x, H, W, relative_pos_index, relative_coords_table)
+        return x
+
+    @torch.no_grad()
+    def assign_pretrained(self, state_dict, device='cpu'):
+        '''
+        Lazy construction path for a model built on the meta device (see ImageBranch): the checkpoint tensors
+        (e.g. memory-mapped by torch.load(..., mmap=True)) are assigned without a copy, and only the weights
+        missing from the checkpoint are allocated on ``device`` and initialized the way __init__ would (the
+        module's reset_parameters, then _init_weights). Returns load_state_dict's (missing_keys, unexpected_keys).
+        '''
+        missing_keys, unexpected_keys = self.load_state_dict(state_dict, strict=False, assign=True)
+        missing_modules = {key.rpartition('.')[0] for key in missing_keys}
+        for name, m in self.named_modules():
+            if name not in missing_modules:
+                continue
+            if not hasattr(m, 'reset_parameters'):
+                raise RuntimeError(f"Cannot initialize the missing weights of {name} ({type(m).__name__}) lazily, "
+                                   f"load the checkpoint into a regularly constructed model instead.")
+            m.to_empty(device=device, recurse=False)
+            m.reset_parameters()
+            self._init_weights(m, name)
+        # reset_parameters may also replace checkpoint tensors of submodules (SlideAttention's shift kernel)
+        self.load_state_dict(state_dict, strict=False, assign=True)
+        meta = [name for name, t in list(self.named_parameters()) + list(self.named_buffers()) if t.is_meta]
+        if meta:
+            raise RuntimeError(f"Weights neither in the checkpoint nor initialized: {meta}")
+        return missing_keys, unexpected_keys
+
     @torch.jit.ignore
     def no_weight_decay(self):
         return {}
@@ -416,27 +507,65 @@ class TransNeXt(nn.Module):
         self.num_classes = num_classes
         self.head = nn.Linear(self.embed_dim, num_classes) if num_classes > 0 else nn.Identity()
 
-    def forward_features(self, x):
+    def forward_stage(self, i, x):
         B = x.shape[0]
+        patch_embed = getattr(self, f"patch_embed{i + 1}")
+        block = getattr(self, f"block{i + 1}")
+        norm = getattr(self, f"norm{i + 1}")
+        x, H, W = patch_embed(x)
+        relative_pos_index, relative_coords_table = self.get_relative_position(i, H, W, x.device)
+        checkpointed = i in self.checkpoint_stages and torch.is_grad_enabled()
+        if checkpointed and self.checkpoint_granularity == 'stage':
+            x = torch.utils.checkpoint.checkpoint(self.forward_blocks, i, x, H, W, relative_pos_index,
+                                                  relative_coords_table, use_reentrant=False)
+        elif checkpointed:
+            for blk in block:
+                x = torch.utils.checkpoint.checkpoint(blk, x, H, W, relative_pos_index, relative_coords_table,
+                                                      use_reentrant=False)
+        else:
+            x = self.forward_blocks(i, x, H, W, relative_pos_index, relative_coords_table)
+        x = norm(x)
+
+        with profile_region(f"encoder/stage{i + 1}/reshape"):
+            return x.reshape(B, H, W, -1).permute(0, 3, 1, 2).contiguous()
+
+    def forward_features(self, x):
         downsample = []
         downsample.append(x)
         for i in range(self.num_stages):
-            patch_embed = getattr(self, f"patch_embed{i + 1}")
-            block = getattr(self, f"block{i + 1}")
-            norm = getattr(self, f"norm{i + 1}")
-            x, H, W = patch_embed(x)
-            relative_pos_index = getattr(self, f"relative_pos_index{i + 1}")
-            relative_coords_table = getattr(self, f"relative_coords_table{i + 1}")
-            for blk in block:
-                x = blk(x, H, W, relative_pos_index, relative_coords_table)
-            x = norm(x)
-
-            if i != (self.num_stages):
-                x = x.reshape(B, H, W, -1).permute(0, 3, 1, 2).contiguous()
+            # (regions recorded under networks.profiling.profile_stages, no-ops otherwise)
+            with profile_region(f"encoder/stage{i + 1}"):
+                x = self.forward_stage(i, x)
             downsample.append(x)
 
         return x, downsample
 
+    @torch.no_grad()
+    def switch_to_deploy(self, check_input=None, atol=1e-5):
+        '''
+        One-shot conversion for inference: every attention block evaluates its continuous relative position
+        bias (cpb MLP + gather over the relative position index) once per input resolution and keeps it, so the
+        forward pass skips both. The biases of the default resolution ("img size") are precomputed here, other
+        resolutions on their first forward. The conversion is not meant to be trained further.
+        If ``check_input`` is given, the outputs before and after the conversion are compared and a
+        RuntimeError is raised when they differ by more than ``atol``.
+        '''
+        reference = self.forward_features(check_input) if check_input is not None else None
+        device = next(self.parameters()).device
+        for i in range(self.num_stages):
+            H = W = self.img_size // (2 ** (i + 2))
+            relative_pos_index, relative_coords_table = self.get_relative_position(i, H, W, device)
+            for blk in getattr(self, f"block{i + 1}"):
+                if hasattr(blk.attn, 'switch_to_deploy'):
+                    blk.attn.switch_to_deploy(H, W, relative_pos_index, relative_coords_table)
+        if reference is not None:
+            deployed = self.forward_features(check_input)
+            max_diff = max((a - b).abs().max().item() for a, b in zip([reference[0]] + reference[1],
+                                                                      [deployed[0]] + deployed[1]))
+            if max_diff > atol:
+                raise RuntimeError(f"Deploy mode output differs from training mode by {max_diff:.3e} > {atol:.1e}")
+        return self
+
     def forward(self, x):
         x, downsample = self.forward_features(x)
 
@@ -0,0 +1,78 @@
+import torch
+import torch.nn as nn
+
+# A view is (k, flip): k quarter turns over (H, W) as np.rot90, then optionally a flip of the W axis. The 8 views
+# form the rot90 / flip family random_rot_flip draws from in training (utils/get_datasets.py).
+VIEW_SETS = {
+    'identity': [(0, False)],
+    'flip': [(0, False), (0, True), (2, True)],  # none, horizontal, vertical
+    'rot90': [(k, False) for k in range(4)],
+    'd4': [(k, flip) for flip in (False, True) for k in range(4)],
+}
+MERGE_MODES = ('mean', 'max')
+
+
+def get_views(views):
+    if isinstance(views, str):
+        if views not in VIEW_SETS:
+            raise ValueError(f"Unknown view set {views}, expected one of {sorted(VIEW_SETS)}.")
+        return list(VIEW_SETS[views])
+    views = [(int(k) % 4, bool(flip)) for k, flip in views]
+    if not views:
+        raise ValueError("At least one view is needed.")
+    return views
+
+
+def apply_view(x, view):
+    k, flip = view
+    x = torch.rot90(x, k, dims=(-2, -1)) if k else x
+    return x.flip(-1) if flip else x
+
+
+def invert_view(x, view):
+    k, flip = view
+    x = x.flip(-1) if flip else x
+    return torch.rot90(x, -k, dims=(-2, -1)) if k else x
+
+
+class TestTimeAugmentation(nn.Module):
+    '''
+    Test-time augmentation around CRNS_NET: the ``views`` (a name of VIEW_SETS or a list of (k, flip) pairs) of a
+    (B, C, H, W) batch are stacked into one (V * B, C, H, W) batch, pushed through ``net`` in a single forward
+    (or in chunks of at most ``max_batch_size``), mapped back to the input orientation and merged by ``merge``
+    ('mean' or 'max' over the views' logits). Everything stays on the device of the input.
+
+        tta = TestTimeAugmentation(net.eval(), views='d4', merge='mean')
+        logits = tta(images)   # also usable as the model of SlidingWindowInferer
+
+    For non-square inputs the odd quarter turns swap H and W and run as a second forward.
+    '''
+
+    def __init__(self, net, views='d4', merge='mean', max_batch_size=None):
+        super().__init__()
+        if merge not in MERGE_MODES:
+            raise ValueError(f"Unknown merge mode {merge}, expected one of {MERGE_MODES}.")
+        self.net = net
+        self.views = get_views(views)
+        self.merge = merge
+        self.max_batch_size = max_batch_size
+
+    def prepare_input(self, x_in):
+        # present like CRNS_NET so SlidingWindowInferer hands uint8 tiles over uncast
+        return self.net.prepare_input(x_in)
+
+    def run(self, batch):
+        if self.max_batch_size is None or batch.shape[0] <= self.max_batch_size:
+            return self.net(batch)
+        return torch.cat([self.net(chunk) for chunk in batch.split(self.max_batch_size)])
+
+    def forward(self, x_in):
+        groups = {}
+        for view in self.views:
+            groups.setdefault(view[0] % 2 if x_in.shape[-2] != x_in.shape[-1] else 0, []).append(view)
+        outputs = []
+        for views in groups.values():
+            logits = self.run(torch.cat([apply_view(x_in, view) for view in views])).split(len(x_in))
+            outputs.extend(invert_view(view_logits, view) for view, view_logits in zip(views, logits))
+        outputs = torch.stack(outputs)
+        return outputs.mean(0) if self.merge == 'mean' else outputs.amax(0)
@@ -0,0 +1,174 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+# sRGB (D65) <-> XYZ, the conversion cv2 uses for 8-bit COLOR_BGR2LAB / COLOR_LAB2BGR
+RGB_TO_XYZ = [[0.412453, 0.357580, 0.180423],
+              [0.212671, 0.715160, 0.072169],
+              [0.019334, 0.119193, 0.950227]]
+WHITE_POINT = [0.950456, 1.0, 1.088754]
+
+AUGMENTATION_TYPES = ['brightness', 'contrast', 'saturation', 'color', 'none']
+
+
+def srgb_to_linear(x):
+    return torch.where(x > 0.04045, ((x + 0.055) / 1.055) ** 2.4, x / 12.92)
+
+
+def linear_to_srgb(x):
+    x = x.clamp(min=0)
+    return torch.where(x > 0.0031308, 1.055 * x ** (1 / 2.4) - 0.055, x * 12.92)
+
+
+def bgr_to_lab(image):
+    # (B, 3, H, W) BGR in [0, 255] -> cv2 8-bit Lab encoding (L * 255 / 100, a + 128, b + 128)
+    rgb = srgb_to_linear(image.flip(1) / 255)
+    xyz = torch.einsum('ij,bjhw->bihw', rgb.new_tensor(RGB_TO_XYZ), rgb) / rgb.new_tensor(WHITE_POINT).view(1, 3, 1, 1)
+    f = torch.where(xyz > 0.008856, xyz.clamp(min=1e-12) ** (1 / 3), 7.787 * xyz + 16 / 116)
+    L = torch.where(xyz[:, 1] > 0.008856, 116 * f[:, 1] - 16, 903.3 * xyz[:, 1])
+    a = 500 * (f[:, 0] - f[:, 1])
+    b = 200 * (f[:, 1] - f[:, 2])
+    return torch.stack([L * 255 / 100, a + 128, b + 128], dim=1)
+
+
+def lab_to_bgr(lab):
+    L, a, b = lab[:, 0] * 100 / 255, lab[:, 1] - 128, lab[:, 2] - 128
+    fy = (L + 16) / 116
+    f = torch.stack([fy + a / 500, fy, fy - b / 200], dim=1)
+    xyz = torch.where(f > 0.206893, f ** 3, (f - 16 / 116) / 7.787) * lab.new_tensor(WHITE_POINT).view(1, 3, 1, 1)
+    rgb = torch.einsum('ij,bjhw->bihw', torch.linalg.inv(lab.new_tensor(RGB_TO_XYZ)), xyz)
+    return (linear_to_srgb(rgb) * 255).clamp(0, 255).flip(1)
+
+
+def batch_rot_flip(image, label, k, axis):
+    # np.rot90 in the (H, W) plane followed by np.flip along H (axis 0) or W (axis 1), grouped by (k, axis)
+    for rot in range(4):
+        for flip_axis in range(2):
+            index = ((k == rot) & (axis == flip_axis)).nonzero().flatten()
+            if len(index) == 0:
+                continue
+            image[index] = torch.rot90(image[index], rot, dims=(2, 3)).flip(2 + flip_axis)
+            label[index] = torch.rot90(label[index], rot, dims=(1, 2)).flip(1 + flip_axis)
+    return image, label
+
+
+def batch_rotate(image, label, angle):
+    # ndimage.rotate(..., order=0, reshape=False) around the image centre, zero fill, for a per-sample angle
+    B, _, H, W = image.shape
+    radians = angle.to(image.device, torch.float32) * math.pi / 180
+    cos, sin = radians.cos(), radians.sin()
+    theta = torch.zeros(B, 2, 3, device=image.device)
+    theta[:, 0, 0], theta[:, 0, 1] = cos, -sin * H / W
+    theta[:, 1, 0], theta[:, 1, 1] = sin * W / H, cos
+    grid = F.affine_grid(theta, (B, 1, H, W), align_corners=False)
+    image = F.grid_sample(image, grid, mode='nearest', padding_mode='zeros', align_corners=False)
+    label = F.grid_sample(label.unsqueeze(1).float(), grid, mode='nearest', padding_mode='zeros',
+                          align_corners=False).squeeze(1).to(label.dtype)
+    return image, label
+
+
+def batch_brightness(image, factor):
+    return (image * factor.view(-1, 1, 1, 1)).clamp(0, 255).floor()
+
+
+def batch_contrast(image, factor):
+    mean = image.mean(dim=(1, 2, 3), keepdim=True)
+    return ((image - mean) * factor.view(-1, 1, 1, 1) + mean).clamp(0, 255).floor()
+
+
+def batch_saturation(image, factor):
+    # Scaling S of HSV with H and V fixed moves every channel towards V by the same ratio, capped where S reaches 1.
+    value = image.max(dim=1, keepdim=True).values
+    minimum = image.min(dim=1, keepdim=True).values
+    saturation = torch.where(value > 0, (value - minimum) / value.clamp(min=1e-6), torch.zeros_like(value))
+    ratio = torch.minimum(factor.view(-1, 1, 1, 1).expand_as(value), 1 / saturation.clamp(min=1e-6))
+    return (value - (value - image) * ratio).clamp(0, 255).round()
+
+
+def batch_color(image, factor):
+    lab = bgr_to_lab(image)
+    ab = (lab[:, 1:] * factor.view(-1, 1, 1, 1)).clamp(0, 255).floor()
+    return lab_to_bgr(torch.cat([lab[:, :1].round(), ab], dim=1)).round()
+
+
+def zoom_nearest_index(in_size, out_size, device):
+    # index map of scipy.ndimage.zoom(order=0), which aligns the corner pixels
+    if out_size == 1:
+        return torch.zeros(1, dtype=torch.long, device=device)
+    return torch.round(torch.arange(out_size, device=device, dtype=torch.float64) * (in_size - 1) /
+                       (out_size - 1)).long()
+
+
+class BatchRandomGenerator(object):
+    '''
+    Batch-level counterpart of RandomGenerator for a collated batch of raw training samples, i.e.
+    GetDatasets(split='train') without a per-sample transform. Every sample independently gets the same schedule as
+    RandomGenerator: rot90 + flip with p=0.5, otherwise a rotation in [-20, 20) degrees with p=0.5, then one of
+    brightness / contrast / saturation / color / none, then a resize to ``output_size`` (bicubic image, nearest label).
+    All transforms are vectorized tensor ops on the batch's device, so the batch can be moved to the GPU first:
+
+        sample = batch_generator(next(loader_iter))   # {'image': B x C x h x w float32, 'label': B x h x w long}
+
+    Images are expected channels-last (B, H, W, C) BGR as stored in the npz files, ``channels_last=False``
+    accepts (B, C, H, W). rot90 by an odd k needs square inputs, non-square batches only draw k in {0, 2}.
+    '''
+
+    def __init__(self, output_size, channels_last=True, generator=None):
+        self.output_size = output_size
+        self.channels_last = channels_last
+        self.generator = generator
+
+    def rand(self, *size):
+        return torch.rand(*size, generator=self.generator)
+
+    def randint(self, low, high, size):
+        return torch.randint(low, high, size, generator=self.generator)
+
+    def uniform(self, low, high, size):
+        return low + (high - low) * self.rand(size)
+
+    def __call__(self, sample):
+        image, label = sample['image'], sample['label']
+        if self.channels_last:
+            image = image.permute(0, 3, 1, 2)
+        image, label = image.to(torch.float32, copy=True), label.clone()
+        B, _, H, W = image.shape
+        device = image.device
+
+        # 形状增强
+        geometry = self.rand(B)
+        rot_flip = geometry > 0.5
+        rotate = ~rot_flip & (self.rand(B) > 0.5)
+        if rot_flip.any():
+            index = rot_flip.nonzero().flatten().to(device)
+            k = self.randint(0, 4, (len(index),))
+            if H != W:
+                k = k - k % 2
+            image[index], label[index] = batch_rot_flip(image[index], label[index], k,
+                                                        self.randint(0, 2, (len(index),)))
+        if rotate.any():
+            index = rotate.nonzero().flatten().to(device)
+            image[index], label[index] = batch_rotate(image[index], label[index],
+                                                      self.randint(-20, 20, (len(index),)).float())
+
+        # 输入增强
+        augmentation_type = self.randint(0, len(AUGMENTATION_TYPES), (B,))
+        # same gain ranges as RandomGenerator, AUGMENTATION_TYPES[4] ('none') leaves the sample untouched
+        for type_id, (op, factor) in enumerate([(batch_brightness, 0.5), (batch_contrast, 0.25),
+                                                (batch_saturation, 0.5), (batch_color, 0.1)]):
+            index = (augmentation_type == type_id).nonzero().flatten().to(device)
+            if len(index):
+                image[index] = op(image[index], self.uniform(1 - factor, 1 + factor, len(index)).to(device))
+
+        if H != self.output_size[0] or W != self.output_size[1]:
+            # bicubic overshoots the pixel range, round back to the uint8 values the rest of the pipeline sees
+            image = F.interpolate(image, size=tuple(self.output_size), mode='bicubic', align_corners=True)
+            image = image.clamp(0, 255).round()
+            rows = zoom_nearest_index(H, self.output_size[0], device)
+            cols = zoom_nearest_index(W, self.output_size[1], device)
+            label = label[:, rows][:, :, cols]
+
+        sample = dict(sample)
+        sample['image'], sample['label'] = image, label.long()
+        return sample
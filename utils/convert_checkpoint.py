@@ -0,0 +1,51 @@
+"""Convert the pretrained TransNeXt checkpoint into the pre-filtered backbone file ImageBranch loads lazily.
+
+    python -m utils.convert_checkpoint --src pretrained_ckpt/transnext_base_224_1k.pth \
+        --dst pretrained_ckpt/transnext_base_224_1k_backbone.pth
+
+The converted file only holds the tensors the encoder actually loads: the classification head, the replaced block4
+attention weights and keys the encoder does not have are dropped once here instead of on every construction.
+Every tensor gets its own storage and the file is written in torch's zip format, so torch.load(..., mmap=True)
+maps it instead of reading it.
+"""
+import argparse
+import os
+
+import torch
+
+from networks.ImageBranch import CONVERTED_CKPT, PRETRAINED_CKPT, filter_pretrained_state_dict, load_checkpoint
+from networks.transnext import transnext_base
+
+
+def convert_checkpoint(src=PRETRAINED_CKPT, dst=CONVERTED_CKPT):
+    state_dict = filter_pretrained_state_dict(load_checkpoint(src))
+    with torch.device('meta'):
+        expected = transnext_base().state_dict()
+    backbone = {k: v.detach().clone(memory_format=torch.contiguous_format) for k, v in state_dict.items()
+                if k in expected and v.shape == expected[k].shape}
+    dropped = sorted(set(state_dict) - set(backbone))
+    missing = sorted(set(expected) - set(backbone))
+
+    directory = os.path.dirname(dst)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    torch.save({'backbone': backbone, 'source': os.path.basename(src)}, dst + '.tmp')
+    os.replace(dst + '.tmp', dst)
+    return backbone, dropped, missing
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src', default=PRETRAINED_CKPT)
+    parser.add_argument('--dst', default=CONVERTED_CKPT)
+    args = parser.parse_args()
+    backbone, dropped, missing = convert_checkpoint(args.src, args.dst)
+    print(f"{args.dst}: {len(backbone)} tensors, {os.path.getsize(args.dst) / 2 ** 20:.1f} MB")
+    if dropped:
+        print(f"Dropped keys not used by the encoder: {dropped}")
+    if missing:
+        print(f"Encoder keys initialized at construction: {missing}")
+
+
+if __name__ == '__main__':
+    main()
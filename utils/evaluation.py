@@ -0,0 +1,165 @@
+"""Dice, AJI and PQ of CRNS_NET outputs against the labels of a GetDatasets split.
+
+Instances are matched through one overlap matrix per case (pixel counts of every (true, predicted) instance pair,
+built with a single bincount), so the cost grows with the number of pixels rather than with instances^2 passes
+over the image. Ground-truth instances are the nucleus regions of the label split along its edge class (see
+utils/instances.py), predicted ones come from extract_instances.
+"""
+import mmap
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils.instances import BACKGROUND, EDGE, NUCLEUS, as_numpy, decode_output, watershed_instances
+
+METRICS = ['dice', 'dice_nucleus', 'dice_edge', 'aji', 'dq', 'sq', 'pq']
+
+
+class MappedOutput(namedtuple('MappedOutput', ['filename', 'dtype', 'shape', 'offset'])):
+    # an np.memmap output (e.g. of SlidingWindowInferer) sent to a worker as its file and layout, mapped again there
+    def load(self):
+        return np.memmap(self.filename, self.dtype, 'r', self.offset, self.shape)
+
+
+def shareable(output):
+    if isinstance(output, np.memmap) and isinstance(output.base, mmap.mmap) and output.flags.c_contiguous:
+        return MappedOutput(output.filename, output.dtype.str, output.shape, output.offset)
+    return as_numpy(output)
+
+
+def dice(pred, true):
+    total = pred.sum() + true.sum()
+    return 2 * np.logical_and(pred, true).sum() / total if total else 1.
+
+
+def relabel_sequential(instances):
+    # labels 1..n in increasing order of the original labels, 0 stays background
+    instances = np.asarray(instances)
+    values = np.unique(instances)
+    values = values[values != 0]
+    relabelled = np.searchsorted(values, instances).astype(np.int32) + 1
+    relabelled[instances == 0] = 0
+    return relabelled
+
+
+def overlap_matrix(true, pred):
+    '''
+    (n_true + 1, n_pred + 1) pixel counts of every (true, pred) label pair of two instance maps labelled 1..n, row
+    and column 0 being the background.
+    '''
+    n_true, n_pred = int(true.max(initial=0)), int(pred.max(initial=0))
+    pairs = true.ravel().astype(np.int64) * (n_pred + 1) + pred.ravel()
+    return np.bincount(pairs, minlength=(n_true + 1) * (n_pred + 1)).reshape(n_true + 1, n_pred + 1)
+
+
+def instance_metrics(true, pred, iou_threshold=0.5):
+    '''
+    AJI and panoptic quality (DQ, SQ, PQ) of two instance maps labelled 1..n. AJI pairs every true instance with
+    the predicted one of highest IoU and adds the never paired predictions to the union; PQ matches pairs with IoU
+    above ``iou_threshold`` (>= 0.5, which makes the matching unique). Metrics without any instance are nan.
+    '''
+    if iou_threshold < 0.5:
+        raise ValueError(f"iou_threshold must be at least 0.5 for a unique matching, got {iou_threshold}.")
+    counts = overlap_matrix(true, pred)
+    true_area, pred_area = counts.sum(1)[1:], counts.sum(0)[1:]
+    intersection = counts[1:, 1:]
+    union = true_area[:, None] + pred_area[None, :] - intersection
+    iou = intersection / np.maximum(union, 1)
+    n_true, n_pred = intersection.shape
+
+    if n_pred:
+        rows = np.arange(n_true)
+        best = iou.argmax(1)
+        paired = intersection[rows, best] > 0
+        rows, best = rows[paired], best[paired]
+        aji_intersection = intersection[rows, best].sum()
+        used = np.zeros(n_pred, bool)
+        used[best] = True
+        aji_union = union[rows, best].sum() + true_area[~paired].sum() + pred_area[~used].sum()
+    else:
+        aji_intersection, aji_union = 0, true_area.sum()
+
+    matched = iou[iou > iou_threshold]
+    tp = len(matched)
+    fp, fn = n_pred - tp, n_true - tp
+    detections = tp + 0.5 * fp + 0.5 * fn
+    dq = tp / detections if detections else np.nan
+    sq = matched.sum() / tp if tp else (0. if detections else np.nan)
+    return {'aji': aji_intersection / aji_union if aji_union else np.nan, 'dq': dq, 'sq': sq, 'pq': dq * sq,
+            'tp': tp, 'fp': fp, 'fn': fn}
+
+
+def evaluate_case(output, label, true_instances=None, iou_threshold=0.5, min_size=10, marker_erosion=1):
+    '''
+    Metrics of one case: ``output`` as accepted by utils.instances.decode_output (or a MappedOutput), ``label`` the
+    (H, W) class label and ``true_instances`` an optional ground-truth instance map (by default derived from
+    ``label``).
+    '''
+    if isinstance(output, MappedOutput):
+        output = output.load()
+    class_map, cost = decode_output(output)
+    label = np.asarray(label).astype(np.uint8, copy=False)
+    pred_instances = watershed_instances(class_map, cost, min_size=min_size, marker_erosion=marker_erosion)
+    if true_instances is None:
+        true_instances = watershed_instances(*decode_output(label), min_size=1, marker_erosion=0)
+    else:
+        true_instances = relabel_sequential(true_instances)
+
+    metrics = {'dice': dice(class_map != BACKGROUND, label != BACKGROUND),
+               'dice_nucleus': dice(class_map == NUCLEUS, label == NUCLEUS),
+               'dice_edge': dice(class_map == EDGE, label == EDGE)}
+    metrics.update(instance_metrics(true_instances, pred_instances, iou_threshold))
+    return metrics
+
+
+def aggregate(per_case):
+    # mean of every metric over the cases where it is defined, and the match counts summed over all cases
+    values = {name: [metrics[name] for metrics in per_case.values() if not np.isnan(metrics[name])]
+              for name in METRICS}
+    summary = {name: float(np.mean(v)) if v else np.nan for name, v in values.items()}
+    for name in ['tp', 'fp', 'fn']:
+        summary[name] = int(sum(metrics[name] for metrics in per_case.values()))
+    summary['cases'] = len(per_case)
+    return summary
+
+
+def evaluate(outputs, dataset, num_workers=None, true_instances=None, **kwargs):
+    '''
+    Per-case and aggregate Dice / AJI / PQ of model outputs over a GetDatasets split:
+
+        per_case, summary = evaluate({case_name: logits, ...}, GetDatasets(base_dir, list_dir, 'test'))
+
+    ``outputs`` maps case names (or dataset indices, for a list) to (n_classes, H, W) logits or (H, W) class maps,
+    numpy or torch; ``true_instances`` optionally does the same for ground-truth instance maps. The labels are read
+    with GetDatasets.load_sample, so no transform is applied. Cases are spread over ``num_workers`` processes
+    (default one per CPU, 0 or 1 runs in this process) and loaded only as the workers need them, at most two per
+    worker in flight; np.memmap outputs are mapped again in the worker instead of being copied. ``kwargs`` go to
+    evaluate_case.
+    '''
+    def cases():
+        for idx in range(len(dataset)):
+            case_name = dataset.sample_list[idx].strip('\n')
+            key = case_name if isinstance(outputs, dict) else idx
+            case_instances = None if true_instances is None else true_instances[key]
+            yield case_name, (shareable(outputs[key]), dataset.load_sample(idx)[1], case_instances)
+
+    per_case = {}
+    if (num_workers is not None and num_workers <= 1) or len(dataset) <= 1:
+        for case_name, args in cases():
+            per_case[case_name] = evaluate_case(*args, **kwargs)
+        return per_case, aggregate(per_case)
+
+    max_pending = 2 * (num_workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(num_workers) as pool:
+        pending = deque()
+        for case_name, args in cases():
+            pending.append((case_name, pool.submit(evaluate_case, *args, **kwargs)))
+            if len(pending) >= max_pending:
+                case_name, future = pending.popleft()
+                per_case[case_name] = future.result()
+        while pending:
+            case_name, future = pending.popleft()
+            per_case[case_name] = future.result()
+    return per_case, aggregate(per_case)
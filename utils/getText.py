@@ -1,18 +1,19 @@
-import os
-import clip
 import torch
 
+from utils.prompt_store import PromptEmbeddingStore
+
 ## PAOT
 ORGAN_NAME = ['back ground', 'cell nucleus', 'edge']
 
-# Load the model
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load('ViT-B/32', device)
 
-text_inputs = torch.cat([clip.tokenize(f'A computerized tomography of a {item}') for item in ORGAN_NAME]).to(device)
+def get_prompts(names=ORGAN_NAME):
+    return [f'A computerized tomography of a {item}' for item in names]
+
 
-# Calculate text embedding features
-with torch.no_grad():
-    text_features = model.encode_text(text_inputs)
+if __name__ == '__main__':
+    # python -m utils.getText
+    # Encodes the prompts missing from the store with the CLIP text tower only; CRNS_NET.set_prompts reads them back.
+    store = PromptEmbeddingStore()
+    text_features = store.populate(get_prompts())
     print(text_features.shape, text_features.dtype)
-    torch.save(text_features, 'txt_encoding_nucleus.pth')
\ No newline at end of file
+    torch.save(text_features, 'txt_encoding_nucleus.pth')
@@ -7,6 +7,8 @@ from scipy import ndimage
 from scipy.ndimage.interpolation import zoom
 from torch.utils.data import Dataset
 
+from utils.pack_dataset import get_packed_paths
+
 
 def random_rot_flip(image, label):
     k = np.random.randint(0, 4)
@@ -91,8 +93,10 @@ def random_color(image, color_factor=0.5):
 
 class RandomGenerator(object):
 
-    def __init__(self, output_size):
+    def __init__(self, output_size, compact=False):
+        # compact=True keeps the image uint8 (C, H, W) and the label uint8, CRNS_NET casts them on its device
         self.output_size = output_size
+        self.compact = compact
 
     def __call__(self, sample):
         image, label = sample['image'], sample['label']
@@ -125,6 +129,12 @@ class RandomGenerator(object):
         if x != self.output_size[0] or y != self.output_size[1]:
             image = zoom(image, (self.output_size[0] / x, self.output_size[1] / y,1), order=3)  # why not 3?
             label = zoom(label, (self.output_size[0] / x, self.output_size[1] / y), order=0)
+        if self.compact:
+            # the augmentations above already produce uint8, only the dtype of the label may differ; copied since an
+            # unaugmented packed sample is still a read-only view of the memory-mapped shard
+            image = torch.from_numpy(np.array(image, dtype=np.uint8, copy=True)).permute(2,0,1)
+            sample = {'image': image, 'label': torch.from_numpy(label.astype(np.uint8))}
+            return sample
         image = torch.from_numpy(image.astype(np.float32))   #.unsqueeze(0)
         image = image.permute(2,0,1)
         label = torch.from_numpy(label.astype(np.float32))
@@ -133,34 +143,96 @@ class RandomGenerator(object):
         return sample
 
 
+class PackedSamples(object):
+    '''
+    Reader for the shards written by utils/pack_dataset.py. Samples are uint8 views into np.memmap'ed image and label
+    shards, nothing is decompressed or copied. The shards are mapped on first access, i.e. inside each DataLoader
+    worker.
+    '''
+
+    def __init__(self, packed_dir, split):
+        self.image_path, self.label_path, index_path = get_packed_paths(packed_dir, split)
+        index = np.load(index_path)
+        self.names = [str(name) for name in index['names']]
+        self.image_offsets, self.image_shapes = index['image_offsets'], index['image_shapes']
+        self.label_offsets, self.label_shapes = index['label_offsets'], index['label_shapes']
+        self.images = self.labels = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def load(self, idx):
+        if self.images is None:
+            self.images = np.memmap(self.image_path, dtype=np.uint8, mode='r')
+            self.labels = np.memmap(self.label_path, dtype=np.uint8, mode='r')
+        image_shape, label_shape = self.image_shapes[idx], self.label_shapes[idx]
+        image_start, label_start = self.image_offsets[idx], self.label_offsets[idx]
+        image = self.images[image_start:image_start + np.prod(image_shape)].reshape(image_shape)
+        label = self.labels[label_start:label_start + np.prod(label_shape)].reshape(label_shape)
+        return image, label
+
+
+def build_sample(image, label, case_name, split, transform=None, compact=False):
+    # the sample dict of a decoded (H, W, 3) image and (H, W) label, shared by GetDatasets and StreamingDataset:
+    # validation splits are converted to tensors here, the train split is left to the transform (RandomGenerator)
+    if split != "train" and compact:
+        image = torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1), dtype=np.uint8))
+        label = torch.from_numpy(label.astype(np.uint8))
+    elif split != "train":
+        image = torch.from_numpy(image.astype(np.float32))
+        image = image.permute(2,0,1)
+        label = torch.from_numpy(label.astype(np.float32))
+
+
+    sample = {'image': image, 'label': label}
+    if transform:
+        sample = transform(sample)
+    sample['case_name'] = case_name
+    return sample
+
+
 class GetDatasets(Dataset):
-    def __init__(self, base_dir, list_dir, split, transform=None):
+    def __init__(self, base_dir, list_dir, split, transform=None, backend='npz', packed_dir=None, compact=False,
+                 cache=None):
+        # backend 'npz' reads <base_dir>/<slice_name>.npz, backend 'packed' the shards of utils/pack_dataset.py
+        # in packed_dir (default base_dir)
+        # compact=True returns uint8 images/labels on the validation path instead of float32 (see RandomGenerator)
+        # cache: optional utils.sample_cache.SharedSampleCache of the decoded samples, shared by the workers
         self.transform = transform
+        self.cache = cache
         self.split = split
-        self.sample_list = open(os.path.join(list_dir, self.split+'.txt')).readlines()
+        self.compact = compact
         self.data_dir = base_dir
+        self.backend = backend
+        if backend == 'npz':
+            self.sample_list = open(os.path.join(list_dir, self.split+'.txt')).readlines()
+        elif backend == 'packed':
+            self.packed = PackedSamples(packed_dir or base_dir, self.split)
+            self.sample_list = self.packed.names
+        else:
+            raise ValueError(f"Unknown backend {backend}, expected 'npz' or 'packed'.")
 
     def __len__(self):
         return len(self.sample_list)
 
-    def __getitem__(self, idx):
-        if self.split == "train":
-            slice_name = self.sample_list[idx].strip('\n')
-            data_path = os.path.join(self.data_dir, slice_name+'.npz')
-            data = np.load(data_path)
-            image, label = data['image'], data['label']
-        else:
-            slice_name = self.sample_list[idx].strip('\n')
-            data_path = os.path.join(self.data_dir, slice_name+'.npz')
-            data = np.load(data_path)
-            image, label = data['image'], data['label']
-            image = torch.from_numpy(image.astype(np.float32))
-            image = image.permute(2,0,1)
-            label = torch.from_numpy(label.astype(np.float32))
-
-
-        sample = {'image': image, 'label': label}
-        if self.transform:
-            sample = self.transform(sample)
-        sample['case_name'] = self.sample_list[idx].strip('\n')
+    def read_sample(self, idx):
+        if self.backend == 'packed':
+            return self.packed.load(idx)
+        slice_name = self.sample_list[idx].strip('\n')
+        data_path = os.path.join(self.data_dir, slice_name+'.npz')
+        data = np.load(data_path)
+        return data['image'], data['label']
+
+    def load_sample(self, idx):
+        if self.cache is None:
+            return self.read_sample(idx)
+        case_name = self.sample_list[idx].strip('\n')
+        sample = self.cache.get(case_name)
+        if sample is None:
+            sample = self.read_sample(idx)
+            self.cache.put(case_name, *sample)
         return sample
+
+    def __getitem__(self, idx):
+        image, label = self.load_sample(idx)
+        return build_sample(image, label, self.sample_list[idx].strip('\n'), self.split, self.transform, self.compact)
@@ -0,0 +1,99 @@
+"""Nucleus instances from the background / nucleus / edge output of CRNS_NET.
+
+Nucleus interiors (eroded) are the markers, the edge channel is the flooding cost: a marker-controlled watershed
+(scipy.ndimage.watershed_ift) splits touching nuclei along the predicted edges, and the instances are restricted to
+the predicted foreground (nucleus or edge).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from scipy import ndimage
+
+# class indices of ORGAN_NAME = ['back ground', 'cell nucleus', 'edge']
+BACKGROUND, NUCLEUS, EDGE = 0, 1, 2
+
+
+def as_numpy(output):
+    if hasattr(output, 'detach'):
+        return output.detach().float().cpu().numpy()
+    return output
+
+
+def decode_output(output, chunk_rows=1024):
+    '''
+    (class map, edge cost) as (H, W) uint8 arrays from (n_classes, H, W) logits, numpy or torch, including the
+    np.memmap of SlidingWindowInferer (processed ``chunk_rows`` rows at a time), or from an (H, W) class map. The
+    cost is the softmax probability of the edge class scaled to 0..255 (255 on edge pixels of a class map).
+    '''
+    output = as_numpy(output)
+    if output.ndim == 2:
+        class_map = output.astype(np.uint8, copy=False)
+        return class_map, np.where(class_map == EDGE, 255, 0).astype(np.uint8)
+    H, W = output.shape[1:]
+    class_map = np.empty((H, W), np.uint8)
+    cost = np.empty((H, W), np.uint8)
+    for r0 in range(0, H, chunk_rows):
+        logits = np.asarray(output[:, r0:r0 + chunk_rows], dtype=np.float32)
+        class_map[r0:r0 + chunk_rows] = logits.argmax(0)
+        probs = np.exp(logits - logits.max(0, keepdims=True))
+        cost[r0:r0 + chunk_rows] = np.rint(probs[EDGE] / probs.sum(0) * 255)
+    return class_map, cost
+
+
+def extract_instances(output, min_size=10, marker_erosion=1):
+    '''
+    (H, W) int32 instance map (0 background, 1..n nuclei) of one output, see decode_output for the accepted inputs.
+    ``marker_erosion`` erodes the nucleus interiors before labelling them, which splits markers of nuclei that touch
+    without a predicted edge; instances smaller than ``min_size`` pixels are dropped and the rest relabelled 1..n.
+    '''
+    return watershed_instances(*decode_output(output), min_size=min_size, marker_erosion=marker_erosion)
+
+
+def watershed_instances(class_map, cost, min_size=10, marker_erosion=1):
+    # extract_instances on decoded (class map, edge cost) arrays. Every background pixel is a marker of one extra
+    # label costlier than any foreground pixel, so each marker floods only its own foreground component, and the
+    # foreground components left without a marker by the erosion (thin nuclei, edge-only rings) become instances
+    # of their own: every instance is a single connected component.
+    background = class_map == BACKGROUND
+    components, n_components = ndimage.label(~background, output=np.int32)
+    if n_components == 0:
+        return np.zeros(class_map.shape, np.int32)
+    interior = class_map == NUCLEUS
+    if marker_erosion > 0:
+        interior = ndimage.binary_erosion(interior, iterations=marker_erosion)
+    markers, n = ndimage.label(interior, output=np.int32)
+
+    marked = np.zeros(n_components + 1, bool)
+    marked[components[markers > 0]] = True
+    unmarked = np.flatnonzero(~marked[1:]) + 1
+    component_markers = np.zeros(n_components + 1, np.int32)
+    component_markers[unmarked] = np.arange(n + 1, n + 1 + len(unmarked), dtype=np.int32)
+    markers = np.where(markers > 0, markers, component_markers[components])
+    n += len(unmarked)
+    markers[background] = n + 1
+
+    cost = cost.astype(np.uint16)
+    cost[background] = 256
+    labels = ndimage.watershed_ift(cost, markers)
+
+    sizes = np.bincount(labels.ravel(), minlength=n + 2)
+    keep = sizes >= min_size
+    keep[0] = keep[n + 1] = False
+    relabel = np.zeros(n + 2, np.int32)
+    relabel[keep] = np.arange(1, keep.sum() + 1, dtype=np.int32)
+    return relabel[labels]
+
+
+def extract_instances_batch(outputs, num_workers=None, **kwargs):
+    '''
+    Instance maps of a batch: (B, n_classes, H, W) logits, (B, H, W) class maps or a list of per-image outputs.
+    Images are spread over ``num_workers`` processes (default one per CPU, 0 or 1 runs in this process);
+    ``kwargs`` go to extract_instances.
+    '''
+    outputs = [as_numpy(output) for output in outputs]
+    extract = partial(extract_instances, **kwargs)
+    if (num_workers is not None and num_workers <= 1) or len(outputs) <= 1:
+        return [extract(output) for output in outputs]
+    with ProcessPoolExecutor(num_workers) as pool:
+        return list(pool.map(extract, outputs))
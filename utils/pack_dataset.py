@@ -0,0 +1,68 @@
+"""Pack a split of per-slice .npz files into one image shard, one label shard and an offset index.
+
+    python -m utils.pack_dataset --base-dir data/MoNuSeg/train_npz --list-dir lists/MoNuSeg --split train \
+        --out-dir data/MoNuSeg/packed
+
+writes <out-dir>/<split>_images.u8, <split>_labels.u8 and <split>_index.npz, which GetDatasets(backend='packed')
+reads through np.memmap.
+"""
+import argparse
+import os
+
+import numpy as np
+
+
+def get_packed_paths(packed_dir, split):
+    return (os.path.join(packed_dir, split + '_images.u8'),
+            os.path.join(packed_dir, split + '_labels.u8'),
+            os.path.join(packed_dir, split + '_index.npz'))
+
+
+def to_uint8(array, name):
+    if array.dtype == np.uint8:
+        return array
+    if array.min() < 0 or array.max() > 255 or not np.array_equal(array, np.round(array)):
+        raise ValueError(f"{name} ({array.dtype}) has values that are not representable as uint8")
+    return array.astype(np.uint8)
+
+
+def pack_split(base_dir, list_dir, split, out_dir):
+    sample_list = [line.strip('\n') for line in open(os.path.join(list_dir, split + '.txt')) if line.strip()]
+    os.makedirs(out_dir, exist_ok=True)
+    image_path, label_path, index_path = get_packed_paths(out_dir, split)
+
+    image_offsets, image_shapes, label_offsets, label_shapes = [], [], [], []
+    image_offset = label_offset = 0
+    with open(image_path, 'wb') as image_file, open(label_path, 'wb') as label_file:
+        for slice_name in sample_list:
+            data = np.load(os.path.join(base_dir, slice_name + '.npz'))
+            image = np.ascontiguousarray(to_uint8(data['image'], slice_name + ' image'))
+            label = np.ascontiguousarray(to_uint8(data['label'], slice_name + ' label'))
+            image_file.write(image.tobytes())
+            label_file.write(label.tobytes())
+            image_offsets.append(image_offset)
+            image_shapes.append(image.shape)
+            label_offsets.append(label_offset)
+            label_shapes.append(label.shape)
+            image_offset += image.nbytes
+            label_offset += label.nbytes
+
+    np.savez(index_path, names=np.array(sample_list), image_offsets=np.array(image_offsets, dtype=np.int64),
+             image_shapes=np.array(image_shapes, dtype=np.int64), label_offsets=np.array(label_offsets, dtype=np.int64),
+             label_shapes=np.array(label_shapes, dtype=np.int64))
+    return image_path, label_path, index_path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-dir', required=True, help='directory with the <slice_name>.npz files')
+    parser.add_argument('--list-dir', required=True, help='directory with <split>.txt')
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--out-dir', required=True)
+    args = parser.parse_args()
+    for path in pack_split(args.base_dir, args.list_dir, args.split, args.out_dir):
+        print(path, os.path.getsize(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Persistent store of prompt text embeddings for CRNS_NET.
+
+    python -m utils.prompt_store --prompts 'A computerized tomography of a cell nucleus' ...
+
+Embeddings are kept in one torch file as {encoder: {prompt: embedding}}, so the same store can hold the prompts of
+several text encoders. Reading the store only needs torch; the CLIP package is imported when missing prompts are
+encoded, and then only the text tower of the checkpoint is kept.
+"""
+import argparse
+import os
+
+import torch
+import torch.nn as nn
+
+DEFAULT_STORE = 'pretrained_ckpt/prompt_embeddings.pth'
+# CRNS_NET's text branch takes 768-d prompt embeddings, the width of the ViT-L/14 text tower
+DEFAULT_ENCODER = 'clip:ViT-L/14'
+
+CLIP_TEXT_KEYS = ('positional_embedding', 'text_projection', 'token_embedding.', 'ln_final.', 'transformer.')
+
+
+class CLIPTextEncoder(nn.Module):
+    '''CLIP's text tower on its own, the computation of ``clip.model.CLIP.encode_text``.'''
+
+    def __init__(self, embed_dim, context_length, vocab_size, width, heads, layers):
+        super().__init__()
+        from clip.model import LayerNorm, Transformer
+
+        self.context_length = context_length
+        mask = torch.empty(context_length, context_length).fill_(float('-inf')).triu_(1)
+        self.transformer = Transformer(width=width, layers=layers, heads=heads, attn_mask=mask)
+        self.token_embedding = nn.Embedding(vocab_size, width)
+        self.positional_embedding = nn.Parameter(torch.empty(context_length, width))
+        self.ln_final = LayerNorm(width)
+        self.text_projection = nn.Parameter(torch.empty(width, embed_dim))
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        # same shape inference as clip.model.build_model, restricted to the text weights
+        state_dict = {k: v for k, v in state_dict.items() if k.startswith(CLIP_TEXT_KEYS)}
+        width = state_dict['ln_final.weight'].shape[0]
+        layers = len(set(k.split('.')[2] for k in state_dict if k.startswith('transformer.resblocks')))
+        model = cls(embed_dim=state_dict['text_projection'].shape[1],
+                    context_length=state_dict['positional_embedding'].shape[0],
+                    vocab_size=state_dict['token_embedding.weight'].shape[0],
+                    width=width, heads=width // 64, layers=layers)
+        model.load_state_dict({k: v.float() for k, v in state_dict.items()})
+        return model.eval()
+
+    def forward(self, text):
+        x = self.token_embedding(text) + self.positional_embedding
+        x = self.transformer(x.permute(1, 0, 2)).permute(1, 0, 2)
+        x = self.ln_final(x)
+        # features of the eot token, the highest id of each sequence
+        return x[torch.arange(x.shape[0]), text.argmax(dim=-1)] @ self.text_projection
+
+
+def load_clip_text_encoder(name='ViT-L/14', device='cpu', download_root=None):
+    # ``name`` is one of clip.available_models() or a checkpoint path; clip.load downloads and checks the weights,
+    # only the text tower is kept
+    import clip
+
+    model, _ = clip.load(name, device='cpu', jit=False, download_root=download_root)
+    return CLIPTextEncoder.from_state_dict(model.state_dict()).to(device)
+
+
+class PromptEmbeddingStore(object):
+    '''
+    Prompt text -> embedding map backed by a torch file, keyed by encoder identity (e.g. 'clip:ViT-L/14'):
+
+        store = PromptEmbeddingStore()
+        store.populate(prompts)              # encodes only the prompts not stored yet, then saves
+        embeddings = store.get(prompts)      # (len(prompts), dim) float32, no CLIP import
+
+    Embeddings are stored as float32 on the CPU.
+    '''
+
+    def __init__(self, path=DEFAULT_STORE):
+        self.path = path
+        self.embeddings = torch.load(path, map_location='cpu') if os.path.exists(path) else {}
+
+    def missing(self, prompts, encoder=DEFAULT_ENCODER):
+        stored = self.embeddings.get(encoder, {})
+        return [prompt for prompt in dict.fromkeys(prompts) if prompt not in stored]
+
+    def __contains__(self, prompt):
+        return any(prompt in stored for stored in self.embeddings.values())
+
+    def get(self, prompts, encoder=DEFAULT_ENCODER):
+        missing = self.missing(prompts, encoder)
+        if missing:
+            raise KeyError(f"{len(missing)} prompt(s) have no {encoder} embedding in {self.path}: {missing}. "
+                           f"Encode them with PromptEmbeddingStore.populate first.")
+        stored = self.embeddings[encoder]
+        return torch.stack([stored[prompt] for prompt in prompts])
+
+    def add(self, prompts, embeddings, encoder=DEFAULT_ENCODER):
+        if len(prompts) != len(embeddings):
+            raise ValueError(f"Got {len(prompts)} prompts and {len(embeddings)} embeddings.")
+        stored = self.embeddings.setdefault(encoder, {})
+        for prompt, embedding in zip(prompts, embeddings):
+            stored[prompt] = embedding.detach().float().cpu().clone()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # write-then-rename, so readers never see a partially written store
+        torch.save(self.embeddings, self.path + '.tmp')
+        os.replace(self.path + '.tmp', self.path)
+
+    @torch.no_grad()
+    def populate(self, prompts, encoder=DEFAULT_ENCODER, batch_size=64, device=None, save=True):
+        missing = self.missing(prompts, encoder)
+        if missing:
+            kind, name = encoder.split(':', 1)
+            if kind != 'clip':
+                raise ValueError(f"Unknown encoder {encoder}, expected 'clip:<model name>'.")
+            import clip
+
+            device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+            text_encoder = load_clip_text_encoder(name, device)
+            for first in range(0, len(missing), batch_size):
+                batch = missing[first:first + batch_size]
+                self.add(batch, text_encoder(clip.tokenize(batch).to(device)), encoder)
+            if save:
+                self.save()
+        return self.get(prompts, encoder)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--prompts', nargs='+', required=True)
+    parser.add_argument('--store', default=DEFAULT_STORE)
+    parser.add_argument('--encoder', default=DEFAULT_ENCODER)
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+    embeddings = PromptEmbeddingStore(args.store).populate(args.prompts, args.encoder, args.batch_size)
+    print(args.store, tuple(embeddings.shape), embeddings.dtype)
+
+
+if __name__ == '__main__':
+    main()
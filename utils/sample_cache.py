@@ -0,0 +1,159 @@
+import atexit
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker
+except ImportError:
+    resource_tracker = None
+
+
+def untrack(segment):
+    # Segments outlive the worker that created or attached them: only SharedSampleCache unlinks them, the resource
+    # tracker must not do it (or warn about "leaked" segments) when a worker exits.
+    if resource_tracker is not None:
+        try:
+            resource_tracker.unregister(segment._name, 'shared_memory')
+        except Exception:
+            pass
+
+
+class SharedSampleCache(object):
+    '''
+    Decoded (image, label) samples in shared memory, keyed by case name, shared by the DataLoader workers of one
+    training process and kept across epochs. Each sample lives in its own shared memory segment; once the cached
+    bytes would exceed ``max_bytes`` the least recently used samples are evicted, in one batch down to
+    ``low_water * max_bytes`` so the index is only sorted once per batch rather than on every later insertion. The
+    index sits in a multiprocessing.Manager dict (one IPC round trip per lookup, small next to opening and
+    decompressing an .npz).
+
+        cache = SharedSampleCache(max_bytes=8 * 2 ** 30)
+        dataset = GetDatasets(..., cache=cache)
+        ...
+        print(cache.stats())   # hits / misses / evictions / bytes, from any process
+
+    Create it in the main process before the DataLoader starts its workers, and ``close()`` it (also done at
+    exit of the creating process) to release the segments.
+    '''
+
+    def __init__(self, max_bytes, manager=None, low_water=0.9):
+        if not 0 <= low_water <= 1:
+            raise ValueError(f"low_water must be in [0, 1], got {low_water}.")
+        self.max_bytes = int(max_bytes)
+        self.low_water_bytes = int(low_water * self.max_bytes)
+        self.manager = manager or mp.Manager()
+        # case name -> (segment name, nbytes, (image dtype, image shape), (label dtype, label shape), last use)
+        self.index = self.manager.dict()
+        self.lock = mp.Lock()
+        self.counters = {name: mp.Value('q', 0, lock=False)
+                         for name in ['hits', 'misses', 'evictions', 'bytes', 'tick']}
+        self.owner = mp.current_process().name
+        atexit.register(self.close)
+
+    def __getstate__(self):
+        # the Manager only lives in the creating process, workers use the proxies
+        state = self.__dict__.copy()
+        state['manager'] = None
+        return state
+
+    def next_tick(self):
+        self.counters['tick'].value += 1
+        return self.counters['tick'].value
+
+    def get(self, key):
+        '''Copy of the cached (image, label) of ``key``, or None.'''
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                self.counters['misses'].value += 1
+                return None
+            self.index[key] = entry[:4] + (self.next_tick(),)
+            self.counters['hits'].value += 1
+        segment_name, _, (image_dtype, image_shape), (label_dtype, label_shape), _ = entry
+        try:
+            segment = shared_memory.SharedMemory(segment_name)
+        except FileNotFoundError:
+            # evicted by another worker between the lookup and here
+            with self.lock:
+                self.counters['hits'].value -= 1
+                self.counters['misses'].value += 1
+            return None
+        untrack(segment)
+        try:
+            image = np.ndarray(image_shape, image_dtype, segment.buf).copy()
+            label = np.ndarray(label_shape, label_dtype, segment.buf, offset=image.nbytes).copy()
+        finally:
+            segment.close()
+        return image, label
+
+    def put(self, key, image, label):
+        image, label = np.ascontiguousarray(image), np.ascontiguousarray(label)
+        nbytes = image.nbytes + label.nbytes
+        if nbytes > self.max_bytes:
+            return
+        segment = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        untrack(segment)
+        np.ndarray(image.shape, image.dtype, segment.buf)[...] = image
+        np.ndarray(label.shape, label.dtype, segment.buf, offset=image.nbytes)[...] = label
+        with self.lock:
+            if key in self.index:
+                stored = False
+            else:
+                if self.counters['bytes'].value + nbytes > self.max_bytes:
+                    self.evict(self.low_water_bytes - nbytes)
+                self.index[key] = (segment.name, nbytes, (image.dtype.str, image.shape),
+                                   (label.dtype.str, label.shape), self.next_tick())
+                self.counters['bytes'].value += nbytes
+                stored = True
+        segment.close()
+        if not stored:
+            # another worker cached the same sample first
+            self.unlink(segment.name)
+
+    def evict(self, budget):
+        # under the lock: drop least recently used samples until at most ``budget`` bytes are cached, the index is
+        # fetched and sorted once for the whole batch
+        if self.counters['bytes'].value <= budget:
+            return
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1][4]):
+            self.unlink(self.index.pop(key)[0])
+            self.counters['bytes'].value -= entry[1]
+            self.counters['evictions'].value += 1
+            if self.counters['bytes'].value <= budget:
+                break
+
+    @staticmethod
+    def unlink(segment_name):
+        # attaching registers the segment with the resource tracker again, unlink() unregisters it
+        try:
+            segment = shared_memory.SharedMemory(segment_name)
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
+
+    def stats(self):
+        with self.lock:
+            stats = {name: self.counters[name].value for name in ['hits', 'misses', 'evictions', 'bytes']}
+            stats['samples'] = len(self.index)
+        stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.
+        return stats
+
+    def close(self):
+        # releases every segment, only in the creating process (workers exit without touching the cache)
+        if self.manager is None or mp.current_process().name != self.owner:
+            return
+        try:
+            with self.lock:
+                for entry in self.index.values():
+                    self.unlink(entry[0])
+                self.index.clear()
+                self.counters['bytes'].value = 0
+            self.manager.shutdown()
+        except (OSError, EOFError, BrokenPipeError):
+            pass
+        self.manager = None
@@ -0,0 +1,197 @@
+import io
+import itertools
+import os
+import random
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from utils.get_datasets import build_sample
+
+
+def iter_tar_members(path):
+    # (case name, path, data offset, size) of the .npz members of an uncompressed tar shard, read header by header
+    with tarfile.open(path, 'r:') as tar:
+        for member in tar:
+            if member.isfile() and member.name.endswith('.npz'):
+                yield os.path.splitext(member.name)[0], path, member.offset_data, member.size
+
+
+def iter_sources(source):
+    '''
+    Paths of the .npz files and .tar shards of ``source``: a directory is walked one directory at a time, the files
+    of each in sorted order before its sorted subdirectories, so every worker, rank and node deals the same list;
+    a list of paths is taken in order. The collection is not listed up front and no shard is opened.
+    '''
+    pending = deque([source] if isinstance(source, (str, os.PathLike)) else source)
+    while pending:
+        path = os.fspath(pending.popleft())
+        if os.path.isdir(path):
+            with os.scandir(path) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+            for entry in entries:
+                if not entry.is_dir() and entry.name.endswith(('.npz', '.tar')):
+                    yield entry.path
+            pending.extendleft(reversed([entry.path for entry in entries if entry.is_dir()]))
+        else:
+            yield path
+
+
+def iter_samples(path):
+    # (case name, path, offset, size) of the samples of one .npz file or .tar shard
+    if path.endswith('.tar'):
+        yield from iter_tar_members(path)
+    else:
+        yield os.path.splitext(os.path.basename(path))[0], path, 0, None
+
+
+def iter_collection(source, consumer=0, consumers=1):
+    '''
+    (case name, path, offset, size) of the samples of ``source`` read by ``consumer`` of ``consumers``: files and
+    shards are dealt round-robin as a whole, so each shard is opened and its headers read by one consumer only.
+    '''
+    for path in itertools.islice(iter_sources(source), consumer, None, consumers):
+        yield from iter_samples(path)
+
+
+def count_samples(source):
+    # reads every shard's headers once, e.g. to choose StreamingDataset(samples_per_rank=count // world_size)
+    return sum(1 for _ in iter_collection(source))
+
+
+def get_quotas(counts, total):
+    '''
+    Samples per consumer of one rank evened out to ``total``: consumers keep their own ``counts`` (every sample once)
+    and the tail beyond ``total`` is dropped from the last consumers, or the missing samples are padded round-robin
+    by the consumers that have any.
+    '''
+    quotas = list(counts)
+    excess = sum(counts) - total
+    for i in reversed(range(len(quotas))):
+        if excess <= 0:
+            break
+        cut = min(quotas[i], excess)
+        quotas[i] -= cut
+        excess -= cut
+    if excess < 0:
+        padding = [i for i, count in enumerate(counts) if count]
+        if not padding:
+            raise RuntimeError(f"No .npz file or .tar shard to pad {total} samples from.")
+        for i in range(-excess):
+            quotas[padding[i % len(padding)]] += 1
+    return quotas
+
+
+def read_sample(path, offset, size):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = np.load(io.BytesIO(f.read(size if size is not None else -1)))
+        return data['image'], data['label']
+
+
+class StreamingDataset(IterableDataset):
+    '''
+    Streaming counterpart of GetDatasets for large tile collections: ``source`` is a directory (walked lazily,
+    .npz files and uncompressed .tar shards of .npz members) or a list of .npz / .tar paths, so start-up does not
+    depend on the size of the collection and no split list is needed. Samples go through the same path as
+    GetDatasets (``split``, ``transform`` e.g. RandomGenerator, ``compact``).
+
+    The .npz files and whole .tar shards are dealt round-robin to the DataLoader workers of every rank
+    (torch.distributed when initialized, or ``rank`` / ``world_size``), so use at least as many shards as workers
+    times ranks. Uneven shards give the ranks different sample counts, which stalls DDP at the end of an epoch:
+    ``samples_per_rank`` (e.g. count_samples(source) // world_size) makes every rank yield exactly that many. The
+    samples of every file and shard are then counted once at construction; each worker yields each of its samples
+    once, and only the rank's total is evened out, by dropping its tail or padding with its first samples.
+    Reading and decoding run on a pool of ``num_threads`` threads with at most ``prefetch`` samples in flight per
+    worker. ``shuffle_buffer`` > 0 shuffles within a window of that many samples, with a seed that changes with
+    set_epoch.
+    '''
+
+    def __init__(self, source, split, transform=None, compact=False, num_threads=4, prefetch=16, shuffle_buffer=0,
+                 seed=0, rank=None, world_size=None, samples_per_rank=None):
+        self.source = source
+        self.split = split
+        self.transform = transform
+        self.compact = compact
+        self.num_threads = num_threads
+        self.prefetch = max(prefetch, 1)
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+        self.rank = rank
+        self.world_size = world_size
+        self.samples_per_rank = samples_per_rank
+        # (path, number of samples) of every file and shard, in dealing order
+        self.source_counts = None
+        if samples_per_rank is not None:
+            self.source_counts = [(path, sum(1 for _ in iter_samples(path))) for path in iter_sources(source)]
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def get_consumer(self):
+        # (index, count) of this DataLoader worker among all workers of all ranks, and its share of samples_per_rank
+        rank, world_size = self.rank, self.world_size
+        if rank is None or world_size is None:
+            distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+            rank = torch.distributed.get_rank() if distributed else 0
+            world_size = torch.distributed.get_world_size() if distributed else 1
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        consumer, consumers = rank * num_workers + worker_id, world_size * num_workers
+        quota = None
+        if self.samples_per_rank is not None:
+            first = rank * num_workers
+            counts = [sum(count for _, count in self.source_counts[first + i::consumers]) for i in range(num_workers)]
+            quota = get_quotas(counts, self.samples_per_rank)[worker_id]
+        return consumer, consumers, quota
+
+    def evened(self, consumer, consumers, quota):
+        # exactly ``quota`` samples: the consumer's own stream, cut or repeated from its start
+        paths = [path for path, _ in self.source_counts[consumer::consumers]]
+        count = 0
+        while count < quota:
+            for path in paths:
+                for item in iter_samples(path):
+                    if count == quota:
+                        return
+                    yield item
+                    count += 1
+
+    def shuffled(self, items, consumer):
+        rng = random.Random(f'{self.seed}/{self.epoch}/{consumer}')
+        buffer = []
+        for item in items:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(item)
+                continue
+            i = rng.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = item
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        consumer, consumers, quota = self.get_consumer()
+        if quota is None:
+            items = iter_collection(self.source, consumer, consumers)
+        else:
+            items = self.evened(consumer, consumers, quota)
+        if self.shuffle_buffer > 0:
+            items = self.shuffled(items, consumer)
+        with ThreadPoolExecutor(self.num_threads) as pool:
+            pending = deque()
+            for case_name, path, offset, size in items:
+                pending.append((case_name, pool.submit(read_sample, path, offset, size)))
+                if len(pending) >= self.prefetch:
+                    yield self.build(*pending.popleft())
+            while pending:
+                yield self.build(*pending.popleft())
+
+    def build(self, case_name, future):
+        image, label = future.result()
+        return build_sample(image, label, case_name, self.split, self.transform, self.compact)